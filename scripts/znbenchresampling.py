@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""
+ZORRO-N - Meteorological Time Series DataBase Engine
+Copyright (C) 2014 - Ernesto Castillo Navarrete
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+
+from optparse import OptionParser
+import sys
+import time
+
+parser = OptionParser()
+
+parser.add_option("-Y","--years",help="The length of the series in years",type="int",default=10)
+parser.add_option("-N","--number-series",help="The number of series sharing the time index",type="int",default=4)
+parser.add_option("-S","--statistic",help="The resampling statistic",default='mean')
+parser.add_option("-U","--units",help="The units of the resampling interval",type="int",default=1)
+parser.add_option("-C","--code",help="The code of the resampling interval (Min,H,D,MS)",default='D')
+parser.add_option("-F","--minimum-fraction",help="The minimum fraction of valid values",type="float",default=75.0)
+parser.add_option("-G","--gaps",help="The fraction of missing values",type="float",default=0.2)
+parser.add_option("-R","--repetitions",help="The number of repetitions",type="int",default=3)
+
+(options,args) = parser.parse_args()
+
+import numpy
+import pandas
+import zorron.util as util
+from zorron.resampling import ZNResampler
+
+#10-minute series with missing values
+numberRows = options.years * 365 * 144
+indexArray = pandas.date_range( '2000-01-01', periods=numberRows, freq='10Min' )
+valuesArray = numpy.random.randn( numberRows, options.number_series )
+valuesArray[ numpy.random.rand( numberRows, options.number_series ) < options.gaps ] = numpy.nan
+blockData = pandas.DataFrame( valuesArray, index=indexArray )
+
+resampler = ZNResampler()
+statistic = { 'name' : options.statistic }
+resamplingFunction = util.parseStatisticFunction( statistic )
+timeInterval = { 'units' : options.units, 'code' : options.code }
+timeIntervalString = '%d%s' % ( options.units, options.code )
+
+def resampleSeries():
+
+	#one resampling for the statistic and another for the fraction of every series
+	columns = []
+	for column in blockData.columns:
+		seriesData = blockData[column]
+		resampledSeries = seriesData.resample( timeIntervalString, how=resamplingFunction )
+		fractionSeries = seriesData.resample( timeIntervalString, how=util.parseStatisticFunction( { 'name' : 'fraction' } ) )
+		columns.append( resampledSeries.where( ~( fractionSeries < options.minimum_fraction ) ) )
+	return pandas.concat( columns, axis=1 )
+
+def resampleKernel():
+
+	return resampler._resampleKernel( blockData, statistic, timeInterval, options.minimum_fraction )
+
+def measure(function):
+
+	times = []
+	for i in range(options.repetitions):
+		startTime = time.time()
+		result = function()
+		times.append( time.time() - startTime )
+	return min(times), result
+
+seriesTime, seriesResult = measure( resampleSeries )
+kernelTime, kernelResult = measure( resampleKernel )
+
+if kernelResult is None:
+	sys.stdout.write( 'interval %s is resampled with pandas\n' % ( timeIntervalString ) )
+	sys.exit(1)
+
+equal = seriesResult.index.equals( kernelResult.index ) and numpy.allclose( seriesResult.values.astype(numpy.float64), kernelResult.values.astype(numpy.float64), equal_nan=True )
+
+sys.stdout.write( 'rows: %d, series: %d, statistic: %s, interval: %s\n' % ( numberRows, options.number_series, options.statistic, timeIntervalString ) )
+sys.stdout.write( 'per series: %.3f s\n' % ( seriesTime ) )
+sys.stdout.write( 'one pass:   %.3f s\n' % ( kernelTime ) )
+sys.stdout.write( 'speedup:    %.1fx\n' % ( seriesTime / max( kernelTime, 1e-9 ) ) )
+sys.stdout.write( 'same values: %s\n' % ( equal ) )
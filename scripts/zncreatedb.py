@@ -28,6 +28,7 @@ parser = OptionParser()
 parser.add_option("-M","--metadata-file",help="The database metadata file")
 parser.add_option("-I","--input-directory",help="The input data directory")
 parser.add_option("-O","--output-directory",help="The output directory")
+parser.add_option("-E","--storage-engine",help="The storage engine of the database (pytables or column)",default="pytables")
 
 (options,args) = parser.parse_args()
 
@@ -50,7 +51,7 @@ def createTable( metaDataLoader, parser, manager, dataBase, inputDirectoryPath,
 
 metaDataLoader 	= ZNMetaDataLoader()
 parser	       	= ZNCSVParser()
-manager		= ZNDefaultManager() 
+manager		= ZNDefaultManager( configuration = { 'storageEngine' : options.storage_engine } ) 
 
 try:
 	metaData = metaDataLoader.loadFile(options.metadata_file)
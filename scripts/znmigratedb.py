@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""
+ZORRO-N - Meteorological Time Series DataBase Engine
+Copyright (C) 2014 - Ernesto Castillo Navarrete
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+
+from optparse import OptionParser
+import sys
+
+parser = OptionParser()
+
+parser.add_option("-D","--database-directory",help="The directory where database is located")
+parser.add_option("-C","--codec",help="The compression codec (blosc, zlib or lzf)",default=None)
+parser.add_option("-L","--level",help="The compression level (5 when never set)",type="int",default=None)
+parser.add_option("-K","--chunk-size",help="The chunk size in rows",type="int",default=None)
+parser.add_option("-R","--partition",help="The partition period of the tables (year or month)",default=None)
+
+(options,args) = parser.parse_args()
+
+import os
+import json
+import time
+
+from zorron.metadata import ZNMetaDataLoader
+from zorron.storage import ZNPyTablesStorageEngine
+
+metaDataLoader = ZNMetaDataLoader()
+storageEngine  = ZNPyTablesStorageEngine()
+
+try:
+	rootDirectory = os.path.abspath( options.database_directory )
+
+	metaDataPath = os.path.join( rootDirectory, 'metadata.json' )
+	metaData = metaDataLoader.loadFile( metaDataPath )
+
+	#storage layout, options not given keep their stored value
+	parameters = dict( metaData.get( 'storage', None ) or {} )
+	if options.codec is not None:
+		parameters['codec'] = options.codec
+	if options.level is not None:
+		parameters['level'] = options.level
+	if options.chunk_size is not None:
+		parameters['chunkSize'] = options.chunk_size
+	if options.partition is not None:
+		parameters['partition'] = options.partition
+
+	#checked before it is kept in the database metadata for new tables
+	storage = storageEngine.createStorage( parameters )
+
+	metaData['storage'] = parameters
+	outputFile = open( metaDataPath, 'w' )
+	json.dump( metaData, outputFile, indent=4 )
+	outputFile.close()
+
+	totalTime = 0
+	for fileName in os.listdir( rootDirectory ):
+
+		tableDirectory = os.path.join( rootDirectory, fileName )
+		if not os.path.isdir( tableDirectory ):
+			continue
+
+		tableMetaData = metaDataLoader.loadFile( os.path.join( tableDirectory, 'metadata.js' ) )
+		tableCode = tableMetaData['code']
+		dataPath = os.path.join( tableDirectory, 'data.h5f' )
+
+		start = time.time()
+		sizeBefore = os.path.getsize( dataPath )
+		storageEngine.loadTableStorage( storage, tableCode, tableDirectory )
+		storageEngine.rewriteTable( storage, tableCode )
+		storageEngine.removeTable( storage, tableCode )
+		sizeAfter = os.path.getsize( dataPath )
+		deltaTime = time.time() - start
+
+		print "%s : %d -> %d bytes ( %.3f s )" % ( tableCode, sizeBefore, sizeAfter, deltaTime )
+		totalTime = totalTime + deltaTime
+
+	print totalTime
+
+except:
+	raise
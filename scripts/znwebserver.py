@@ -22,6 +22,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import sys
 import os
 import datetime
+import json
 from optparse import OptionParser
 from apscheduler.scheduler import Scheduler
 import cherrypy
@@ -37,6 +38,23 @@ parser.add_option("-P","--port",help="The port to listen",default=1069)
 parser.add_option("-D","--database-directory",help="The directory where database is located")
 parser.add_option("-R","--root-directory",help="The directory where the web site is located")
 parser.add_option("-T","--temporary-directory",help="The directory where the temporary output files will be created",default="/tmp")
+parser.add_option("-L","--lazy-loading",help="Load table data on first use instead of at startup",action="store_true",default=False)
+parser.add_option("-M","--memory-budget",help="The memory budget in megabytes for lazily loaded tables",type="float",default=None)
+parser.add_option("-W","--loading-workers",help="The number of processes used to load tables at startup",type="int",default=1)
+parser.add_option("-Z","--snapshot",help="Load the database from its snapshot file when it is up to date",action="store_true",default=False)
+parser.add_option("-E","--storage-engine",help="The storage engine of the database (pytables or column)",default="pytables")
+parser.add_option("-U","--update-workers",help="The number of threads used by batch table updates",type="int",default=1)
+parser.add_option("-A","--write-ahead-log",help="Record updates in a log and compact them into storage in the background",action="store_true",default=False)
+parser.add_option("-C","--compaction-interval",help="The time in seconds between log compactions",type="float",default=300)
+parser.add_option("-N","--processors",help="The number of threads serving requests concurrently",type="int",default=4)
+parser.add_option("-Q","--queue-size",help="The maximum number of queued requests and updates",type="int",default=64)
+parser.add_option("-O","--queue-timeout",help="The time in seconds to wait for a free queue slot before failing",type="float",default=None)
+parser.add_option("-K","--result-cache-size",help="The number of request answers kept in cache, 0 disables the cache",type="int",default=0)
+parser.add_option("-F","--output-cache-size",help="The number of formatted outputs kept in cache, 0 disables the cache",type="int",default=0)
+parser.add_option("-G","--output-cache-time",help="The time in seconds a cached excel file is reused, lower than the file removal interval",type="float",default=3600)
+parser.add_option("-B","--rollups",help="Maintain daily and monthly aggregates of the tables to answer resampling requests",action="store_true",default=False)
+parser.add_option("-X","--sketch-accuracy",help="The relative accuracy of the monthly quantile sketches kept with the rollups, none by default",type="float",default=None)
+parser.add_option("-Y","--histogram-layouts",help="The fixed histogram bins counted with the rollups by variable type, and the wind rose bins under windRose, as json: {\"vels\": {\"min\": 0, \"max\": 40, \"bins\": 40}, \"windRose\": {\"directionBins\": 16, \"velocityBins\": 10, \"velocityMin\": 0, \"velocityMax\": 25}}",default=None)
 
 (options,args) = parser.parse_args()
 
@@ -51,6 +69,31 @@ timeInterval = datetime.timedelta(days=1)
 fileRemover = ZNFileRemover(options.temporary_directory,pattern,timeInterval)
 scheduler.add_interval_job( fileRemover.remove, days=1)
 
+#configuration
+histogramLayouts = None
+if options.histogram_layouts is not None:
+	histogramLayouts = json.loads( options.histogram_layouts )
+
+serverConfiguration = {
+			'lazyLoading' : options.lazy_loading,
+			'memoryBudget' : options.memory_budget,
+			'loadingWorkers' : options.loading_workers,
+			'snapshot' : options.snapshot,
+			'storageEngine' : options.storage_engine,
+			'updateWorkers' : options.update_workers,
+			'writeAheadLog' : options.write_ahead_log,
+			'compactionInterval' : options.compaction_interval,
+			'processors' : options.processors,
+			'queueSize' : options.queue_size,
+			'queueTimeout' : options.queue_timeout,
+			'resultCacheSize' : options.result_cache_size,
+			'outputCacheSize' : options.output_cache_size,
+			'outputCacheTime' : options.output_cache_time,
+			'rollups' : options.rollups,
+			'sketchAccuracy' : options.sketch_accuracy,
+			'histogramLayouts' : histogramLayouts
+		}
+
 #webserver
 configuration = { 
 			'/' : {	
@@ -64,5 +107,10 @@ configuration = {
 			}
 }
 
-znWebServer = ZNWebServer( options.database_directory , options.temporary_directory )
+znWebServer = ZNWebServer( options.database_directory , options.temporary_directory, serverConfiguration )
+
+#per-table load times
+for tableCode,loadTime in sorted( znWebServer.manager.getLoadTimes().items() ):
+	print "%s : %.3f s" % ( tableCode, loadTime )
+
 cherrypy.quickstart( znWebServer, config=configuration)
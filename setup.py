@@ -16,6 +16,7 @@ setup(
 	scripts = [  	'scripts/zncreatedb.py',
 			'scripts/zncreatetb.py',
 			'scripts/znupdatetb.py',
+			'scripts/znmigratedb.py',
 			'scripts/znserver.py',
 			'scripts/znwebserver.py',
 			'scripts/znrequest.py',
@@ -0,0 +1,439 @@
+"""
+ZORRO-N - Meteorological Time Series DataBase Engine
+Copyright (C) 2014 - Ernesto Castillo Navarrete
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import numpy
+
+import zorron.util as util
+
+from zorron.sketch import ZNQuantileSketch, createSketchLevel
+from zorron.histogram import ZNHistogramEngine
+
+DAY_SECONDS = 86400
+DAY = DAY_SECONDS * 10**9
+HOUR = 3600 * 10**9
+
+def monthStarts(timeArray):
+
+	#first nanosecond of the month of each timestamp
+	months = timeArray.astype('datetime64[ns]').astype('datetime64[M]')
+	return months.astype('datetime64[ns]').astype(numpy.int64)
+
+class ZNRollupLevel:
+
+	def __init__(self,times,count,total,minimum,maximum):
+
+		#one row per bin with data, bins are identified by their start
+		self.times	= times
+		self.count	= count
+		self.total	= total
+		self.minimum	= minimum
+		self.maximum	= maximum
+
+	def head(self,position):
+
+		return ZNRollupLevel(
+					self.times[:position],
+					self.count[:position],
+					self.total[:position],
+					self.minimum[:position],
+					self.maximum[:position]
+				)
+
+	def tail(self,position):
+
+		return ZNRollupLevel(
+					self.times[position:],
+					self.count[position:],
+					self.total[position:],
+					self.minimum[position:],
+					self.maximum[position:]
+				)
+
+	def append(self,level):
+
+		return ZNRollupLevel(
+					numpy.concatenate( ( self.times, level.times ) ),
+					numpy.concatenate( ( self.count, level.count ) ),
+					numpy.concatenate( ( self.total, level.total ) ),
+					numpy.concatenate( ( self.minimum, level.minimum ) ),
+					numpy.concatenate( ( self.maximum, level.maximum ) )
+				)
+
+class ZNCubeLevel:
+
+	def __init__(self,times,count,total,squares,minimum,maximum):
+
+		#one row per month with data, arrays are month x hour x column
+		self.times	= times
+		self.count	= count
+		self.total	= total
+		self.squares	= squares
+		self.minimum	= minimum
+		self.maximum	= maximum
+
+	def head(self,position):
+
+		return ZNCubeLevel(
+					self.times[:position],
+					self.count[:position],
+					self.total[:position],
+					self.squares[:position],
+					self.minimum[:position],
+					self.maximum[:position]
+				)
+
+	def append(self,level):
+
+		return ZNCubeLevel(
+					numpy.concatenate( ( self.times, level.times ) ),
+					numpy.concatenate( ( self.count, level.count ) ),
+					numpy.concatenate( ( self.total, level.total ) ),
+					numpy.concatenate( ( self.squares, level.squares ) ),
+					numpy.concatenate( ( self.minimum, level.minimum ) ),
+					numpy.concatenate( ( self.maximum, level.maximum ) )
+				)
+
+class ZNRollup:
+
+	def __init__(self,samplingFrequency,columns,valid=True):
+
+		#samplingFrequency in seconds, rows are on a grid of that step
+		self.samplingFrequency	= samplingFrequency
+		self.columns		= columns
+		self.valid		= valid
+		self.levels		= {}
+
+		#hourly accumulators of each month, for annual and daily cycles
+		self.cube		= None
+
+		#monthly quantile sketches, one level per column
+		self.sketch		= None
+		self.sketchLevels	= None
+
+		#monthly counts of fixed bin layouts, by column: ( layout, level )
+		self.histograms		= {}
+
+		#monthly direction x velocity counts of fixed wind rose layouts,
+		#by ( direction column, velocity column ): ( layout, level )
+		self.windRoses		= {}
+
+class ZNRollupEngine:
+
+	#daily and monthly bins, both closed left
+	codes = [ 'D', 'MS' ]
+
+	def __init__(self,sketchAccuracy=None):
+
+		#monthly quantile sketches of that relative accuracy, None to skip them
+		self.sketchAccuracy = sketchAccuracy
+		self.histogramEngine = ZNHistogramEngine()
+
+	def create(self,dataFrame,histogramLayouts=None,windRoseLayouts=None):
+
+		#histogramLayouts: { 'min', 'max', 'bins' } or None for each column
+		#windRoseLayouts: ( direction column, velocity column,
+		#	{ 'directionBins', 'velocityBins', 'velocityMin', 'velocityMax' } ) of each pair
+
+		if len(dataFrame) < 2:
+			return None
+
+		columns = [ '%s' % ( column ) for column in dataFrame.columns ]
+
+		#rollups answer exactly only for rows on a grid that divides a day
+		timeArray = dataFrame.index.asi8
+		samplingFrequency = util.findSamplingFrequency( dataFrame )
+		if not self._isAligned( timeArray, samplingFrequency ):
+			return ZNRollup( samplingFrequency, columns, False )
+
+		rollup = ZNRollup( samplingFrequency, columns )
+		rollup.levels['D']  = self._aggregateRows( timeArray, dataFrame.values )
+		rollup.levels['MS'] = self._aggregateDays( rollup.levels['D'] )
+		rollup.cube = self._cubeRows( timeArray, dataFrame.values )
+
+		if self.sketchAccuracy is not None:
+			rollup.sketch = ZNQuantileSketch( self.sketchAccuracy )
+			rollup.sketchLevels = self._sketchRows( rollup.sketch, timeArray, dataFrame.values )
+
+		if histogramLayouts is not None:
+			for column in range( len(histogramLayouts) ):
+				layout = histogramLayouts[column]
+				if layout is None:
+					continue
+				edges = self._getEdges( layout )
+				rollup.histograms[column] = ( layout, self.histogramEngine.countMonths( timeArray, dataFrame.values[:,column], edges ) )
+
+		if windRoseLayouts is not None:
+			for directionColumn,velocityColumn,layout in windRoseLayouts:
+				windRoseLevel = self._countWindRose( timeArray, dataFrame.values, directionColumn, velocityColumn, layout )
+				rollup.windRoses[ ( directionColumn, velocityColumn ) ] = ( layout, windRoseLevel )
+
+		return rollup
+
+	def update(self,rollup,dataFrame,firstTime,histogramLayouts=None,windRoseLayouts=None):
+
+		#a new rollup is returned, pinned views keep the previous one
+		if rollup is None:
+			return self.create( dataFrame, histogramLayouts, windRoseLayouts )
+		if not rollup.valid:
+			return rollup
+
+		timeArray = dataFrame.index.asi8
+		samplingFrequency = rollup.samplingFrequency
+		position = numpy.searchsorted( timeArray, firstTime, 'left' )
+		if not self._isAligned( timeArray[position:], samplingFrequency ):
+			return ZNRollup( samplingFrequency, rollup.columns, False )
+
+		newRollup = ZNRollup( samplingFrequency, rollup.columns )
+
+		#days from the first updated one
+		firstDay = firstTime // DAY * DAY
+		position = numpy.searchsorted( timeArray, firstDay, 'left' )
+		dailyLevel = rollup.levels['D']
+		dayPosition = numpy.searchsorted( dailyLevel.times, firstDay, 'left' )
+		dailyLevel = dailyLevel.head( dayPosition ).append( self._aggregateRows( timeArray[position:], dataFrame.values[position:] ) )
+		newRollup.levels['D'] = dailyLevel
+
+		#months from the first updated one
+		firstMonth = monthStarts( numpy.array( [ firstDay ], dtype=numpy.int64 ) )[0]
+		monthlyLevel = rollup.levels['MS']
+		monthPosition = numpy.searchsorted( monthlyLevel.times, firstMonth, 'left' )
+		dayPosition = numpy.searchsorted( dailyLevel.times, firstMonth, 'left' )
+		monthlyLevel = monthlyLevel.head( monthPosition ).append( self._aggregateDays( dailyLevel.tail( dayPosition ) ) )
+		newRollup.levels['MS'] = monthlyLevel
+
+		#cube from the first updated month
+		position = numpy.searchsorted( timeArray, firstMonth, 'left' )
+		monthPosition = numpy.searchsorted( rollup.cube.times, firstMonth, 'left' )
+		newRollup.cube = rollup.cube.head( monthPosition ).append( self._cubeRows( timeArray[position:], dataFrame.values[position:] ) )
+
+		#sketches from the first updated month
+		if rollup.sketch is not None:
+			sketchLevels = self._sketchRows( rollup.sketch, timeArray[position:], dataFrame.values[position:] )
+			for column in range( len(sketchLevels) ):
+				sketchLevel = rollup.sketchLevels[column]
+				monthPosition = numpy.searchsorted( sketchLevel.times, firstMonth, 'left' )
+				sketchLevels[column] = sketchLevel.head( monthPosition ).append( sketchLevels[column] )
+			newRollup.sketch = rollup.sketch
+			newRollup.sketchLevels = sketchLevels
+
+		#histograms from the first updated month
+		for column,( layout, histogramLevel ) in rollup.histograms.items():
+			edges = self._getEdges( layout )
+			monthPosition = numpy.searchsorted( histogramLevel.times, firstMonth, 'left' )
+			newLevel = self.histogramEngine.countMonths( timeArray[position:], dataFrame.values[position:,column], edges )
+			newRollup.histograms[column] = ( layout, histogramLevel.head( monthPosition ).append( newLevel ) )
+
+		#wind roses from the first updated month
+		for ( directionColumn, velocityColumn ),( layout, windRoseLevel ) in rollup.windRoses.items():
+			monthPosition = numpy.searchsorted( windRoseLevel.times, firstMonth, 'left' )
+			newLevel = self._countWindRose( timeArray[position:], dataFrame.values[position:], directionColumn, velocityColumn, layout )
+			newRollup.windRoses[ ( directionColumn, velocityColumn ) ] = ( layout, windRoseLevel.head( monthPosition ).append( newLevel ) )
+
+		return newRollup
+
+	def aggregate(self,rollup,code,column,edges):
+
+		#count, sum, minimum and maximum of a column in [edges[k],edges[k+1])
+		level = rollup.levels[code]
+		starts = numpy.searchsorted( level.times, edges[:-1], 'left' )
+		ends   = numpy.searchsorted( level.times, edges[1:], 'left' )
+
+		count   = util.reduceGroups( numpy.add, level.count[:,column], starts, ends, 0 )
+		total   = util.reduceGroups( numpy.add, level.total[:,column], starts, ends, 0 )
+		minimum = util.reduceGroups( numpy.fmin, level.minimum[:,column], starts, ends )
+		maximum = util.reduceGroups( numpy.fmax, level.maximum[:,column], starts, ends )
+
+		return count, total, minimum, maximum
+
+	def foldCube(self,rollup,column,monthTimes):
+
+		#count, sum, sum of squares, minimum and maximum of a column by
+		#calendar month and hour, over the months starting at monthTimes
+		cube = rollup.cube
+		selected = numpy.in1d( cube.times, monthTimes )
+		months = cube.times[selected].astype('datetime64[ns]').astype('datetime64[M]').astype(numpy.int64) % 12
+
+		count   = numpy.zeros( ( 12, 24 ), dtype=numpy.int64 )
+		total   = numpy.zeros( ( 12, 24 ) )
+		squares = numpy.zeros( ( 12, 24 ) )
+		minimum = numpy.empty( ( 12, 24 ) )
+		maximum = numpy.empty( ( 12, 24 ) )
+		minimum.fill( numpy.nan )
+		maximum.fill( numpy.nan )
+
+		for month in range(12):
+			rows = numpy.flatnonzero( selected )[ months == month ]
+			if len(rows) == 0:
+				continue
+			count[month]   = cube.count[rows,:,column].sum( axis=0 )
+			total[month]   = cube.total[rows,:,column].sum( axis=0 )
+			squares[month] = cube.squares[rows,:,column].sum( axis=0 )
+			minimum[month] = numpy.fmin.reduce( cube.minimum[rows,:,column], axis=0 )
+			maximum[month] = numpy.fmax.reduce( cube.maximum[rows,:,column], axis=0 )
+
+		return count, total, squares, minimum, maximum
+
+	def foldHistogram(self,rollup,column,monthTimes):
+
+		#bin counts of a column over the months starting at monthTimes,
+		#None without a histogram of that column
+		if column not in rollup.histograms:
+			return None, None
+
+		layout, histogramLevel = rollup.histograms[column]
+		selected = numpy.in1d( histogramLevel.times, monthTimes )
+
+		return layout, histogramLevel.counts[selected].sum( axis=0 )
+
+	def foldWindRose(self,rollup,directionColumn,velocityColumn,monthTimes):
+
+		#direction x velocity counts of a pair over the months starting at monthTimes,
+		#None without a wind rose of that pair
+		if ( directionColumn, velocityColumn ) not in rollup.windRoses:
+			return None, None
+
+		layout, windRoseLevel = rollup.windRoses[ ( directionColumn, velocityColumn ) ]
+		selected = numpy.in1d( windRoseLevel.times, monthTimes )
+
+		return layout, windRoseLevel.counts[selected].sum( axis=0 )
+
+	def _countWindRose(self,timeArray,valuesArray,directionColumn,velocityColumn,layout):
+
+		directionBins = layout['directionBins']
+		directions = self.histogramEngine.shiftDirections( valuesArray[:,directionColumn], directionBins )
+		directionEdges = self.histogramEngine.calculateEdges( 0, 360, directionBins )
+		velocityEdges = self.histogramEngine.calculateEdges( layout['velocityMin'], layout['velocityMax'], layout['velocityBins'] )
+
+		return self.histogramEngine.countMonthPairs( timeArray, directions, valuesArray[:,velocityColumn], directionEdges, velocityEdges )
+
+	def _getEdges(self,layout):
+
+		return self.histogramEngine.calculateEdges( layout['min'], layout['max'], layout['bins'] )
+
+	def quantiles(self,rollup,column,edges,level):
+
+		#quantile of a column in [edges[k],edges[k+1]), edges are month starts
+		sketchLevel = rollup.sketchLevels[column]
+		starts = numpy.searchsorted( sketchLevel.times, edges[:-1], 'left' )
+		ends   = numpy.searchsorted( sketchLevel.times, edges[1:], 'left' )
+
+		result = numpy.empty( len(starts) )
+		for k in range( len(starts) ):
+			keys, counts = sketchLevel.select( starts[k], ends[k] )
+			if ends[k] > starts[k] + 1:
+				keys, counts = rollup.sketch.merge( keys, counts )
+			result[k] = rollup.sketch.quantile( keys, counts, level )
+
+		return result
+
+	def _isAligned(self,timeArray,samplingFrequency):
+
+		if samplingFrequency is None or samplingFrequency <= 0:
+			return False
+		if DAY_SECONDS % samplingFrequency != 0:
+			return False
+
+		return numpy.all( timeArray % ( samplingFrequency * 10**9 ) == 0 )
+
+	def _aggregateRows(self,timeArray,valuesArray):
+
+		days = timeArray // DAY
+		validArray = ~numpy.isnan( valuesArray )
+		totalArray = numpy.where( validArray, valuesArray, 0.0 )
+
+		return self._reduce( days * DAY, validArray.astype(numpy.int64), totalArray, valuesArray, valuesArray )
+
+	def _cubeRows(self,timeArray,valuesArray):
+
+		numberColumns = valuesArray.shape[1]
+		months = monthStarts( timeArray )
+		hours = ( timeArray // HOUR ) % 24
+
+		if len(timeArray) == 0:
+			return ZNCubeLevel(
+						numpy.zeros( 0, dtype=numpy.int64 ),
+						numpy.zeros( ( 0, 24, numberColumns ), dtype=numpy.int64 ),
+						numpy.zeros( ( 0, 24, numberColumns ) ),
+						numpy.zeros( ( 0, 24, numberColumns ) ),
+						numpy.zeros( ( 0, 24, numberColumns ) ),
+						numpy.zeros( ( 0, 24, numberColumns ) )
+					)
+
+		#rows of a (month,hour) cell together, months are already sorted
+		order = numpy.lexsort( ( hours, months ) )
+		months = months[order]
+		hours = hours[order]
+		valuesArray = valuesArray[order]
+		validArray = ~numpy.isnan( valuesArray )
+		totalArray = numpy.where( validArray, valuesArray, 0.0 )
+		starts = numpy.flatnonzero( numpy.concatenate( ( [ True ], ( months[1:] != months[:-1] ) | ( hours[1:] != hours[:-1] ) ) ) )
+
+		times = months[ numpy.flatnonzero( numpy.concatenate( ( [ True ], months[1:] != months[:-1] ) ) ) ]
+		rows = numpy.searchsorted( times, months[starts] )
+		cells = ( rows, hours[starts] )
+		shape = ( len(times), 24, numberColumns )
+
+		count = numpy.zeros( shape, dtype=numpy.int64 )
+		total = numpy.zeros( shape )
+		squares = numpy.zeros( shape )
+		minimum = numpy.empty( shape )
+		maximum = numpy.empty( shape )
+		minimum.fill( numpy.nan )
+		maximum.fill( numpy.nan )
+
+		count[cells]   = numpy.add.reduceat( validArray.astype(numpy.int64), starts, axis=0 )
+		total[cells]   = numpy.add.reduceat( totalArray, starts, axis=0 )
+		squares[cells] = numpy.add.reduceat( totalArray * totalArray, starts, axis=0 )
+		minimum[cells] = numpy.fmin.reduceat( valuesArray, starts, axis=0 )
+		maximum[cells] = numpy.fmax.reduceat( valuesArray, starts, axis=0 )
+
+		return ZNCubeLevel( times, count, total, squares, minimum, maximum )
+
+	def _sketchRows(self,sketch,timeArray,valuesArray):
+
+		months = monthStarts( timeArray )
+		return [ createSketchLevel( sketch, months, valuesArray[:,column] ) for column in range( valuesArray.shape[1] ) ]
+
+	def _aggregateDays(self,dailyLevel):
+
+		months = monthStarts( dailyLevel.times )
+		return self._reduce( months, dailyLevel.count, dailyLevel.total, dailyLevel.minimum, dailyLevel.maximum )
+
+	def _reduce(self,binTimes,count,total,minimum,maximum):
+
+		numberColumns = count.shape[1]
+		if len(binTimes) == 0:
+			return ZNRollupLevel(
+						numpy.zeros( 0, dtype=numpy.int64 ),
+						numpy.zeros( ( 0, numberColumns ), dtype=numpy.int64 ),
+						numpy.zeros( ( 0, numberColumns ) ),
+						numpy.zeros( ( 0, numberColumns ) ),
+						numpy.zeros( ( 0, numberColumns ) )
+					)
+
+		#rows are sorted, a bin starts where its time changes
+		starts = numpy.flatnonzero( numpy.concatenate( ( [ True ], binTimes[1:] != binTimes[:-1] ) ) )
+
+		return ZNRollupLevel(
+					binTimes[starts],
+					numpy.add.reduceat( count, starts, axis=0 ),
+					numpy.add.reduceat( total, starts, axis=0 ),
+					numpy.fmin.reduceat( minimum, starts, axis=0 ),
+					numpy.fmax.reduceat( maximum, starts, axis=0 )
+				)
@@ -0,0 +1,123 @@
+"""
+ZORRO-N - Meteorological Time Series DataBase Engine
+Copyright (C) 2014 - Ernesto Castillo Navarrete
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import collections
+import json
+import threading
+
+class ZNResultCache:
+
+	def __init__(self,maximumSize=64,ignoredFields=None):
+
+		#request fields that do not change the cached value
+		if ignoredFields is None:
+			ignoredFields = [ 'outputFormat' ]
+
+		self.maximumSize	= maximumSize
+		self.ignoredFields	= ignoredFields
+
+		#least recently used first
+		self.entries	= collections.OrderedDict()
+		self.tableKeys	= {}
+
+		self.hits	= 0
+		self.misses	= 0
+		self.lock	= threading.Lock()
+
+	def getKey(self,request,versions):
+
+		canonicalRequest = dict( request )
+		for field in self.ignoredFields:
+			canonicalRequest.pop( field, None )
+
+		try:
+			return json.dumps( [ canonicalRequest, sorted( versions.items() ) ], sort_keys=True )
+		except TypeError:
+			return None
+
+	def get(self,key):
+
+		with self.lock:
+
+			if key not in self.entries:
+				self.misses = self.misses + 1
+				return None
+
+			self.hits = self.hits + 1
+			tableCodes, value = self.entries.pop( key )
+			self.entries[key] = ( tableCodes, value )
+
+			return value
+
+	def put(self,key,tableCodes,value):
+
+		if self.maximumSize <= 0:
+			return
+
+		with self.lock:
+
+			self._remove( key )
+			self.entries[key] = ( tableCodes, value )
+			for tableCode in tableCodes:
+				self.tableKeys.setdefault( tableCode, set() ).add( key )
+
+			while len(self.entries) > self.maximumSize:
+				leastRecentlyUsed = next( iter( self.entries ) )
+				self._remove( leastRecentlyUsed )
+
+	def discard(self,key):
+
+		with self.lock:
+			self._remove( key )
+
+	def invalidate(self,tableCode):
+
+		with self.lock:
+			for key in list( self.tableKeys.get( tableCode, [] ) ):
+				self._remove( key )
+
+	def clear(self):
+
+		with self.lock:
+			self.entries.clear()
+			self.tableKeys.clear()
+
+	def getStatistics(self):
+
+		with self.lock:
+			return {
+					'entries' : len(self.entries),
+					'maximumSize' : self.maximumSize,
+					'hits' : self.hits,
+					'misses' : self.misses
+				}
+
+	def _remove(self,key):
+
+		if key not in self.entries:
+			return
+
+		tableCodes, value = self.entries.pop( key )
+		for tableCode in tableCodes:
+			keys = self.tableKeys.get( tableCode )
+			if keys is None:
+				continue
+			keys.discard( key )
+			if len(keys) == 0:
+				del self.tableKeys[tableCode]
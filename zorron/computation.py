@@ -20,12 +20,85 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import numpy
 import pandas
 import parser
-import sys
 
 import zorron.util as util
 
+from zorron.sketch import ZNQuantileSketch, getAccuracy
+from zorron.histogram import ZNHistogramEngine
+
+def foldCube(cube,axis):
+
+	#cube cells merged along an axis
+	count, total, squares, minimum, maximum = cube
+	return (
+			count.sum( axis=axis ),
+			total.sum( axis=axis ),
+			squares.sum( axis=axis ),
+			numpy.fmin.reduce( minimum, axis=axis ),
+			numpy.fmax.reduce( maximum, axis=axis )
+		)
+
+def cubeStatistic(statisticName,cube):
+
+	#statistic of each cell, nan for cells without values
+	#std and var with ddof=1 as pandas groupby
+	count, total, squares, minimum, maximum = cube
+	empty = count == 0
+	cellCount = numpy.maximum( count, 1 )
+
+	if statisticName == 'count':
+		if numpy.any( empty ):
+			return numpy.where( empty, numpy.nan, count )
+		return count
+	elif statisticName == 'sum':
+		return numpy.where( empty, numpy.nan, total )
+	elif statisticName == 'mean':
+		return numpy.where( empty, numpy.nan, total / cellCount )
+	elif statisticName == 'min':
+		return minimum
+	elif statisticName == 'max':
+		return maximum
+
+	pairs = numpy.maximum( count * count - count, 1 )
+	variance = numpy.where( count > 1, ( count * squares - total * total ) / pairs, numpy.nan )
+	if statisticName == 'var':
+		return variance
+
+	return numpy.sqrt( variance )
+
+def groupCube(values,groups,numberGroups):
+
+	#count, sum, sum of squares, minimum and maximum of each group
+	count   = numpy.bincount( groups, minlength=numberGroups )
+	total   = numpy.bincount( groups, weights=values, minlength=numberGroups )
+	squares = numpy.bincount( groups, weights=values * values, minlength=numberGroups )
+
+	minimum = numpy.empty( numberGroups )
+	maximum = numpy.empty( numberGroups )
+	minimum.fill( numpy.nan )
+	maximum.fill( numpy.nan )
+	if len(values) > 0:
+		order = numpy.argsort( groups, kind='mergesort' )
+		sortedGroups = groups[order]
+		starts = numpy.flatnonzero( numpy.concatenate( ( [ True ], sortedGroups[1:] != sortedGroups[:-1] ) ) )
+		minimum[sortedGroups[starts]] = numpy.minimum.reduceat( values[order], starts )
+		maximum[sortedGroups[starts]] = numpy.maximum.reduceat( values[order], starts )
+
+	return count, total, squares, minimum, maximum
+
 class ZNComputationHandler:
 
+	#computations answered from the month x hour cubes of the rollups
+	cubeComputations = [ 'annualCycle', 'dailyCycle', 'annualDailyCycle' ]
+	cubeStatistics	 = [ 'mean', 'sum', 'min', 'max', 'std', 'var', 'count' ]
+
+	#computations answered from bins counted with the rollups
+	histogramComputations = [ 'histogram', 'cumulativeDistribution' ]
+	windRoseComputations  = [ 'windRose' ]
+
+	#computations answered from the running statistics of the tables
+	summaryComputations = [ 'standardSummary' ]
+
 	def __init__(self):
 
 		self.aggregated	            = ZNAggregatedComputation()
@@ -67,6 +140,55 @@ class ZNComputationHandler:
 
 		return result
 
+	def handleCubes(self, seriesCubes, parameters ):
+
+		#series data are cubes folded by calendar month and hour
+		result = None
+		if len(seriesCubes)==0:
+			return result
+
+		computation = getattr( self, parameters['name'] )
+
+		result = []
+		for seriesCube in seriesCubes:
+			seriesResult = {
+					'metaData' : seriesCube['metaData'],
+					'data' : computation._computeCube( seriesCube['data'], parameters )
+					}
+			result.append( seriesResult )
+
+		return result
+
+	def handleCounts(self, seriesCounts, parameters ):
+
+		#series data are counts of the bins of the parameters
+		result = None
+		if len(seriesCounts)==0:
+			return result
+
+		computation = getattr( self, parameters['name'] )
+		return computation.computeCounts( seriesCounts, parameters )
+
+	def handleSummaries(self, seriesSummaries, parameters ):
+
+		#series data are the running statistics of their table and a column
+		result = None
+		if len(seriesSummaries)==0:
+			return result
+
+		computation = getattr( self, parameters['name'] )
+
+		result = []
+		for seriesSummary in seriesSummaries:
+			summary, column = seriesSummary['data']
+			seriesResult = {
+					'metaData' : seriesSummary['metaData'],
+					'data' : computation._computeSummary( summary, column, parameters )
+					}
+			result.append( seriesResult )
+
+		return result
+
 class ZNComputation:
 
 	def compute(self,seriesArray,parameters):
@@ -90,28 +212,114 @@ class ZNComputation:
 	
 	def _compute(self,serie,parameters):
 		pass
+
+	def _computeCube(self,cube,parameters):
+		pass
 	
 	def _processSharedData(self,seriesArray,parameters):
 		pass
 
+	def _getSketch(self,parameters):
+
+		#approximate percentiles when the statistic has an accuracy
+		statistic = parameters['statistic']
+		if statistic['name'] != 'percentile':
+			return None
+
+		accuracy = getAccuracy( statistic )
+		if accuracy is None:
+			return None
+
+		return ZNQuantileSketch( accuracy )
+
+	def _groupStatistic(self,values,groups,numberGroups,parameters):
+
+		#statistic of the groups 0..numberGroups-1 of values without nan,
+		#nan for empty groups, None when the statistic has no kernel
+		statistic = parameters['statistic']
+		name = statistic['name']
+
+		if name == 'percentile':
+
+			sketch = self._getSketch( parameters )
+			if sketch is not None:
+				return sketch.groupQuantiles( values, groups, numberGroups, statistic['level'] )
+
+			#exact, one sort of all the groups
+			order = numpy.lexsort( ( values, groups ) )
+			values = values[order]
+			bounds = numpy.searchsorted( groups[order], numpy.arange( numberGroups + 1 ) )
+			result = numpy.empty( numberGroups )
+			result.fill( numpy.nan )
+			for group in range( numberGroups ):
+				if bounds[group+1] > bounds[group]:
+					result[group] = numpy.percentile( values[bounds[group]:bounds[group+1]], statistic['level'] )
+			return result
+
+		if name not in ZNComputationHandler.cubeStatistics:
+			return None
+
+		return cubeStatistic( name, groupCube( values, groups, numberGroups ) )
+
 class ZNHistogramComputation(ZNComputation):
 
-	def _processSharedData(self,seriesArray,parameters):
+	def __init__(self):
 
-		if 'min' in parameters and 'max' in parameters:
-			return
+		self.histogramEngine = ZNHistogramEngine()
+
+	def compute(self,seriesArray,parameters):
+
+		#all series binned at once with the same edges
+		validSeriesArray = [ series for series in seriesArray if series is not None ]
+		if len(validSeriesArray) == 0:
+			return [ None for series in seriesArray ]
 
-		minimum = sys.float_info.max
-		maximum = sys.float_info.min
+		valuesArrays = [ series['data'].values for series in validSeriesArray ]
+		self._processSharedData( valuesArrays, parameters )
+		edges, counts = self._count( valuesArrays, parameters )
 
+		result = []
+		position = 0
 		for series in seriesArray:
-			
-			min = series['data'].min()
-			if min < minimum:
-				minimum = min
-			max = series['data'].max()
-			if max > maximum:
-				maximum = max
+			if series is None:
+				result.append( None )
+				continue
+
+			#series without values have no histogram
+			seriesCounts = None
+			if counts is not None and not numpy.all( numpy.isnan( valuesArrays[position] ) ):
+				seriesCounts = counts[position]
+			position = position + 1
+
+			seriesResult = {
+				  	'metaData' : series['metaData'],
+				  	'data' : self._format( edges, seriesCounts, parameters )
+					}
+			result.append( seriesResult )
+
+		return result
+
+	def computeCounts(self,seriesCounts,parameters):
+
+		#series whose data are counts of the bins of the parameters
+		edges = self.histogramEngine.calculateEdges( parameters['min'], parameters['max'], parameters['bins'] )
+
+		result = []
+		for series in seriesCounts:
+			seriesResult = {
+				  	'metaData' : series['metaData'],
+				  	'data' : self._format( edges, series['data'], parameters )
+					}
+			result.append( seriesResult )
+
+		return result
+
+	def _processSharedData(self,valuesArrays,parameters):
+
+		if 'min' in parameters and 'max' in parameters:
+			return
+
+		minimum, maximum = self.histogramEngine.calculateBounds( valuesArrays )
 				
 		if 'min' not in parameters:
 			parameters['min'] = minimum
@@ -119,31 +327,39 @@ class ZNHistogramComputation(ZNComputation):
 		if 'max' not in parameters:
 			parameters['max'] = maximum
 
-	def _compute(self,series,parameters):
-		
-		result = []
+	def _count(self,valuesArrays,parameters):
 
 		a = parameters['min']
 		b = parameters['max']
 
-		if a >= b:
-			return result
+		#series without values give nan bounds
+		if not a < b:
+			return None, None
 
-		series = series.dropna()
-		if len(series) == 0:
-			return result
-		
-		(histogram,bins) = numpy.histogram( series.values,range=(a,b),bins=parameters['bins'],density=parameters['density'])
+		edges = self.histogramEngine.calculateEdges( a, b, parameters['bins'] )
+		return edges, self.histogramEngine.count( valuesArrays, edges )
 
-		result = []
-		for i in range(len(histogram)):
-			label = [ bins[i] , bins[i+1] ]
-			result.append( [ label, float( histogram[i] ) ] )	
+	def _format(self,edges,counts,parameters):
+
+		if counts is None:
+			return []
+
+		histogram = counts.astype(numpy.float64)
+		if parameters.get( 'density', False ):
+			histogram = self.histogramEngine.density( counts, edges )
+
+		result = {
+				'binEdges' : edges,
+				'histogram' : histogram
+			}
 
 		return result
 
 class ZNAggregatedComputation(ZNComputation):
 
+	#statistics computed on all rows at once, other statistics are applied row by row
+	vectorizedStatistics = [ 'mean', 'sum', 'min', 'max', 'std', 'var', 'count', 'fraction', 'percentile' ]
+
 	def compute(self,seriesInputArray,parameters):
 		
 		seriesArray = []
@@ -158,8 +374,13 @@ class ZNAggregatedComputation(ZNComputation):
 			
 		dataFrame = pandas.concat( seriesArray, axis=1 )
 
-		function = util.parseStatisticFunction( parameters['statistic'] )
-		series = dataFrame.apply( function , axis=1)
+		statistic = parameters['statistic']
+		if statistic['name'] in self.vectorizedStatistics:
+			values = self._aggregate( dataFrame.values, statistic )
+			series = pandas.Series( data=values, index=dataFrame.index )
+		else:
+			function = util.parseStatisticFunction( statistic )
+			series = dataFrame.apply( function , axis=1)
 
 		result = {
 			   'type' : 'aggregated',
@@ -168,46 +389,53 @@ class ZNAggregatedComputation(ZNComputation):
 
 		return result
 
+	def _aggregate(self,valuesArray,statistic):
 
-class ZNCumulativeDistributionComputation(ZNComputation):
+		#statistic of every row, nan values skipped as the pandas methods
+		#called by numpy on each row
+		name = statistic['name']
+		validArray = ~numpy.isnan( valuesArray )
+		count = validArray.sum( axis=1 )
 
-	def _processSharedData(self,seriesArray,parameters):
+		if name == 'count':
+			return count
+		if name == 'fraction':
+			return count / float( valuesArray.shape[1] ) * 100
+		if name == 'percentile':
+			return numpy.percentile( valuesArray, statistic['level'], axis=1 )
+		if name == 'min':
+			return numpy.fmin.reduce( valuesArray, axis=1 )
+		if name == 'max':
+			return numpy.fmax.reduce( valuesArray, axis=1 )
 
-		if 'min' in parameters and 'max' in parameters:
-			return
+		total = numpy.where( validArray, valuesArray, 0.0 ).sum( axis=1 )
+		if name == 'sum':
+			return numpy.where( count > 0, total, numpy.nan )
 
-		minimum = sys.float_info.max
-		maximum = sys.float_info.min
+		mean = numpy.where( count > 0, total / numpy.maximum( count, 1 ), numpy.nan )
+		if name == 'mean':
+			return mean
 
-		for series in seriesArray:
-			
-			min = series['data'].min()
-			if min < minimum:
-				minimum = min
-			max = series['data'].max()
-			if max > maximum:
-				maximum = max
-				
-		if 'min' not in parameters:
-			parameters['min'] = minimum
+		#population variance, numpy.std and numpy.var use ddof=0
+		deviations = numpy.where( validArray, valuesArray - mean[:,numpy.newaxis], 0.0 )
+		variance = numpy.where( count > 0, ( deviations * deviations ).sum( axis=1 ) / numpy.maximum( count, 1 ), numpy.nan )
+		if name == 'var':
+			return variance
 
-		if 'max' not in parameters:
-			parameters['max'] = maximum
+		return numpy.sqrt( variance )
 
-	def _compute(self,series,parameters):
 
-		series = series.dropna()
+class ZNCumulativeDistributionComputation(ZNHistogramComputation):
 
-		a = parameters['min']
-		b = parameters['max']
-		
-		(histogram,bins) = numpy.histogram( series.values,range=(a,b),bins=parameters['bins'])
-		cumulativeSum = numpy.cumsum( histogram )
+	def _format(self,edges,counts,parameters):
 
-		result = []
-		for i in range(len(cumulativeSum)):
-			label = [ bins[i] , bins[i+1] ]
-			result.append( [ label, cumulativeSum[i] ] )	
+		if counts is None:
+			return []
+
+		result = {
+				'binEdges' : edges,
+				'histogram' : numpy.cumsum( counts )
+			}
 
 		return result
 
@@ -216,6 +444,13 @@ class ZNAnnualCycleComputation(ZNComputation):
 	def _compute(self,series,parameters):
 		
 		series = series.dropna()
+
+		#integer month codes, fixed 12 outputs
+		months = util.calendarCodes( series.index.asi8 )[0]
+		values = self._groupStatistic( series.values, months, 12, parameters )
+		if values is not None:
+			return pandas.Series( data=values, index=range(1,13) )
+
 		grouped = series.groupby( lambda x : x.month )
 		statisticFunction = util.parseStatisticFunction( parameters['statistic'] )
 		series = grouped.aggregate( statisticFunction )
@@ -230,13 +465,24 @@ class ZNAnnualCycleComputation(ZNComputation):
 			series = series.append( temporalSeries ).sort_index()
 
 		return series
-		
+
+	def _computeCube(self,cube,parameters):
+
+		values = cubeStatistic( parameters['statistic']['name'], foldCube( cube, 1 ) )
+		return pandas.Series( data=values, index=range(1,13) )
 
 class ZNDailyCycleComputation(ZNComputation):
 
 	def _compute(self,series,parameters):
 
 		series = series.dropna()
+
+		#integer hour codes, fixed 24 outputs
+		hours = util.calendarCodes( series.index.asi8 )[1]
+		values = self._groupStatistic( series.values, hours, 24, parameters )
+		if values is not None:
+			return pandas.Series( data=values, index=range(0,24) )
+
 		grouped = series.groupby( lambda x : x.hour )
 		statisticFunction = util.parseStatisticFunction( parameters['statistic'] )
 		series = grouped.aggregate( statisticFunction )
@@ -252,11 +498,29 @@ class ZNDailyCycleComputation(ZNComputation):
 
 		return series
 
+	def _computeCube(self,cube,parameters):
+
+		values = cubeStatistic( parameters['statistic']['name'], foldCube( cube, 0 ) )
+		return pandas.Series( data=values, index=range(0,24) )
+
 class ZNAnnualDailyCycleComputation(ZNComputation):
 	
 	def _compute(self,series,parameters):
 		
 		series = series.dropna()
+
+		#integer (month,hour) codes, only pairs with values
+		months, hours = util.calendarCodes( series.index.asi8 )
+		groups = months * 24 + hours
+		values = self._groupStatistic( series.values, groups, 12 * 24, parameters )
+		if values is not None:
+			counts = numpy.bincount( groups, minlength=12 * 24 )
+
+			result = []
+			for group in numpy.flatnonzero( counts ):
+				result.append( [ ( int( group // 24 ) + 1, int( group % 24 ) ), values[group] ] )
+			return result
+
 		grouped = series.groupby( lambda x : (x.month,x.hour) )
 		statisticFunction = util.parseStatisticFunction( parameters['statistic'] )
 		series = grouped.aggregate( statisticFunction )
@@ -269,6 +533,18 @@ class ZNAnnualDailyCycleComputation(ZNComputation):
 
 		return result
 
+	def _computeCube(self,cube,parameters):
+
+		#only (month,hour) pairs with values
+		values = cubeStatistic( parameters['statistic']['name'], cube )
+		count = cube[0]
+
+		result = []
+		for month,hour in zip( *numpy.nonzero( count ) ):
+			result.append( [ ( int( month ) + 1, int( hour ) ), values[month,hour] ] )
+
+		return result
+
 class ZNGenericExpressionComputation(ZNComputation):
 
 	def _compute(self,series,parameters):
@@ -283,9 +559,52 @@ class ZNGenericExpressionComputation(ZNComputation):
 
 class ZNWindRoseComputation(ZNComputation):
 
+	def __init__(self):
+
+		self.histogramEngine = ZNHistogramEngine()
+
 	def compute(self,seriesArray,parameters):
 
-		#find (direction,velocity) pairs
+		pairs = self.findPairs( seriesArray )
+		if len(pairs) == 0:
+			return []
+
+		#all pairs binned at once, direction edges are shared
+		directionArrays = [ self.histogramEngine.shiftDirections( pair[0]['data'].values, parameters['directionBins'] ) for pair in pairs ]
+		velocityArrays  = [ pair[1]['data'].values for pair in pairs ]
+		directionEdges  = self._getDirectionEdges( parameters )
+		velocityEdges   = self._getVelocityEdges( velocityArrays, parameters )
+		counts = self.histogramEngine.countPairs( directionArrays, velocityArrays, directionEdges, velocityEdges )
+
+		result = []
+		for position in range( len(pairs) ):
+			seriesResult = {
+					'metaData' : self.getPairMetaData( pairs[position] ),
+					'data' : self._format( counts[position], directionEdges, velocityEdges[position], parameters )
+				       }
+			result.append( seriesResult )
+
+		return result
+
+	def computeCounts(self,seriesCounts,parameters):
+
+		#series whose data are direction x velocity counts of the bins of the parameters
+		directionEdges = self._getDirectionEdges( parameters )
+		velocityEdges  = self._getVelocityEdges( None, parameters )
+
+		result = []
+		for series in seriesCounts:
+			seriesResult = {
+					'metaData' : series['metaData'],
+					'data' : self._format( series['data'], directionEdges, velocityEdges[0], parameters )
+				       }
+			result.append( seriesResult )
+
+		return result
+
+	def findPairs(self,seriesArray):
+
+		#( direction, velocity ) series of the same table, altitude and statistic
 		pairs = []
 		dictionary = {}
 		for series in seriesArray:
@@ -310,66 +629,57 @@ class ZNWindRoseComputation(ZNComputation):
 				else:
 					dictionary[key]  = series
 
-		#compute histogram2d
-		result = []
-		for pair in pairs:
-			computation = self._compute( pair, parameters )
-			metaData = pair[0]['metaData'].copy()
-			metaData['variableType'] = 'windRose'
-			seriesResult = {
-					'metaData' : metaData,
-					'data' : computation
-				       }
+		return pairs
 
-			result.append( seriesResult )
+	def getPairMetaData(self,seriesPair):
 
-		return result
-			
-	def _compute(self,seriesPair,parameters):
-
-		direction 	= seriesPair[0]['data'].values
-		directionBins 	= parameters['directionBins']
+		metaData = seriesPair[0]['metaData'].copy()
+		metaData['variableType'] = 'windRose'
+		return metaData
 
-		delta = 360 / ( 2 * directionBins )
-		direction = ( direction + delta ) % 360
+	def _getDirectionEdges(self,parameters):
 
-		velocity 	= seriesPair[1]['data'].values
-		velocityBins 	= parameters['velocityBins']
+		return self.histogramEngine.calculateEdges( 0, 360, parameters['directionBins'] )
 
-		directionMin 	= 0
-		directionMax	= 360
+	def _getVelocityEdges(self,velocityArrays,parameters):
 
-		if 'velocityMin' in parameters:
-			velocityMin = parameters['velocityMin']
+		#one row of edges per pair, from the values of the pair unless fixed by the parameters
+		if velocityArrays is None:
+			numberPairs = 1
 		else:
-			velocityMin	= numpy.nanmin( velocity )
+			numberPairs = len(velocityArrays)
 
-		if 'velocityMax' in parameters:
-			velocityMax = parameters['velocityMax']
+		if 'velocityMin' in parameters and 'velocityMax' in parameters:
+			minima = numpy.repeat( float( parameters['velocityMin'] ), numberPairs )
+			maxima = numpy.repeat( float( parameters['velocityMax'] ), numberPairs )
 		else:
-			velocityMax	= numpy.nanmax( velocity )
+			#pairs are not empty, fmin and fmax skip nan
+			values = numpy.concatenate( velocityArrays )
+			starts = numpy.cumsum( [ 0 ] + [ len(velocityArray) for velocityArray in velocityArrays[:-1] ] )
+			minima = numpy.fmin.reduceat( values, starts )
+			maxima = numpy.fmax.reduceat( values, starts )
+			if 'velocityMin' in parameters:
+				minima = numpy.repeat( float( parameters['velocityMin'] ), numberPairs )
+			if 'velocityMax' in parameters:
+				maxima = numpy.repeat( float( parameters['velocityMax'] ), numberPairs )
 
-		density = True
-		if 'density' in parameters:
-			density = parameters['density']
+		#bins of finite width, as numpy.histogram2d
+		equal = minima == maxima
+		minima = numpy.where( equal, minima - 0.5, minima )
+		maxima = numpy.where( equal, maxima + 0.5, maxima )
 
-		histogram = numpy.histogram2d( 
-						direction, 
-						velocity, 
-						bins= [ directionBins, velocityBins ],
-						range = [ [ directionMin, directionMax ],
-						          [ velocityMin, velocityMax ]
-							],
-						normed = density
-					)
+		return numpy.array( [ self.histogramEngine.calculateEdges( minima[k], maxima[k], parameters['velocityBins'] ) for k in range( numberPairs ) ] )
 
-		directionBinEdges = histogram[1]
-		directionBinEdges = ( directionBinEdges - delta ) % 360
+	def _format(self,counts,directionEdges,velocityEdges,parameters):
+
+		histogram = counts.astype(numpy.float64)
+		if parameters.get( 'density', True ):
+			histogram = self.histogramEngine.densityPairs( counts, directionEdges, velocityEdges )
 
 		result = {
-				'histogram' : histogram[0].transpose(),
-				'directionBinEdges' : directionBinEdges,
-				'velocityBinEdges' : histogram[2]
+				'histogram' : histogram.transpose(),
+				'directionBinEdges' : ( directionEdges - self.histogramEngine.calculateDirectionShift( parameters['directionBins'] ) ) % 360,
+				'velocityBinEdges' : velocityEdges
 			 }
 
 		return result
@@ -398,3 +708,18 @@ class ZNStandardSummaryComputation(ZNComputation):
 			}
 		
 		return  result
+
+	def _computeSummary(self,summary,column,parameters):
+
+		#the whole table filled on its grid, without reading its rows
+		result = {
+			   'start' : summary.firstTime,
+			   'end' : summary.lastTime,
+			   'min' : summary.minimum[column],
+			   'max' : summary.maximum[column],
+			   'mean' : summary.mean[column],
+			   'stdev' : summary.getStandardDeviation()[column],
+			   'fraction' : summary.count[column] / float( summary.getGridLength() )
+			}
+
+		return result
@@ -17,137 +17,161 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 
+import collections
 import threading
 import time
 
+from zorron.error import ZNQueueFullError,ZNQueueClosedError
+
 class ZNAction:
 
 	def __init__(self,actionType,parameters):
 
+		#parameters: ( function, arguments )
 		self.type = actionType
 		self.parameters = parameters
+
+		self.result	= None
+		self.error	= None
+		self.event	= threading.Event()
+		self.enqueueTime = None
+		self.startTime	 = None
 	
 	def __repr__(self):
 		return self.type
 	def __str__(self):
 		return self.type
 
+	def execute(self):
+
+		function, arguments = self.parameters
+		try:
+			self.result = function( *arguments )
+		except Exception as error:
+			self.error = error
+		self.event.set()
+
+	def wait(self):
+
+		self.event.wait()
+		if self.error is not None:
+			raise self.error
+		return self.result
+
 
 class ZNActionSyncronizationParameters:
 
-	def __init__(self,condition,actionQueue,state,stop, activeProcessors, logFile ):
+	def __init__(self,condition,actionQueue,stop, activeProcessors, maxQueueSize ):
 
 		self.condition   	= condition
 		self.actionQueue 	= actionQueue
 		self.stop	 	= stop
-		self.state	 	= state
 		self.activeProcessors   = activeProcessors
-		self.logFile 		= logFile
+		self.maxQueueSize	= maxQueueSize
+		self.writing		= False
+
+		#queue wait statistics by action type
+		self.metrics = {}
+		for actionType in [ 'REQUEST', 'WRITE' ]:
+			self.metrics[actionType] = {
+							'count' : 0,
+							'totalWaitTime' : 0.0,
+							'maximumWaitTime' : 0.0,
+							'rejected' : 0
+						}
 
 class ZNActionProcessor(threading.Thread):
 
+	#action types:
+	#	REQUEST		runs concurrently with requests and writes
+	#	WRITE		runs concurrently with requests, one write at a time
+	#writes publish new versions of the tables, requests read pinned views
+
 	def __init__(self,id,parameters):
 
 		threading.Thread.__init__(self)
+		self.daemon	 = True
 		self.id 	 = id
 		self.parameters  = parameters
-		self.requester   = None
-		self.updater     = None
 	
 	def run(self):
 		
-		print "INICIANDO THREAD (%d)" % ( self.id )
-		while True:	
-			
-			with self.parameters.condition:
-
-				self.parameters.condition.acquire()
-				print "%s (%d) - %s" % ( self.parameters.state, self.id , self.parameters.actionQueue )
-				if self.parameters.stop:
-					print "STOP (%d)" % ( self.id )
-					self.parameters.condition.release()
-					break
+		parameters = self.parameters
+		condition = parameters.condition
 
-				if len( self.parameters.actionQueue ) == 0:
-					print "ESPERANDO (%d)" % ( self.id )
-					self.parameters.condition.wait()	
+		condition.acquire()
+		try:
+			#after a stop the queued actions are still processed
+			while not ( parameters.stop and len( parameters.actionQueue ) == 0 ):
 
-				elif self.parameters.state == 'REQUESTING':
+				action = self._next()
 
-					actionType = self.parameters.actionQueue[0].type	
+				if action is None:
+					#empty queue, or only writes queued behind a running write
+					condition.wait()
+					continue
 
-					if actionType == 'REQUEST':
+				self._start( action )
+				parameters.activeProcessors = parameters.activeProcessors + 1
+				if action.type == 'WRITE':
+					parameters.writing = True
 
-						action = self.parameters.actionQueue.pop()
-						self.parameters.activeProcessors = self.parameters.activeProcessors + 1
-						self.parameters.logFile.write( "EMPEZANDO REQUEST (%d)" % ( self.id ) )
-						print "EMPEZANDO REQUEST (%d) - %s" % ( self.id, time.time() )
+				condition.release()
+				try:
+					action.execute()
+				finally:
+					condition.acquire()
 
-						self.parameters.condition.release()
+				if action.type == 'WRITE':
+					parameters.writing = False
+				parameters.activeProcessors = parameters.activeProcessors - 1
+				condition.notifyAll()
+		finally:
+			condition.release()
 
-						time.sleep(2)
-						#self.requester.process( action )
+	def _next(self):
 
-						self.parameters.condition.acquire()
-						self.parameters.logFile.write( "TERMINANDO REQUEST (%d)" % ( self.id ) )
-						print "TERMINANDO REQUEST (%d) - %s" % ( self.id, time.time() )
+		#called with the condition acquired
+		#writes run in order, requests may overtake a blocked write
+		for action in self.parameters.actionQueue:
+			if action.type == 'REQUEST' or not self.parameters.writing:
+				return action
 
-						self.parameters.activeProcessors = self.parameters.activeProcessors - 1
-						
-					elif actionType == 'UPDATE':
+		return None
 
-						self.parameters.state = 'WAITING_REQUESTS'
-						
-				elif self.parameters.state == 'WAITING_REQUESTS':
-				
-					if self.parameters.activeProcessors == 0:
+	def _start(self,action):
 
-						self.parameters.state = 'UPDATING'
-						
-						action = self.parameters.actionQueue.pop()
-						self.parameters.logFile.write( "EMPEZANDO UPDATE (%d)" % ( self.id ) )
-						print "EMPEZANDO UPDATE (%d) - %s" % ( self.id , time.time() )
+		#called with the condition acquired
+		self.parameters.actionQueue.remove( action )
+		action.startTime = time.time()
+		waitTime = action.startTime - action.enqueueTime
 
-						self.parameters.condition.release()
+		metrics = self.parameters.metrics[action.type]
+		metrics['count'] = metrics['count'] + 1
+		metrics['totalWaitTime'] = metrics['totalWaitTime'] + waitTime
+		metrics['maximumWaitTime'] = max( metrics['maximumWaitTime'], waitTime )
 
-						#self.updater.process( action )
-						time.sleep(4)
+		#a slot in the queue is free
+		self.parameters.condition.notifyAll()
 
-						self.parameters.condition.acquire()
-						self.parameters.logFile.write( "TERMINANDO UPDATE (%d)" % ( self.id ) )
-						print  "TERMINANDO UPDATE (%d) - %s" % ( self.id , time.time() ) 
-
-						self.parameters.state = 'REQUESTING'
-						self.parameters.condition.notifyAll()
-
-					self.parameters.condition.wait()
-
-				elif self.parameters.state == 'UPDATING':
-
-					print "ESPERANDO UPDATING (%d)" % ( self.id )
-					self.parameters.condition.wait()
-					self.parameters.logFile.write( "ESPERANDO UPDATING (%d)" % ( self.id ) )
-
-				self.parameters.condition.release()
+		return action
 
 class ZNConcurrencyManager:
 	
-	def __init__(self,numberProcessors):
+	def __init__(self,numberProcessors,maxQueueSize=None,queueTimeout=None):
 		
 		condition = threading.Condition()
-		actionQueue = []
+		actionQueue = collections.deque()
 		activeProcessors = 0
-		state = 'REQUESTING'
 		stop = False
 
-		self.logFile = open( '/tmp/manager.log', 'w' )
+		self.queueTimeout = queueTimeout
 		self.parameters = ZNActionSyncronizationParameters( 
 									condition, 
 									actionQueue, 
-									state, 
 									stop , 
 									activeProcessors,
-									self.logFile
+									maxQueueSize
 								  )
 		self.processors = []
 
@@ -156,30 +180,76 @@ class ZNConcurrencyManager:
 			self.processors.append( processor )
 			self.processors[i].start()
 
+	def request(self,function,*arguments):
+
+		action = ZNAction( 'REQUEST', ( function, arguments ) )
+		self.enque( action )
+		return action.wait()
+
+	def write(self,function,*arguments):
+
+		action = ZNAction( 'WRITE', ( function, arguments ) )
+		self.enque( action )
+		return action.wait()
+
 	def enque(self,action):	
 		
-		with self.parameters.condition:
+		parameters = self.parameters
+
+		with parameters.condition:
+
+			if parameters.stop:
+				raise ZNQueueClosedError()
+
+			#backpressure: wait for a free slot
+			if parameters.maxQueueSize is not None:
+
+				deadline = None
+				if self.queueTimeout is not None:
+					deadline = time.time() + self.queueTimeout
 
-			self.parameters.condition.acquire()
+				while len( parameters.actionQueue ) >= parameters.maxQueueSize:
 
-			if self.parameters.stop == True:
-				self.parameters.condition.release()
-				return
+					timeout = None
+					if deadline is not None:
+						timeout = deadline - time.time()
+						if timeout <= 0:
+							parameters.metrics[action.type]['rejected'] = parameters.metrics[action.type]['rejected'] + 1
+							raise ZNQueueFullError( len( parameters.actionQueue ) )
 
-			self.parameters.actionQueue.append( action )		
-			self.parameters.condition.notify()
-			self.parameters.condition.release()
+					parameters.condition.wait( timeout )
+
+			action.enqueueTime = time.time()
+			parameters.actionQueue.append( action )		
+			parameters.condition.notifyAll()
+
+	def getMetrics(self):
+
+		parameters = self.parameters
+
+		with parameters.condition:
+
+			metrics = {
+					'writing' : parameters.writing,
+					'queueLength' : len( parameters.actionQueue ),
+					'activeProcessors' : parameters.activeProcessors
+				}
+			for actionType,actionMetrics in parameters.metrics.items():
+				actionMetrics = actionMetrics.copy()
+				meanWaitTime = 0.0
+				if actionMetrics['count'] > 0:
+					meanWaitTime = actionMetrics['totalWaitTime'] / actionMetrics['count']
+				actionMetrics['meanWaitTime'] = meanWaitTime
+				metrics[actionType] = actionMetrics
+
+		return metrics
 		
 	def finalize(self):
 
 		with self.parameters.condition:
 
-			self.parameters.condition.acquire()
 			self.parameters.stop = True
 			self.parameters.condition.notifyAll()
-			self.parameters.condition.release()
 
 		for processor in self.processors:
 			processor.join()
-
-		self.logFile.close()
@@ -17,11 +17,16 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 
+import collections
+import threading
 import numpy
 import pandas
 
 import zorron.util as util
 
+from zorron.aggregate import ZNRollupEngine
+from zorron.summary import ZNSummaryEngine
+
 class ZNDataEngine:
 
 	def createData(self):
@@ -40,28 +45,416 @@ class ZNPandasData:
 	def __init__(self):
 		self.dataFrames = {}
 
+		#version of each table, increased on every publication
+		self.versions	= {}
+		self.rollups	= {}
+		self.summaries	= {}
+		self.views	= []
+		self.lock	= threading.Lock()
+
+	def publish(self,tableCode,dataFrame,rollup=None,summary=None):
+
+		currentFrame = self._readCurrent( tableCode )
+		with self.lock:
+
+			self._preserve( tableCode, currentFrame )
+
+			rollups = dict( self.rollups )
+			if rollup is None:
+				rollups.pop( tableCode, None )
+			else:
+				rollups[tableCode] = rollup
+			self.rollups = rollups
+
+			summaries = dict( self.summaries )
+			if summary is None:
+				summaries.pop( tableCode, None )
+			else:
+				summaries[tableCode] = summary
+			self.summaries = summaries
+
+			#copy-on-write: pinned views keep the previous dictionary
+			if isinstance( self.dataFrames, dict ):
+				dataFrames = dict( self.dataFrames )
+				dataFrames[tableCode] = dataFrame
+				self.dataFrames = dataFrames
+			else:
+				self.dataFrames[tableCode] = dataFrame
+
+			self.versions[tableCode] = self.versions.get( tableCode, 0 ) + 1
+
+	def retract(self,tableCode):
+
+		currentFrame = self._readCurrent( tableCode )
+		with self.lock:
+
+			self._preserve( tableCode, currentFrame )
+
+			if isinstance( self.dataFrames, dict ):
+				dataFrames = dict( self.dataFrames )
+				del dataFrames[tableCode]
+				self.dataFrames = dataFrames
+			else:
+				del self.dataFrames[tableCode]
+
+			self.versions.pop( tableCode, None )
+
+			rollups = dict( self.rollups )
+			rollups.pop( tableCode, None )
+			self.rollups = rollups
+
+			summaries = dict( self.summaries )
+			summaries.pop( tableCode, None )
+			self.summaries = summaries
+
+	def attach(self,tableCode,rollup=None,summary=None):
+
+		#aggregates of a table read from disk, the ones maintained
+		#by publications since the table was loaded first are kept
+		with self.lock:
+
+			if rollup is not None and tableCode not in self.rollups:
+				rollups = dict( self.rollups )
+				rollups[tableCode] = rollup
+				self.rollups = rollups
+
+			if summary is not None and tableCode not in self.summaries:
+				summaries = dict( self.summaries )
+				summaries[tableCode] = summary
+				self.summaries = summaries
+
+	def keepTable(self,tableCode):
+
+		#lazy tables: a kept table is not evicted until it is let go,
+		#e.g. while it holds updates that are not in storage yet
+		if isinstance( self.dataFrames, ZNLazyDataFrames ):
+			self.dataFrames.keep( tableCode )
+
+	def letGoTable(self,tableCode):
+
+		if isinstance( self.dataFrames, ZNLazyDataFrames ):
+			self.dataFrames.letGo( tableCode )
+
+	def pin(self):
+
+		#consistent view of all tables, valid until released
+		with self.lock:
+
+			if isinstance( self.dataFrames, dict ):
+				dataFrames = self.dataFrames
+			else:
+				dataFrames = ZNPinnedDataFrames( self.dataFrames )
+
+			view = ZNPandasDataView( dataFrames, self.versions.copy(), self.rollups, self.summaries )
+			self.views.append( view )
+
+		return view
+
+	def release(self,view):
+
+		with self.lock:
+			if view in self.views:
+				self.views.remove( view )
+
+		#dataframes of older versions are freed with the last view using them
+		view.dataFrames = None
+
+	def _readCurrent(self,tableCode):
+
+		#lazy tables: the version pinned views may still need, read from
+		#disk if evicted before taking the lock
+		if not isinstance( self.dataFrames, ZNLazyDataFrames ) or tableCode not in self.dataFrames:
+			return None
+
+		return self.dataFrames[tableCode]
+
+	def _preserve(self,tableCode,dataFrame):
+
+		#lazy tables: views that did not read the table yet keep the current version
+		if dataFrame is None:
+			return
+
+		for view in self.views:
+			if isinstance( view.dataFrames, ZNPinnedDataFrames ):
+				view.dataFrames.preserve( tableCode, dataFrame )
+
+class ZNPandasDataView:
+
+	def __init__(self,dataFrames,versions,rollups,summaries):
+
+		self.dataFrames = dataFrames
+		self.versions	= versions
+		self.rollups	= rollups
+		self.summaries	= summaries
+
+class ZNPinnedDataFrames:
+
+	def __init__(self,lazyDataFrames):
+
+		#tables of lazyDataFrames at pin time, resolved on first use
+		self.lazyDataFrames	= lazyDataFrames
+		self.tableCodes		= set( lazyDataFrames.keys() )
+		self.resolvedFrames	= {}
+		self.lock		= threading.Lock()
+
+	def preserve(self,tableCode,dataFrame):
+
+		#dataFrame is the version at pin time, read by the caller
+		if tableCode not in self.tableCodes:
+			return
+
+		with self.lock:
+			self.resolvedFrames.setdefault( tableCode, dataFrame )
+
+	def __getitem__(self,tableCode):
+
+		with self.lock:
+			if tableCode in self.resolvedFrames:
+				return self.resolvedFrames[tableCode]
+		if tableCode not in self.tableCodes:
+			raise KeyError( tableCode )
+
+		#a preserved version wins over the one read here
+		dataFrame = self.lazyDataFrames[tableCode]
+		with self.lock:
+			return self.resolvedFrames.setdefault( tableCode, dataFrame )
+
+	def __contains__(self,tableCode):
+
+		return tableCode in self.tableCodes
+
+	def __len__(self):
+
+		return len(self.tableCodes)
+
+	def __iter__(self):
+
+		return iter( self.keys() )
+
+	def keys(self):
+
+		return list( self.tableCodes )
+
+	def values(self):
+
+		return [ self[tableCode] for tableCode in self.keys() ]
+
+	def items(self):
+
+		return [ ( tableCode, self[tableCode] ) for tableCode in self.keys() ]
+
+class ZNLazyDataFrames:
+
+	def __init__(self,loadFunction,memoryBudget=None):
+
+		#loadFunction(tableCode) reads a table from disk into a dataframe
+		#memoryBudget is expressed in bytes, None means unbounded
+		self.loadFunction	= loadFunction
+		self.memoryBudget	= memoryBudget
+
+		self.tableCodes		= set()
+		self.keptCodes		= set()
+		self.loadedFrames	= collections.OrderedDict()
+		self.memorySizes	= {}
+		self.memoryUsage	= 0
+
+		self.lock		= threading.RLock()
+		self.loadLock		= threading.Lock()
+
+	def register(self,tableCode):
+
+		with self.lock:
+			self.tableCodes.add( tableCode )
+
+	def keep(self,tableCode):
+
+		with self.lock:
+			self.keptCodes.add( tableCode )
+
+	def letGo(self,tableCode):
+
+		with self.lock:
+			self.keptCodes.discard( tableCode )
+
+	def isLoaded(self,tableCode):
+
+		with self.lock:
+			return tableCode in self.loadedFrames
+
+	def evict(self,tableCode):
+
+		with self.lock:
+			if tableCode in self.loadedFrames:
+				del self.loadedFrames[tableCode]
+				self.memoryUsage = self.memoryUsage - self.memorySizes.pop( tableCode )
+
+	def __getitem__(self,tableCode):
+
+		with self.lock:
+			dataFrame = self._touch( tableCode )
+			if dataFrame is not None:
+				return dataFrame
+			if tableCode not in self.tableCodes:
+				raise KeyError( tableCode )
+
+		#read from disk, one table at a time
+		with self.loadLock:
+
+			with self.lock:
+				dataFrame = self._touch( tableCode )
+				if dataFrame is not None:
+					return dataFrame
+
+			dataFrame = self.loadFunction( tableCode )
+
+			with self.lock:
+				self._store( tableCode, dataFrame )
+
+		return dataFrame
+
+	def __setitem__(self,tableCode,dataFrame):
+
+		with self.lock:
+			self.tableCodes.add( tableCode )
+			self._store( tableCode, dataFrame )
+
+	def __delitem__(self,tableCode):
+
+		with self.lock:
+			self.evict( tableCode )
+			self.tableCodes.remove( tableCode )
+			self.keptCodes.discard( tableCode )
+
+	def __contains__(self,tableCode):
+
+		return tableCode in self.tableCodes
+
+	def __len__(self):
+
+		return len(self.tableCodes)
+
+	def __iter__(self):
+
+		return iter( self.keys() )
+
+	def keys(self):
+
+		with self.lock:
+			return list( self.tableCodes )
+
+	def values(self):
+
+		return [ self[tableCode] for tableCode in self.keys() ]
+
+	def items(self):
+
+		return [ ( tableCode, self[tableCode] ) for tableCode in self.keys() ]
+
+	def _touch(self,tableCode):
+
+		#move to the most recently used position
+		if tableCode not in self.loadedFrames:
+			return None
+		dataFrame = self.loadedFrames.pop( tableCode )
+		self.loadedFrames[tableCode] = dataFrame
+		return dataFrame
+
+	def _store(self,tableCode,dataFrame):
+
+		self.evict( tableCode )
+
+		memorySize = dataFrame.values.nbytes + dataFrame.index.nbytes
+		self.loadedFrames[tableCode] = dataFrame
+		self.memorySizes[tableCode]  = memorySize
+		self.memoryUsage = self.memoryUsage + memorySize
+
+		#release least recently used tables, keep the current and kept ones
+		if self.memoryBudget is None:
+			return
+		while self.memoryUsage > self.memoryBudget:
+			candidates = [ loadedCode for loadedCode in self.loadedFrames if loadedCode != tableCode and loadedCode not in self.keptCodes ]
+			if len(candidates) == 0:
+				break
+			self.evict( candidates[0] )
+
 class ZNPandasDataEngine(ZNDataEngine):
 
-	def createData(self):
-		return ZNPandasData()
+	def __init__(self,rollups=False,sketchAccuracy=None,histogramLayouts=None):
+
+		#daily and monthly aggregates maintained with the data
+		self.rollupEngine = None
+		if rollups:
+			self.rollupEngine = ZNRollupEngine( sketchAccuracy )
+
+		#fixed bin layouts by variable type, counted with the rollups
+		self.histogramLayouts = histogramLayouts
+
+		#running statistics of every table, for unfiltered summaries
+		self.summaryEngine = ZNSummaryEngine()
+
+	def createData(self,loadFunction=None,memoryBudget=None):
+
+		data = ZNPandasData()
+		if loadFunction is not None:
+			data.dataFrames = ZNLazyDataFrames( loadFunction, memoryBudget )
+		return data
+
+	def createDataFrame(self,tableMetaData,dataArray):
 
-	def createTable(self,tableMetaData,data,dataArray):
-	
 		variablesNames  = []
 		for variable in tableMetaData['variables']:
 			variablesNames.append( '%s' % ( variable['code'] ) )
 
 		dataFrame = util.createDataFrame( dataArray, variablesNames)	
 
-		data.dataFrames[ tableMetaData['code'] ] = dataFrame
+		return dataFrame
+
+	def createTable(self,tableMetaData,data,dataArray):
+	
+		dataFrame = self.createDataFrame( tableMetaData, dataArray )
+
+		self.insertTable( tableMetaData, data, dataFrame )
+
+	def insertTable(self,tableMetaData,data,dataFrame):
+
+		rollup, summary = self._createAggregates( tableMetaData, dataFrame )
+
+		data.publish( tableMetaData['code'], dataFrame, rollup, summary )
+
+	def attachTable(self,tableMetaData,data,dataFrame):
+
+		#lazy tables are read from disk without a publication
+		tableCode = tableMetaData['code']
+		if tableCode in data.summaries and ( self.rollupEngine is None or tableCode in data.rollups ):
+			return
+
+		rollup, summary = self._createAggregates( tableMetaData, dataFrame )
+
+		data.attach( tableCode, rollup, summary )
+
+	def _createAggregates(self,tableMetaData,dataFrame):
+
+		rollup = None
+		if self.rollupEngine is not None:
+			rollup = self.rollupEngine.create( dataFrame, self._getHistogramLayouts( tableMetaData ), self._getWindRoseLayouts( tableMetaData ) )
+
+		#measured once, requests read it from the metadata
+		samplingFrequency = util.findSamplingFrequency( dataFrame )
+		tableMetaData['samplingFrequency'] = samplingFrequency
+
+		summary = self.summaryEngine.create( dataFrame, samplingFrequency )
+
+		return rollup, summary
 
 	def removeTable(self,data,tableCode):
 
-		del data.dataFrames[tableCode]
+		data.retract( tableCode )
 	
 	def getTableData(self,data,tableCode,firstPosition=None, lastPosition=None ):
 
-		dataFrame = data.dataFrames[tableCode]
+		return self.getFrameData( data.dataFrames[tableCode], firstPosition, lastPosition )
+
+	def getFrameData(self,dataFrame,firstPosition=None, lastPosition=None ):
 
 		if firstPosition == None and lastPosition == None:
 			firstPosition = 0
@@ -72,29 +465,103 @@ class ZNPandasDataEngine(ZNDataEngine):
 		dataArray = numpy.concatenate( ( indexArray.T, dataFrame.values[firstPosition:lastPosition+1] ), axis = 1)
 		return dataArray
 	
-	def updateTableData(self,data,tableCode,dataArray):
+	def updateTableData(self,data,tableCode,dataArray,tableMetaData=None):
 		
-		#create new dataframe
+		#dataArray rows are sorted by time and unique
 		dataFrame = data.dataFrames[tableCode]
 		variablesNames = dataFrame.columns
-		updateDataFrame = util.createDataFrame( dataArray,variablesNames )
-		
-		#calculate intersection and differencefrom zorron.util import parseDateTime
-		existingValuesIndex = dataFrame.index.intersection( updateDataFrame.index )
-		newValuesIndex = updateDataFrame.index.diff( existingValuesIndex )
 
-		#update existing values if not nan
-		dataFrame.update( updateDataFrame.ix[existingValuesIndex] )
+		timeArray = dataFrame.index.asi8
+		updateTimeArray = dataArray[:,0].astype(numpy.int64)
+		updateValuesArray = dataArray[:,1:]
+
+		#pure append
+		if len(timeArray) == 0 or updateTimeArray[0] > timeArray[-1]:
+
+			updateDataFrame = util.createDataFrame( dataArray, variablesNames )
+			newDataFrame = pandas.concat( [ dataFrame, updateDataFrame ] )
+
+		#merge, only rows after the first updated timestamp change
+		else:
+
+			positions = numpy.searchsorted( timeArray, updateTimeArray, 'left' )
+			firstPosition = positions[0]
+			positions = positions - firstPosition
+
+			newTimeArray = timeArray[firstPosition:]
+			newValuesArray = dataFrame.values[firstPosition:].copy()
+
+			#existing timestamps
+			existing = positions < len(newTimeArray)
+			existing[existing] = newTimeArray[ positions[existing] ] == updateTimeArray[existing]
+
+			#update existing values if not nan
+			rows = positions[existing]
+			currentValues = newValuesArray[rows]
+			updateValues  = updateValuesArray[existing]
+			validValues   = ~numpy.isnan( updateValues )
+			currentValues[validValues] = updateValues[validValues]
+			newValuesArray[rows] = currentValues
+
+			#insert new values at their sorted positions
+			missing = ~existing
+			newTimeArray = numpy.insert( newTimeArray, positions[missing], updateTimeArray[missing] )
+			newValuesArray = numpy.insert( newValuesArray, positions[missing], updateValuesArray[missing], axis=0 )
+
+			newTimeArray = numpy.concatenate( ( timeArray[:firstPosition], newTimeArray ) )
+			newValuesArray = numpy.concatenate( ( dataFrame.values[:firstPosition], newValuesArray ) )
+
+			indexArray = pandas.DatetimeIndex( data=newTimeArray )
+			newDataFrame = pandas.DataFrame( index=indexArray, data=newValuesArray, columns=variablesNames )
+
+		#aggregates from the first updated timestamp
+		rollup = None
+		if self.rollupEngine is not None:
+			rollup = self.rollupEngine.update( data.rollups.get( tableCode ), newDataFrame, updateTimeArray[0], self._getHistogramLayouts( tableMetaData ), self._getWindRoseLayouts( tableMetaData ) )
+
+		samplingFrequency = util.findSamplingFrequency( newDataFrame )
+		if tableMetaData is not None:
+			tableMetaData['samplingFrequency'] = samplingFrequency
+
+		#running statistics from the year of the first updated timestamp
+		summary = self.summaryEngine.update( data.summaries.get( tableCode ), newDataFrame, samplingFrequency, updateTimeArray[0] )
+
+		#publish new dataframe, pinned views keep the previous one
+		data.publish( tableCode, newDataFrame, rollup, summary )
+
+	def _getHistogramLayouts(self,tableMetaData):
+
+		#layout of each column, None for columns without one
+		if self.histogramLayouts is None or tableMetaData is None:
+			return None
+
+		return [ self.histogramLayouts.get( variable['type'] ) for variable in tableMetaData['variables'] ]
+
+	def _getWindRoseLayouts(self,tableMetaData):
 
-		#concatenate new values
-		newDataFrame = pandas.concat( [ dataFrame, updateDataFrame.ix[newValuesIndex] ] )
+		#( direction column, velocity column, layout ) of the variables of the
+		#same altitude and statistic, paired as the wind rose computation does
+		if self.histogramLayouts is None or tableMetaData is None:
+			return None
 
-		#sort rows
-		newDataFrame = newDataFrame.sort()
+		layout = self.histogramLayouts.get( 'windRose' )
+		if layout is None:
+			return None
 
-		#update new dataframe
-		data.dataFrames[ tableCode ] = newDataFrame
+		windRoseLayouts = []
+		dictionary = {}
+		for column in range( len(tableMetaData['variables']) ):
+			variable = tableMetaData['variables'][column]
+			if variable['type'] not in [ 'dirv', 'vels' ]:
+				continue
+			key = ( variable['altitude'], variable['statistic'] )
+			if key in dictionary and dictionary[key][0] != variable['type']:
+				otherType, otherColumn = dictionary.pop( key )
+				if variable['type'] == 'vels':
+					windRoseLayouts.append( ( otherColumn, column, layout ) )
+				else:
+					windRoseLayouts.append( ( column, otherColumn, layout ) )
+			else:
+				dictionary[key] = ( variable['type'], column )
 
-		#release memory
-		del dataFrame
-		del updateDataFrame
+		return windRoseLayouts
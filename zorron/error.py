@@ -7,3 +7,13 @@ class ZNMissingFieldError(ZNError):
 
 	def __init__(self,field):
 		self.value = "Field %s is missing" % ( field )
+
+class ZNQueueFullError(ZNError):
+
+	def __init__(self,queueLength):
+		self.value = "Action queue is full (%s)" % ( queueLength )
+
+class ZNQueueClosedError(ZNError):
+
+	def __init__(self):
+		self.value = "Action queue is closed"
@@ -29,14 +29,22 @@ import zorron.util as util
 import zorron.excelwriter as excelwriter
 import zorron.encoding as encoding
 
+from zorron.cache import ZNResultCache
+
 class ZNFormatHandler:
 
-	def __init__(self,temporaryDirectory):
+	def __init__(self,temporaryDirectory,cacheSize=0,cacheTime=3600):
 
 		self.jsonFormatter  = ZNJSONFormatter()
 		self.excelFormatter = ZNExcelFormatter(temporaryDirectory)
 
-	def handle(self,dataBase,request,answer):
+		#formatted outputs, excel files are reused while younger than cacheTime seconds
+		self.outputCache = None
+		self.cacheTime	 = cacheTime
+		if cacheSize > 0:
+			self.outputCache = ZNResultCache( cacheSize, [] )
+
+	def handle(self,dataBase,request,answer,cacheKey=None,tableCodes=None):
 
 		formatType = request['outputFormat']['type']
 	
@@ -46,8 +54,39 @@ class ZNFormatHandler:
 		elif formatType  == 'excel':
 			output = self.excelFormatter.format( dataBase,answer, request )
 
+		if cacheKey is not None and output is not None:
+			self.outputCache.put( cacheKey, tableCodes, ( formatType, output ) )
+
 		return output
 
+	def getCachedOutput(self,cacheKey):
+
+		entry = self.outputCache.get( cacheKey )
+		if entry is None:
+			return None
+
+		formatType, output = entry
+
+		#the file may have been removed, or will be soon
+		if formatType == 'excel' and output['result'] is not None:
+			filePath = output['result']
+			if not os.path.isfile( filePath ) or \
+			time.time() - os.path.getctime( filePath ) > self.cacheTime:
+				self.outputCache.discard( cacheKey )
+				return None
+
+		return dict( output )
+
+	def invalidate(self,tableCode):
+
+		if self.outputCache is not None:
+			self.outputCache.invalidate( tableCode )
+
+	def clear(self):
+
+		if self.outputCache is not None:
+			self.outputCache.clear()
+
 class ZNJSONFormatter:
 
 	def format(self,dataBase,answer,request):
@@ -571,14 +610,13 @@ class ZNExcelFormatter:
 
 		self._formatColumnNames( answer , dataColumns )
 
-		#data
-		boundArray = numpy.array( answer['result'][0]['data'] )[ :, 0]
-		boundArray = numpy.array( boundArray.tolist() )
+		#data, all series share the bin edges
+		binEdges = numpy.array( answer['result'][0]['data']['binEdges'] )
+		boundArray = numpy.column_stack( ( binEdges[:-1], binEdges[1:] ) )
 
 		seriesArray = []
 		for item in answer['result']:
-			series   = numpy.array( item['data'] )
-			seriesArray.append( series[:,1] )
+			seriesArray.append( numpy.array( item['data']['histogram'] ) )
 
 		seriesArray = numpy.array( seriesArray )
 		dataArray = numpy.concatenate( ( boundArray, seriesArray.T ), axis = 1 )
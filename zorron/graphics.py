@@ -126,11 +126,9 @@ class ZNHistogramChartCreator:
 		figure = plt.figure()
 		for param in parameters:
 		
-			array = numpy.array( param['data'] )
-			x = array[:,0]
-			y = array[:,1]
-			
-			x = [ a[0] for a in x]
+			x = numpy.array( param['data']['binEdges'] )[:-1]
+			y = numpy.array( param['data']['histogram'] )
+
 			plt.plot(x,y,label="%s" %( param['tableCode']))
 			plt.legend()
 		
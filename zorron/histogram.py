@@ -0,0 +1,182 @@
+"""
+ZORRO-N - Meteorological Time Series DataBase Engine
+Copyright (C) 2014 - Ernesto Castillo Navarrete
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import numpy
+
+class ZNHistogramLevel:
+
+	def __init__(self,times,counts):
+
+		#one row per month with data, counts are month x bin (or month x bin x bin)
+		self.times	= times
+		self.counts	= counts
+
+	def head(self,position):
+
+		return ZNHistogramLevel( self.times[:position], self.counts[:position] )
+
+	def append(self,level):
+
+		return ZNHistogramLevel(
+					numpy.concatenate( ( self.times, level.times ) ),
+					numpy.concatenate( ( self.counts, level.counts ) )
+				)
+
+class ZNHistogramEngine:
+
+	def calculateBounds(self,valuesArrays):
+
+		#minimum and maximum of the values of all the series, nan without values
+		values = numpy.concatenate( valuesArrays )
+		values = values[ ~numpy.isnan( values ) ]
+		if len(values) == 0:
+			return numpy.nan, numpy.nan
+
+		return values.min(), values.max()
+
+	def calculateEdges(self,minimum,maximum,numberBins):
+
+		#same edges as numpy.histogram
+		return numpy.linspace( minimum, maximum, numberBins + 1 )
+
+	def calculateDirectionShift(self,numberBins):
+
+		#half a direction bin, the first bin is centered on north
+		return 360 / ( 2 * numberBins )
+
+	def shiftDirections(self,directions,numberBins):
+
+		#directions binned over 0-360 with edges shifted back afterwards
+		return ( directions + self.calculateDirectionShift( numberBins ) ) % 360
+
+	def count(self,valuesArrays,edges):
+
+		#series x bin counts with one bincount over the stacked values
+		numberSeries = len(valuesArrays)
+		numberBins = len(edges) - 1
+		values = numpy.concatenate( valuesArrays )
+		series = numpy.repeat( numpy.arange( numberSeries ), [ len(valuesArray) for valuesArray in valuesArrays ] )
+
+		bins, valid = self._locate( values, edges )
+		counts = numpy.bincount( series[valid] * numberBins + bins[valid], minlength=numberSeries * numberBins )
+
+		return counts.reshape( ( numberSeries, numberBins ) )
+
+	def countPairs(self,xArrays,yArrays,xEdges,yEdges):
+
+		#series x xbin x ybin counts with one bincount over the stacked pairs,
+		#x edges are shared and y edges have one row per series
+		numberSeries = len(xArrays)
+		numberX = len(xEdges) - 1
+		numberY = yEdges.shape[1] - 1
+		x = numpy.concatenate( xArrays )
+		y = numpy.concatenate( yArrays )
+		series = numpy.repeat( numpy.arange( numberSeries ), [ len(xArray) for xArray in xArrays ] )
+
+		xBins, xValid = self._locate( x, xEdges )
+		yBins, yValid = self._locateRows( y, series, yEdges )
+		valid = xValid & yValid
+		counts = numpy.bincount( ( series[valid] * numberX + xBins[valid] ) * numberY + yBins[valid], minlength=numberSeries * numberX * numberY )
+
+		return counts.reshape( ( numberSeries, numberX, numberY ) )
+
+	def countMonths(self,times,values,edges):
+
+		#month x bin counts of sorted timestamps, for the rollups
+		numberBins = len(edges) - 1
+		monthTimes, rows = self._splitMonths( times )
+
+		bins, valid = self._locate( values, edges )
+		counts = numpy.bincount( rows[valid] * numberBins + bins[valid], minlength=len(monthTimes) * numberBins )
+
+		return ZNHistogramLevel( monthTimes, counts.reshape( ( len(monthTimes), numberBins ) ) )
+
+	def countMonthPairs(self,times,x,y,xEdges,yEdges):
+
+		#month x xbin x ybin counts of sorted timestamps, for the rollups
+		numberX = len(xEdges) - 1
+		numberY = len(yEdges) - 1
+		monthTimes, rows = self._splitMonths( times )
+
+		xBins, xValid = self._locate( x, xEdges )
+		yBins, yValid = self._locate( y, yEdges )
+		valid = xValid & yValid
+		counts = numpy.bincount( ( rows[valid] * numberX + xBins[valid] ) * numberY + yBins[valid], minlength=len(monthTimes) * numberX * numberY )
+
+		return ZNHistogramLevel( monthTimes, counts.reshape( ( len(monthTimes), numberX, numberY ) ) )
+
+	def density(self,counts,edges):
+
+		#as numpy.histogram with density, nan for series without values
+		totals = counts.sum( axis=-1 )
+		totals = numpy.where( totals > 0, totals, numpy.nan )
+
+		return counts / numpy.diff( edges ) / numpy.expand_dims( totals, -1 )
+
+	def densityPairs(self,counts,xEdges,yEdges):
+
+		#as numpy.histogram2d with normed, counts are xbin x ybin
+		total = counts.sum()
+		if total == 0:
+			total = numpy.nan
+
+		return counts / numpy.outer( numpy.diff( xEdges ), numpy.diff( yEdges ) ) / float( total )
+
+	def _splitMonths(self,times):
+
+		#month starts and the month of each row
+		months = times.astype('datetime64[ns]').astype('datetime64[M]').astype('datetime64[ns]').astype(numpy.int64)
+		if len(months) == 0:
+			return months, numpy.zeros( 0, dtype=numpy.int64 )
+
+		monthStarts = numpy.flatnonzero( numpy.concatenate( ( [ True ], months[1:] != months[:-1] ) ) )
+		rows = numpy.repeat( numpy.arange( len(monthStarts) ), numpy.diff( numpy.append( monthStarts, len(months) ) ) )
+
+		return months[monthStarts], rows
+
+	def _locate(self,values,edges):
+
+		#bins are closed left except the last one, values outside and nan are not counted
+		numberBins = len(edges) - 1
+		bins = numpy.searchsorted( edges, values, 'right' ) - 1
+		bins[ values == edges[-1] ] = numberBins - 1
+		valid = ( bins >= 0 ) & ( bins < numberBins ) & ~numpy.isnan( values )
+
+		return bins, valid
+
+	def _locateRows(self,values,rows,edges):
+
+		#as _locate with the edges of the row of each value
+		numberBins = edges.shape[1] - 1
+		bins = numpy.zeros( len(values), dtype=numpy.int64 )
+		valid = ~numpy.isnan( values )
+		valid[valid] = ( values[valid] >= edges[rows[valid],0] ) & ( values[valid] <= edges[rows[valid],-1] )
+
+		values = values[valid]
+		rows = rows[valid]
+		firstEdges = edges[rows,0]
+		located = numpy.floor( ( values - firstEdges ) / ( edges[rows,-1] - firstEdges ) * numberBins ).astype(numpy.int64)
+		located = numpy.clip( located, 0, numberBins - 1 )
+
+		#rounding of the division, moved to the bin between its edges
+		located = located - ( values < edges[rows,located] )
+		located = located + ( ( values >= edges[rows,located+1] ) & ( located < numberBins - 1 ) )
+		bins[valid] = located
+
+		return bins, valid
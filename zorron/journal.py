@@ -0,0 +1,132 @@
+"""
+ZORRO-N - Meteorological Time Series DataBase Engine
+Copyright (C) 2014 - Ernesto Castillo Navarrete
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import os
+import struct
+import threading
+import traceback
+import numpy
+
+#record layout:
+#	number of rows (8 bytes) | number of columns (8 bytes) | float64 rows
+
+RECORD_HEADER = '<QQ'
+
+class ZNWriteAheadLog:
+
+	def __init__(self,path):
+
+		self.path = path
+
+	def exists(self):
+
+		return os.path.isfile( self.path )
+
+	def append(self,dataArray):
+
+		dataArray = numpy.ascontiguousarray( dataArray, dtype=numpy.float64 )
+		numberRows, numberColumns = dataArray.shape
+
+		logFile = open( self.path, 'ab' )
+		try:
+			logFile.write( struct.pack( RECORD_HEADER, numberRows, numberColumns ) )
+			dataArray.tofile( logFile )
+			logFile.flush()
+			os.fsync( logFile.fileno() )
+		finally:
+			logFile.close()
+
+	def read(self):
+
+		dataArrays = []
+		if not self.exists():
+			return dataArrays
+
+		headerSize = struct.calcsize( RECORD_HEADER )
+		logFile = open( self.path, 'rb' )
+		try:
+			while True:
+				header = logFile.read( headerSize )
+				if len(header) < headerSize:
+					break
+				numberRows, numberColumns = struct.unpack( RECORD_HEADER, header )
+				numberBytes = numberRows * numberColumns * 8
+				body = logFile.read( numberBytes )
+
+				#incomplete record, written while crashing
+				if len(body) < numberBytes:
+					break
+
+				dataArray = numpy.fromstring( body, dtype=numpy.float64 )
+				dataArrays.append( dataArray.reshape( ( numberRows, numberColumns ) ) )
+		finally:
+			logFile.close()
+
+		return dataArrays
+
+	def rotate(self,segmentPath):
+
+		#move the records to a segment, later records start a new log
+		segment = ZNWriteAheadLog( segmentPath )
+		if segment.exists():
+			#left by a failed compaction, records are kept in order
+			for dataArray in self.read():
+				segment.append( dataArray )
+			self.clear()
+		elif self.exists():
+			os.rename( self.path, segmentPath )
+
+		return segment
+
+	def clear(self):
+
+		if self.exists():
+			os.remove( self.path )
+
+class ZNCompactor(threading.Thread):
+
+	def __init__(self,updater,dataBase,interval,executor=None):
+
+		threading.Thread.__init__(self)
+		self.daemon	= True
+		self.updater	= updater
+		self.dataBase	= dataBase
+		self.interval	= interval
+		self.executor	= executor
+		self.stopEvent	= threading.Event()
+
+	def run(self):
+
+		while not self.stopEvent.is_set():
+
+			self.stopEvent.wait( self.interval )
+
+			try:
+				if self.executor is None:
+					self.updater.compact( self.dataBase )
+				else:
+					#e.g. run as an update of the server scheduler
+					self.executor( self.updater.compact, self.dataBase )
+			except:
+				traceback.print_exc()
+
+	def finalize(self):
+
+		self.stopEvent.set()
+		self.join()
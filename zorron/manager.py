@@ -20,6 +20,11 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import json
 import os
 import shutil
+import threading
+import time
+import traceback
+import multiprocessing
+import multiprocessing.pool
 
 import numpy
 import tables
@@ -31,7 +36,11 @@ from zorron.model import ZNDataBase
 from zorron.znparser import ZNCSVParser
 from zorron.metadata import ZNMetaDataLoader
 from zorron.data import ZNPandasDataEngine
-from zorron.storage import ZNPyTablesStorageEngine
+from zorron.storage import ZNPyTablesStorageEngine,ZNColumnStorageEngine
+from zorron.snapshot import ZNSnapshotEngine
+from zorron.journal import ZNWriteAheadLog,ZNCompactor
+from zorron.cache import ZNResultCache
+from zorron.filter import ZNTableFilter
 from zorron.request import ZNRequestHandler
 from zorron.format import ZNFormatHandler
 from zorron.error import ZNMissingFieldError
@@ -61,18 +70,66 @@ class ZNManager:
 
 class ZNDefaultManager(ZNManager):
 
-	def __init__(self,temporaryDirectory='/tmp'):
+	def __init__(self,temporaryDirectory='/tmp',configuration=None):
+
+		if configuration is None:
+			configuration = {}
+
+		#lazy loading: memory budget in megabytes
+		lazyLoading  = configuration.get( 'lazyLoading', False )
+		memoryBudget = configuration.get( 'memoryBudget', None )
+		if memoryBudget is not None:
+			memoryBudget = int( memoryBudget * 1024 * 1024 )
+
+		#eager loading: number of worker processes
+		loadingWorkers = configuration.get( 'loadingWorkers', 1 )
+
+		#batch updates: number of worker threads
+		updateWorkers = configuration.get( 'updateWorkers', 1 )
+
+		#write-ahead log: compaction interval in seconds
+		writeAheadLog = configuration.get( 'writeAheadLog', False )
+		self.compactionInterval = configuration.get( 'compactionInterval', 300 )
+		self.compactor = None
+		self.compactionExecutor = None
+
+		#result cache: number of answers kept, 0 disables it
+		resultCacheSize = configuration.get( 'resultCacheSize', 0 )
+
+		#output cache: number of formatted outputs kept and
+		#time in seconds an excel file is reused
+		outputCacheSize = configuration.get( 'outputCacheSize', 0 )
+		outputCacheTime = configuration.get( 'outputCacheTime', 3600 )
+
+		#storage engine: 'pytables' or 'column'
+		storageEngines = {
+					'pytables' : ZNPyTablesStorageEngine,
+					'column' : ZNColumnStorageEngine
+				}
+		storageEngineName = configuration.get( 'storageEngine', 'pytables' )
 
 		metaDataLoader 	= ZNMetaDataLoader()
-		dataEngine     	= ZNPandasDataEngine()
-		storageEngine  	= ZNPyTablesStorageEngine()
+		dataEngine     	= ZNPandasDataEngine( configuration.get( 'rollups', False ), configuration.get( 'sketchAccuracy', None ), configuration.get( 'histogramLayouts', None ) )
+		storageEngine  	= storageEngines[storageEngineName]()
+		snapshotEngine	= ZNSnapshotEngine()
 
+		self.configuration	= configuration
 		self.creator  		= ZNCreator( dataEngine, storageEngine )
 		self.remover    	= ZNRemover( dataEngine, storageEngine )
-		self.loader   		= ZNLoader( metaDataLoader, dataEngine, storageEngine )
-		self.updater  		= ZNUpdater( dataEngine, storageEngine )
+		self.loader   		= ZNLoader( metaDataLoader, dataEngine, storageEngine, lazyLoading, memoryBudget, loadingWorkers )
+		self.snapshotEngine	= snapshotEngine
+
+		#load from a valid snapshot when available
+		if configuration.get( 'snapshot', False ):
+			self.loader.snapshotEngine = snapshotEngine
+		self.updater  		= ZNUpdater( dataEngine, storageEngine, updateWorkers, writeAheadLog )
+		self.updater.storageLock = self.loader.storageLock
 		self.requestHandler 	= ZNRequestHandler()
-		self.formatHandler	= ZNFormatHandler(temporaryDirectory)
+		self.formatHandler	= ZNFormatHandler( temporaryDirectory, outputCacheSize, outputCacheTime )
+		self.tableFilter	= ZNTableFilter()
+		self.resultCache	= None
+		if resultCacheSize > 0:
+			self.resultCache = ZNResultCache( resultCacheSize )
 	
 	def createDataBase( self, metaData, outputDirectory ):
 		dataBase = self.creator.createDataBase( metaData, outputDirectory )
@@ -85,24 +142,122 @@ class ZNDefaultManager(ZNManager):
 	def loadDataBase( self, inputDirectory ):
 		dataBase = self.loader.loadDataBase( inputDirectory )
 		dataBase.metaData['rootDirectory'] = os.path.abspath( inputDirectory )
+
+		#replay updates not yet compacted into storage
+		self.updater.recover( dataBase )
+
+		if self.updater.writeAheadLog:
+			self.compactor = ZNCompactor( self.updater, dataBase, self.compactionInterval, self.compactionExecutor )
+			self.compactor.start()
+
 		return dataBase
+
+	def finalize( self, dataBase ):
+
+		#stop the compactor after a last compaction
+		if self.compactor is not None:
+			self.compactor.finalize()
+			self.compactor = None
+		else:
+			self.updater.compact( dataBase )
 	
+	def snapshotDataBase( self, dataBase, outputPath=None ):
+
+		pinnedDataBase = dataBase.pin()
+		try:
+			return self.snapshotEngine.write( pinnedDataBase, outputPath )
+		finally:
+			dataBase.release( pinnedDataBase )
+
 	def createTable( self, dataBase, metaData, dataArray=None ):
 
 		self.creator.createTable( dataBase, metaData, dataArray )
+
+		#requests without table filter now select one more table
+		if self.resultCache is not None:
+			self.resultCache.clear()
+		self.formatHandler.clear()
 	
 	def updateTable( self, dataBase, tableCode, dataArray ):
 
 		self.updater.updateTable( dataBase, tableCode, dataArray )
+		self._invalidate( [ tableCode ] )
+
+	def updateTables( self, dataBase, dataArrays ):
+
+		try:
+			return self.updater.updateDataBase( dataBase, dataArrays )
+		finally:
+			self._invalidate( dataArrays.keys() )
 	
 	def removeTable( self, dataBase, tableCode ):
 		self.remover.removeTable( dataBase, tableCode )
+		self._invalidate( [ tableCode ] )
 	
 	def requestData( self, dataBase, request  ):
-		answer = self.requestHandler.handle( dataBase, request ) 
-		answer = self.formatHandler.handle( dataBase, request, answer )
+
+		#keys are computed before handling, handlers modify the request
+		answer = None
+		tableCodes = None
+		resultKey = None
+		outputKey = None
+		outputCache = self.formatHandler.outputCache
+		if request['type'] == 'data' and ( self.resultCache is not None or outputCache is not None ):
+
+			tableParameters = request.get( 'table', None )
+			tableCodes = self.tableFilter.filter( dataBase.metaData, tableParameters )
+			versions = {}
+			for tableCode in tableCodes:
+				versions[tableCode] = dataBase.data.versions.get( tableCode, 0 )
+
+			if self.resultCache is not None:
+				resultKey = self.resultCache.getKey( request, versions )
+			if outputCache is not None:
+				outputKey = outputCache.getKey( request, versions )
+
+		#same request already formatted
+		if outputKey is not None:
+			output = self.formatHandler.getCachedOutput( outputKey )
+			if output is not None:
+				return output
+
+		if resultKey is not None:
+			answer = self.resultCache.get( resultKey )
+
+		if answer is None:
+			answer = self.requestHandler.handle( dataBase, request ) 
+			if resultKey is not None:
+				self.resultCache.put( resultKey, tableCodes, answer )
+
+		#formatters modify the answer, the cached one is kept intact
+		answer = self.formatHandler.handle( dataBase, request, dict( answer ), outputKey, tableCodes )
 		return answer
 
+	def getLoadTimes( self ):
+
+		#seconds spent loading each table at startup
+		return dict( self.loader.loadTimes )
+
+	def getCacheStatistics( self ):
+
+		statistics = {
+				'results' : None,
+				'outputs' : None
+			}
+		if self.resultCache is not None:
+			statistics['results'] = self.resultCache.getStatistics()
+		if self.formatHandler.outputCache is not None:
+			statistics['outputs'] = self.formatHandler.outputCache.getStatistics()
+
+		return statistics
+
+	def _invalidate( self, tableCodes ):
+
+		for tableCode in tableCodes:
+			if self.resultCache is not None:
+				self.resultCache.invalidate( tableCode )
+			self.formatHandler.invalidate( tableCode )
+
 class ZNCreator:
 
 	def __init__(self,dataEngine,storageEngine,):
@@ -114,7 +269,7 @@ class ZNCreator:
 
 		#containers
 		data 	= self.dataEngine.createData()
-		storage = self.storageEngine.createStorage()
+		storage = self.storageEngine.createStorage( metaData.get( 'storage', None ) )
 
 		#copy metadata file
 		outputPath = os.path.join( outputDirectory, 'metadata.js' )
@@ -166,40 +321,123 @@ class ZNCreator:
 		#create data structure in disk
 		self.storageEngine.createTable(metaData,dataArray,dataBase.storage,outputDirectory)
 
+def _loadTableData(parameters):
+
+	#executed in a worker process of ZNLoader
+	storageEngine, dataEngine, tableMetaData, inputDirectory = parameters
+
+	startTime = time.time()
+	dataArray = storageEngine.readTableData( inputDirectory )
+	dataFrame = dataEngine.createDataFrame( tableMetaData, dataArray )
+	loadTime  = time.time() - startTime
+
+	return inputDirectory, dataFrame, loadTime
+
 class ZNLoader:
 
-	def __init__(self,metaDataLoader,dataEngine,storageEngine):
+	def __init__(self,metaDataLoader,dataEngine,storageEngine,lazyLoading=False,memoryBudget=None,workers=1):
 
 		self.metaDataLoader 	= metaDataLoader
 		self.dataEngine 	= dataEngine
 		self.storageEngine 	= storageEngine
+		self.lazyLoading	= lazyLoading
+		self.memoryBudget	= memoryBudget
+		self.workers		= workers
+		self.loadTimes		= {}
+		self.snapshotEngine	= None
+
+		#shared with the updater, lazy reads and writes do not overlap
+		self.storageLock	= threading.Lock()
 
 	def loadDataBase(self,inputDirectory):
 
+		#fast path
+		if self.snapshotEngine is not None and self.snapshotEngine.isValid( inputDirectory, self.storageEngine ):
+			return self.loadSnapshot( inputDirectory )
+
 		#metadata
 		metaData = self.metaDataLoader.load( inputDirectory ) 	
 
 		#data
-		data = self.dataEngine.createData()	
+		if self.lazyLoading:
+			#tables are read from disk when a request touches them
+			loadFunction = lambda tableCode : self._readTable( dataBase, tableCode )
+			data = self.dataEngine.createData( loadFunction, self.memoryBudget )
+		else:
+			data = self.dataEngine.createData()	
 
 		#storage
-		storage = self.storageEngine.createStorage()
+		storage = self.storageEngine.createStorage( metaData.get( 'storage', None ) )
 
 		#database
 		dataBase = ZNDataBase( metaData, data, storage )
 
 		#iterate subdirectories
+		tableDirectories = []
 		fileNames = os.listdir(inputDirectory)
 		for fileName in fileNames:
 			inputPath = os.path.join( inputDirectory, fileName )	
 			if os.path.isfile(inputPath):
 				continue
-			self.loadTable(dataBase,inputPath)
+			tableDirectories.append( inputPath )
+
+		self.loadTimes = {}
+		if self.workers > 1 and not self.lazyLoading:
+			self.loadTablesParallel( dataBase, tableDirectories )
+		else:
+			for tableDirectory in tableDirectories:
+				self.loadTable( dataBase, tableDirectory )
 
 		return dataBase
+
+	def loadSnapshot(self,inputDirectory):
+
+		inputPath = self.snapshotEngine.getPath( inputDirectory )
+		metaData, dataFrames = self.snapshotEngine.load( inputPath )
+		metaData['rootDirectory'] = os.path.abspath( inputDirectory )
+
+		data = self.dataEngine.createData()
+		storage = self.storageEngine.createStorage( metaData.get( 'storage', None ) )
+		dataBase = ZNDataBase( metaData, data, storage )
+
+		for tableCode,tableMetaData in metaData['tables'].items():
+			tableDirectory = os.path.join( inputDirectory, '%s' % ( tableCode ) )
+			self.storageEngine.loadTableStorage( storage, tableCode, tableDirectory )
+			self.dataEngine.insertTable( tableMetaData, data, dataFrames[tableCode] )
+
+		return dataBase
+
+	def loadTablesParallel(self,dataBase,tableDirectories):
+
+		#metadata
+		tablesMetaData = {}
+		tasks = []
+		for tableDirectory in tableDirectories:
+			inputPath = os.path.join( tableDirectory, 'metadata.js' )
+			tableMetaData = self.metaDataLoader.loadFile( inputPath )
+			tablesMetaData[tableDirectory] = tableMetaData
+			tasks.append( ( self.storageEngine, self.dataEngine, tableMetaData, tableDirectory ) )
+
+		#read and build dataframes in worker processes
+		pool = multiprocessing.Pool( self.workers )
+		try:
+			for tableDirectory,dataFrame,loadTime in pool.imap_unordered( _loadTableData, tasks ):
+
+				tableMetaData = tablesMetaData[tableDirectory]
+				tableCode = tableMetaData['code']
+
+				self.storageEngine.loadTableStorage( dataBase.storage, tableCode, tableDirectory )
+				self.dataEngine.insertTable( tableMetaData, dataBase.data, dataFrame )
+
+				self.loadTimes[tableCode] = loadTime
+		finally:
+			pool.close()
+			pool.join()
 	
 	def loadTable(self,dataBase,inputDirectory):
 
+		startTime = time.time()
+
 		#load metadata
 		inputPath = os.path.join( inputDirectory, 'metadata.js' )
 		tableMetaData = self.metaDataLoader.loadFile( inputPath )
@@ -209,63 +447,250 @@ class ZNLoader:
 		#load storage
 		self.storageEngine.loadTableStorage(dataBase.storage,tableCode,inputDirectory)
 
+		#defer data until first use
+		if self.lazyLoading:
+			dataBase.data.dataFrames.register( tableCode )
+			return
+
 		#load data
 		dataArray = self.storageEngine.getTableData(dataBase.storage,tableCode)
 		
 		#data
 		self.dataEngine.createTable( tableMetaData, dataBase.data, dataArray )
+
+		loadTime = time.time() - startTime
+		self.loadTimes[tableCode] = loadTime
+
+	def _readTable(self,dataBase,tableCode):
+
+		tableMetaData = dataBase.metaData['tables'][tableCode]
+		with self.storageLock:
+			dataArray = self.storageEngine.getTableData( dataBase.storage, tableCode )
+		dataFrame = self.dataEngine.createDataFrame( tableMetaData, dataArray )
+
+		#rollups and running statistics, as for tables loaded at startup
+		self.dataEngine.attachTable( tableMetaData, dataBase.data, dataFrame )
+
+		return dataFrame
 		
 class ZNUpdater:
 	
-	def __init__(self,dataEngine,storageEngine):
+	def __init__(self,dataEngine,storageEngine,workers=1,writeAheadLog=False):
 		
 		self.dataEngine = dataEngine
 		self.storageEngine = storageEngine
+		self.workers = workers
+		self.writeAheadLog = writeAheadLog
+
+		#pytables is not thread safe, writes are serialized
+		self.storageLock = threading.Lock()
+
+		#logged tables: first row that differs from storage
+		self.pendingPositions = {}
+		self.logLock = threading.Lock()
+		self.compactionLock = threading.Lock()
 
 	def updateDataBase(self,dataBase,dataArrays):
 		
-		#update tables
-		tablesMetaData = dataBase.metaData['tables']
-
-		for tableMetaData in tablesMetaData:
-			tableCode = tableMetaData['code']
-			self.updateTableData( tableCode, dataBase, dataArrays[tableCode] )
+		#update tables, in parallel when workers > 1
+		tableCodes = dataArrays.keys()
+		updateFunction = lambda tableCode : self._updateTableTimed( dataBase, tableCode, dataArrays[tableCode] )
+
+		if self.workers > 1 and len(tableCodes) > 1:
+			pool = multiprocessing.pool.ThreadPool( min( self.workers, len(tableCodes) ) )
+			try:
+				results = pool.map( updateFunction, tableCodes )
+			finally:
+				pool.close()
+				pool.join()
+		else:
+			results = map( updateFunction, tableCodes )
+
+		report = {}
+		for k in range( len(tableCodes) ):
+			report[ tableCodes[k] ] = results[k]
+
+		return report
+
+	def _updateTableTimed(self,dataBase,tableCode,dataArray):
+
+		#a failing table does not stop the batch
+		startTime = time.time()
+		result = { 'rows' : len(dataArray) }
+		try:
+			self.updateTable( dataBase, tableCode, dataArray )
+		except:
+			result['error'] = traceback.format_exc()
+		result['time'] = time.time() - startTime
+
+		return result
 	
 	def updateTable(self, dataBase, tableCode , dataArray ):
 		
-		tableMetaData = dataBase.metaData['tables'][tableCode]
+		if len(dataArray) == 0:
+			return
+
+		#sorted rows without duplicated timestamps
+		dataArray = self._prepareDataArray( dataArray )
+
+		if self.writeAheadLog:
+			self._updateTableLogged( dataBase, tableCode, dataArray )
+			return
 
 		#compute row range to be updated
 		data = dataBase.data
 		dataFrame = data.dataFrames[tableCode]
 		firstIndexValue = numpy.int64( dataArray[0][0] )
-		timeIndexArray = dataFrame.index.astype(numpy.int64)
-		firstPosition  = self._computeFirstPosition( timeIndexArray,firstIndexValue)
+		timeIndexArray = dataFrame.index.asi8
+		firstPosition  = numpy.searchsorted( timeIndexArray, firstIndexValue, 'left' )
 		lastPosition = len(dataFrame) - 1
 		
 		#update data
-		self.dataEngine.updateTableData( data, tableCode, dataArray )
+		self.dataEngine.updateTableData( data, tableCode, dataArray, dataBase.metaData['tables'][tableCode] )
+
+		#read before taking the storage lock, lazy reloads take it too
+		dataFrame = data.dataFrames[tableCode]
+
+		#update storage, flushed once
+		with self.storageLock:
+			self._updateStorage( dataBase, tableCode, dataArray, dataFrame, firstPosition, lastPosition )
+			self.storageEngine.flushTable( dataBase.storage, tableCode )
+
+	def _updateTableLogged(self, dataBase, tableCode, dataArray ):
+
+		with self.logLock:
+
+			#record first, then apply in memory
+			self._getLog( dataBase, tableCode ).append( dataArray )
+
+			#the table is the only copy of the update until compaction
+			data = dataBase.data
+			data.keepTable( tableCode )
+			dataFrame = data.dataFrames[tableCode]
+			firstIndexValue = numpy.int64( dataArray[0][0] )
+			firstPosition  = numpy.searchsorted( dataFrame.index.asi8, firstIndexValue, 'left' )
+
+			self.dataEngine.updateTableData( data, tableCode, dataArray, dataBase.metaData['tables'][tableCode] )
+
+			#rows before the smallest first position are still equal in storage
+			if tableCode in self.pendingPositions:
+				firstPosition = min( firstPosition, self.pendingPositions[tableCode] )
+			self.pendingPositions[tableCode] = firstPosition
+
+	def compact(self,dataBase):
+
+		#fold logged updates into storage, one compaction at a time
+		with self.compactionLock:
+
+			#copy the pending rows and move the logs aside, updates go on
+			#in new logs while storage is written
+			tasks = []
+			with self.logLock:
+
+				for tableCode,firstPosition in self.pendingPositions.items():
+
+					del self.pendingPositions[tableCode]
+					if tableCode not in dataBase.metaData['tables']:
+						dataBase.data.letGoTable( tableCode )
+						continue
 
-		#update storage
+					dataFrame = dataBase.data.dataFrames[tableCode]
+					dataArray = self.dataEngine.getFrameData( dataFrame, firstPosition, len(dataFrame) - 1 )
+					segment = self._getLog( dataBase, tableCode ).rotate( self._getSegmentPath( dataBase, tableCode ) )
+					tasks.append( ( tableCode, firstPosition, dataArray, segment ) )
+
+			storage = dataBase.storage
+			for tableCode,firstPosition,dataArray,segment in tasks:
+
+				with self.storageLock:
+
+					storageSize = self.storageEngine.getTableSize( storage, tableCode )
+					if firstPosition < storageSize:
+						self.storageEngine.deleteTableData( storage, tableCode, firstPosition, storageSize - 1, False )
+
+					self.storageEngine.appendTableData( tableCode, dataArray, storage, False )
+					self.storageEngine.flushTable( storage, tableCode )
+
+				segment.clear()
+
+				#updated again while compacting, the table stays in memory
+				with self.logLock:
+					if tableCode not in self.pendingPositions:
+						dataBase.data.letGoTable( tableCode )
+
+	def recover(self,dataBase):
+
+		#replay logs left by a previous run directly into storage,
+		#a segment of an interrupted compaction goes first
+		for tableCode in dataBase.metaData['tables'].keys():
+
+			logs = [ ZNWriteAheadLog( self._getSegmentPath( dataBase, tableCode ) ), self._getLog( dataBase, tableCode ) ]
+			logs = [ log for log in logs if log.exists() ]
+			if len(logs) == 0:
+				continue
+
+			writeAheadLog = self.writeAheadLog
+			self.writeAheadLog = False
+			try:
+				for log in logs:
+					for dataArray in log.read():
+						self.updateTable( dataBase, tableCode, dataArray )
+			finally:
+				self.writeAheadLog = writeAheadLog
+
+			for log in logs:
+				log.clear()
+
+	def _getLog(self,dataBase,tableCode):
+
+		rootDirectory = dataBase.metaData['rootDirectory']
+		path = os.path.join( rootDirectory, '%s' % ( tableCode ), 'data.wal' )
+
+		return ZNWriteAheadLog( path )
+
+	def _getSegmentPath(self,dataBase,tableCode):
+
+		#records being compacted
+		rootDirectory = dataBase.metaData['rootDirectory']
+
+		return os.path.join( rootDirectory, '%s' % ( tableCode ), 'data.wal.compacting' )
+
+	def _updateStorage(self, dataBase, tableCode, dataArray, dataFrame, firstPosition, lastPosition ):
+
+		#dataFrame is the updated table, read by the caller
 		storage = dataBase.storage
+
+		#pure append: only the new rows are written
+		if firstPosition > lastPosition:
+			self.storageEngine.appendTableData( tableCode, dataArray, storage, False )
+			return
+
+		#partitioned storage: rewrite only the partitions touched by the update
+		timeArray = dataArray[:,0]
+		partitionBounds = self.storageEngine.getPartitionBounds( storage, tableCode, timeArray[0], timeArray[-1] )
+		if partitionBounds is not None:
+			lowerBound, upperBound = partitionBounds
+			timeIndexArray = dataFrame.index.asi8
+			firstPosition = numpy.searchsorted( timeIndexArray, lowerBound, 'left' )
+			lastPosition  = numpy.searchsorted( timeIndexArray, upperBound, 'left' ) - 1
+			dataArray = self.dataEngine.getFrameData( dataFrame, firstPosition, lastPosition )
+			self.storageEngine.replacePartitions( storage, tableCode, lowerBound, upperBound, dataArray, False )
+			return
 		
-		if firstPosition <= lastPosition:
-			self.storageEngine.deleteTableData( storage, tableCode, firstPosition,lastPosition )
+		#late data: rewrite from the first changed row
+		self.storageEngine.deleteTableData( storage, tableCode, firstPosition, lastPosition, False )
 
-		dataFrame = data.dataFrames[tableCode]
 		lastPosition = len(dataFrame) - 1
-		dataArray = self.dataEngine.getTableData( data, tableCode, firstPosition,lastPosition )
-		self.storageEngine.appendTableData( tableCode, dataArray, storage  )
+		dataArray = self.dataEngine.getFrameData( dataFrame, firstPosition,lastPosition )
+		self.storageEngine.appendTableData( tableCode, dataArray, storage, False )
 
-	def _computeFirstPosition(self,array,value):
+	def _prepareDataArray(self,dataArray):
 
-		firstPosition = 0
-		for a in array:
-			if value <= a:
-				break
-			firstPosition = firstPosition + 1
+		timeArray = dataArray[:,0]
+		if numpy.all( timeArray[1:] > timeArray[:-1] ):
+			return dataArray
 
-		return firstPosition	
+		return util.resolveDuplicatedEntries( dataArray )
 
 class ZNRemover:
 
@@ -25,6 +25,25 @@ class ZNDataBase:
 		self.data 	= data
 		self.storage	= storage
 	
+	def pin(self):
+
+		#database whose tables do not change until released
+		view = self.data.pin()
+
+		metaData = dict( self.metaData )
+		metaData['tables'] = dict( self.metaData['tables'] )
+
+		#tables created after the pin are not visible
+		for tableCode in metaData['tables'].keys():
+			if tableCode not in view.dataFrames:
+				del metaData['tables'][tableCode]
+
+		return ZNDataBase( metaData, view, self.storage )
+
+	def release(self,pinnedDataBase):
+
+		self.data.release( pinnedDataBase.data )
+
 	def __del__(self):
 		
 		del self.metaData
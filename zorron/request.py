@@ -35,6 +35,7 @@ from zorron.filter import ZNTableFilter,ZNVariableFilter,ZNTimeFilter
 from zorron.transform import ZNTransformHandler
 from zorron.resampling import ZNResampler
 from zorron.computation import ZNComputationHandler
+from zorron.aggregate import ZNRollupEngine
 
 class ZNRequestHandler:
 
@@ -79,6 +80,14 @@ class ZNMetaDataRequestHandler:
 
 			result = metaData['tables'].keys()
 
+		elif name == 'samplingFrequency':
+
+			#seconds, None for tables not loaded yet or with less than two rows
+			tableCodes = request['tableCodes']
+			result = {}
+			for tableCode in tableCodes:
+				result[tableCode] = metaData['tables'][tableCode].get( 'samplingFrequency' )
+
 		elif name == 'variableTypeUnion':
 
 			tableCodes = request['tableCodes']
@@ -183,11 +192,24 @@ class ZNDataRequestHandler:
 		self.transformHandler		= ZNTransformHandler()
 		self.resampler			= ZNResampler()
 		self.computationHandler 	= ZNComputationHandler()
+		self.rollupEngine		= ZNRollupEngine()
 
 		self.transforms = None
 	
 	def handle(self,dataBase,request):
 
+		#the request sees the tables as they were when it started,
+		#updates published meanwhile do not wait for it
+		pinnedDataBase = dataBase.pin()
+		try:
+			answer = self._handle( pinnedDataBase, request )
+		finally:
+			dataBase.release( pinnedDataBase )
+
+		return answer
+
+	def _handle(self,dataBase,request):
+
 		metaData = dataBase.metaData
 		
 		#set transforms
@@ -234,50 +256,379 @@ class ZNDataRequestHandler:
 			if timeInterval['code'] != 'C':
  				timeBounds = self._roundTimeBounds( timeBounds, timeInterval )
 
-		#ITERATE 
-		seriesResults = []
+		timeParameters = None
+		if 'time' in request:
+			timeParameters = request['time']
+
+		#CYCLES, HISTOGRAMS AND SUMMARIES FROM ROLLUPS AND RUNNING STATISTICS
+		cubeResults = None
+		if 'computation' in request and 'resampling' not in request and len( transformSeriesArray ) == 0:
+			cubeResults = self._computeCubes( dataBase.data, seriesArray, request['computation'], timeBounds, timeParameters )
+			if cubeResults is None:
+				cubeResults = self._computeHistograms( dataBase.data, seriesArray, request['computation'], timeBounds, timeParameters )
+			if cubeResults is None:
+				cubeResults = self._computeWindRoses( dataBase.data, seriesArray, request['computation'], timeBounds, timeParameters )
+			if cubeResults is None:
+				cubeResults = self._computeSummaries( dataBase.data, seriesArray, request['computation'], timeBounds, timeParameters )
+
+		if cubeResults is not None:
+			seriesResults = cubeResults
+		else:
+			#RESAMPLING FROM ROLLUPS
+			rollupResults = None
+			if 'resampling' in request and len( transformSeriesArray ) == 0:
+				rollupResults = self.resampler.resampleRollups( dataBase.data, seriesArray, request['resampling'], timeBounds, timeInterval, timeParameters )
+
+			if rollupResults is not None:
+				seriesResults = rollupResults
+			else:
+				#PLAN TIME WINDOW
+				timeWindow = self._planTimeWindow( timeParameters )
+				seriesResults = self._processSeries( seriesArray, request, timeBounds, timeInterval, timeWindow )
+
+			#PERFORM COMPUTATION
+			if 'computation' in request:
+				computationParameters = request['computation']
+				seriesResults = self.computationHandler.handle( seriesResults, computationParameters )
+
+		computationTime = time.time() - startTime
+
+		answer['result']          = seriesResults
+		answer['computationTime'] = computationTime
+
+		return answer
+	
+	def _computeCubes( self, data, seriesArray, computationParameters, timeBounds, timeParameters ):
+
+		#same answer as filling and filtering the series before a cycle
+		#computation, None when the cubes cannot give it exactly
+		if computationParameters['name'] not in self.computationHandler.cubeComputations:
+			return None
+		if computationParameters['statistic']['name'] not in self.computationHandler.cubeStatistics:
+			return None
+
+		seriesMonths = self._selectRollupMonths( data, seriesArray, timeBounds, timeParameters )
+		if seriesMonths is None:
+			return None
+
+		seriesCubes = []
+		for series,rollup,column,monthTimes in seriesMonths:
+			if rollup.cube is None:
+				return None
+			seriesCube = {
+					'metaData' : series['metaData'],
+					'data' : self.rollupEngine.foldCube( rollup, column, monthTimes )
+					}
+			seriesCubes.append( seriesCube )
+
+		return self.computationHandler.handleCubes( seriesCubes, computationParameters )
+
+	def _computeHistograms( self, data, seriesArray, computationParameters, timeBounds, timeParameters ):
+
+		#same answer as filling and filtering the series before a histogram,
+		#None when the bins counted with the rollups cannot give it exactly
+		if computationParameters['name'] not in self.computationHandler.histogramComputations:
+			return None
+		for key in [ 'min', 'max', 'bins' ]:
+			if key not in computationParameters:
+				return None
+
+		seriesMonths = self._selectRollupMonths( data, seriesArray, timeBounds, timeParameters )
+		if seriesMonths is None:
+			return None
+
+		seriesCounts = []
+		for series,rollup,column,monthTimes in seriesMonths:
+			layout, counts = self.rollupEngine.foldHistogram( rollup, column, monthTimes )
+			if layout is None:
+				return None
+			for key in [ 'min', 'max', 'bins' ]:
+				if layout[key] != computationParameters[key]:
+					return None
+			seriesCount = {
+					'metaData' : series['metaData'],
+					'data' : counts
+					}
+			seriesCounts.append( seriesCount )
+
+		return self.computationHandler.handleCounts( seriesCounts, computationParameters )
+
+	def _computeWindRoses( self, data, seriesArray, computationParameters, timeBounds, timeParameters ):
+
+		#same answer as filling and filtering the series before a wind rose,
+		#None when the pairs counted with the rollups cannot give it exactly
+		if computationParameters['name'] not in self.computationHandler.windRoseComputations:
+			return None
+		for key in [ 'velocityMin', 'velocityMax' ]:
+			if key not in computationParameters:
+				return None
+		if not computationParameters['velocityMin'] < computationParameters['velocityMax']:
+			return None
+
+		seriesMonths = self._selectRollupMonths( data, seriesArray, timeBounds, timeParameters )
+		if seriesMonths is None:
+			return None
+
+		#series dropped by the time filter have no pair
+		selectedSeries = {}
+		for series,rollup,column,monthTimes in seriesMonths:
+			selectedSeries[ id( series ) ] = ( rollup, column, monthTimes )
+
+		windRose = self.computationHandler.windRose
+		seriesCounts = []
+		for pair in windRose.findPairs( seriesArray ):
+
+			directionEntry = selectedSeries.get( id( pair[0] ) )
+			velocityEntry  = selectedSeries.get( id( pair[1] ) )
+			if directionEntry is None and velocityEntry is None:
+				continue
+			if directionEntry is None or velocityEntry is None:
+				return None
+
+			rollup, directionColumn, monthTimes = directionEntry
+			layout, counts = self.rollupEngine.foldWindRose( rollup, directionColumn, velocityEntry[1], monthTimes )
+			if layout is None:
+				return None
+			for key in [ 'directionBins', 'velocityBins', 'velocityMin', 'velocityMax' ]:
+				if layout[key] != computationParameters[key]:
+					return None
+
+			seriesCount = {
+					'metaData' : windRose.getPairMetaData( pair ),
+					'data' : counts
+					}
+			seriesCounts.append( seriesCount )
+
+		return self.computationHandler.handleCounts( seriesCounts, computationParameters )
+
+	def _computeSummaries( self, data, seriesArray, computationParameters, timeBounds, timeParameters ):
+
+		#same answer as filling the whole series before a standard summary,
+		#None when the running statistics of the tables cannot give it exactly
+		if computationParameters['name'] not in self.computationHandler.summaryComputations:
+			return None
+		if timeBounds is None:
+			return None
+		if timeParameters is not None:
+			for key in [ 'years', 'months', 'hours' ]:
+				if len( timeParameters.get( key, [] ) ) > 0:
+					return None
+
+		lowerBound = pandas.Timestamp( timeBounds[0] ).value
+		upperBound = pandas.Timestamp( timeBounds[1] ).value
+
+		seriesSummaries = []
 		for series in seriesArray:
 
+			tableCode = series['metaData']['tableCode']
+			seriesData = series['data']
+			summary = data.summaries.get( tableCode )
+			if summary is None or not summary.aligned:
+				return None
+
+			#the grid used to fill missing data
+			if util.getSamplingFrequency( series ) != summary.samplingFrequency:
+				return None
+
+			#the bounds must hold the whole table, of the version of the series
+			timeArray = seriesData.index.asi8
+			if len(timeArray) == 0 or timeArray[0] != summary.firstTime or timeArray[-1] != summary.lastTime:
+				return None
+			if summary.firstTime < lowerBound or summary.lastTime > upperBound:
+				return None
+
 			seriesMetaData = series['metaData']
-			seriesData   = series['data']
-			
+			seriesMetaData['firstTimeStamp'] = pandas.Timestamp( summary.firstTime )
+			seriesMetaData['lastTimeStamp']  = pandas.Timestamp( summary.lastTime )
+
+			column = summary.columns.index( '%s' % ( seriesData.name ) )
+			seriesSummary = {
+					'metaData' : seriesMetaData,
+					'data' : ( summary, column )
+					}
+			seriesSummaries.append( seriesSummary )
+
+		return self.computationHandler.handleSummaries( seriesSummaries, computationParameters )
+
+	def _selectRollupMonths( self, data, seriesArray, timeBounds, timeParameters ):
+
+		#( series, rollup, column, month starts ) of the series whose filled and
+		#filtered rows are whole months of their table, None otherwise
+		if timeBounds is None:
+			return None
+
+		#years and months select whole months of the rollups
+		years  = []
+		months = []
+		if timeParameters is not None:
+			if len( timeParameters.get( 'hours', [] ) ) > 0:
+				return None
+			years  = timeParameters.get( 'years', [] )
+			months = timeParameters.get( 'months', [] )
+
+		lowerBound = pandas.Timestamp( timeBounds[0] ).value
+		upperBound = pandas.Timestamp( timeBounds[1] ).value
+
+		seriesMonths = []
+		for series in seriesArray:
+
+			tableCode = series['metaData']['tableCode']
+			seriesData = series['data']
+			rollup = data.rollups.get( tableCode )
+			if rollup is None or not rollup.valid:
+				return None
+
+			#the grid used to fill missing data
+			samplingFrequency = util.getSamplingFrequency( series )
+			if samplingFrequency != rollup.samplingFrequency:
+				return None
+
+			#series without rows between the bounds are dropped
+			timeArray = seriesData.index.asi8
+			firstPosition = numpy.searchsorted( timeArray, lowerBound, 'left' )
+			lastPosition  = numpy.searchsorted( timeArray, upperBound, 'right' )
+			if firstPosition >= lastPosition:
+				continue
+
+			#the rows between the bounds must be whole months of the table
+			firstTime = timeArray[firstPosition]
+			lastTime  = timeArray[lastPosition-1]
+			monthBounds = numpy.array( [ firstTime, lastTime ], dtype=numpy.int64 ).astype('datetime64[ns]').astype('datetime64[M]').astype(numpy.int64)
+			monthNumbers = numpy.arange( monthBounds[0], monthBounds[1] + 2 )
+			monthTimes = monthNumbers.astype('datetime64[M]').astype('datetime64[ns]').astype(numpy.int64)
+			if numpy.searchsorted( timeArray, monthTimes[0], 'left' ) != firstPosition:
+				return None
+			if numpy.searchsorted( timeArray, monthTimes[-1], 'left' ) != lastPosition:
+				return None
+
+			#months passing the time filter, series without them are dropped
+			monthEnds = monthTimes[1:]
+			monthNumbers = monthNumbers[:-1]
+			monthTimes = monthTimes[:-1]
+			selected = numpy.ones( len(monthNumbers), dtype=bool )
+			if len(years) > 0:
+				selected &= numpy.in1d( 1970 + monthNumbers // 12, years )
+			if len(months) > 0:
+				selected &= numpy.in1d( monthNumbers % 12 + 1, months )
+			if not numpy.any( selected ):
+				continue
+
+			#first and last points of the filled and filtered grid
+			seriesMetaData = series['metaData']
+			seriesMetaData['firstTimeStamp'] = pandas.Timestamp( max( monthTimes[selected][0], firstTime ) )
+			seriesMetaData['lastTimeStamp']  = pandas.Timestamp( min( monthEnds[selected][-1] - samplingFrequency * 10**9, lastTime ) )
+
+			column = rollup.columns.index( '%s' % ( seriesData.name ) )
+			seriesMonths.append( ( series, rollup, column, monthTimes[selected] ) )
+
+		return seriesMonths
+
+	def _processSeries( self, seriesArray, request, timeBounds, timeInterval, timeWindow=None ):
+
+		timeParameters = None
+		if 'time' in request:
+			timeParameters = request['time']
+
+		#ITERATE BLOCKS OF SERIES SHARING A TIME INDEX
+		seriesBlocks = []
+		for seriesBlock in self._groupSeries( seriesArray, timeBounds ):
+
+			blockData = seriesBlock['data']
+
 			#FILL MISSING DATA
-			seriesData = self._fillMissingData( seriesData, timeBounds, timeInterval )
-			
+			blockData = self._fillMissingData( blockData, timeBounds, timeInterval, timeWindow, seriesBlock['samplingFrequency'] )
+
 			#FILTER BY TIME
-			timeParameters = None
-			if 'time' in request:
-				timeParameters = request['time']
-			seriesData = self.timeFilter.filter( seriesData, timeParameters )
+			blockData = self.timeFilter.filter( blockData, timeParameters )
 
-			if len( seriesData ) > 0:
-				
-				seriesMetaData['firstTimeStamp'] = seriesData.index[0]
-				seriesMetaData['lastTimeStamp']  = seriesData.index[-1]
- 				series = {
-						'metaData' : seriesMetaData,
-						'data' : seriesData
-					}
+			if len( blockData ) > 0:
 
-				seriesResults.append( series )
+				for seriesMetaData in seriesBlock['metaData']:
+					seriesMetaData['firstTimeStamp'] = blockData.index[0]
+					seriesMetaData['lastTimeStamp']  = blockData.index[-1]
+				seriesBlock['data'] = blockData
+
+				seriesBlocks.append( seriesBlock )
 
 		#RESAMPLING
 		if 'resampling' in request:
-			resamplingResult = self.resampler.resample( seriesResults, request['resampling'] , timeInterval )
-			seriesResults = resamplingResult
-			
-		#PERFORM COMPUTATION
-		if 'computation' in request:
-			computationParameters = request['computation']
-			seriesResults = self.computationHandler.handle( seriesResults, computationParameters )
+			seriesBlocks = self.resampler.resample( seriesBlocks, request['resampling'] , timeInterval )
 
-		computationTime = time.time() - startTime
+		return self._splitSeries( seriesBlocks )
 
-		answer['result']          = seriesResults
-		answer['computationTime'] = computationTime
+	def _groupSeries( self, seriesArray, timeBounds ):
+
+		#consecutive series with the same index, e.g. variables of a table
+		groups = []
+		for series in seriesArray:
+			if len(groups) > 0 and groups[-1][-1]['data'].index is series['data'].index:
+				groups[-1].append( series )
+			else:
+				groups.append( [ series ] )
+
+		seriesBlocks = []
+		for group in groups:
+
+			#of the whole table index, once per block
+			samplingFrequency = util.getSamplingFrequency( group[0] )
+
+			#one column per series, rows within the time bounds
+			#series without sampling frequency are not filled nor bounded
+			seriesDataArray = [ series['data'] for series in group ]
+			if samplingFrequency is not None:
+				seriesDataArray = [ seriesData[ timeBounds[0] : timeBounds[1] ] for seriesData in seriesDataArray ]
+			valuesArray = numpy.column_stack( [ seriesData.values for seriesData in seriesDataArray ] )
+			blockData = pandas.DataFrame( index=seriesDataArray[0].index, data=valuesArray )
+
+			seriesBlock = {
+					'metaData' : [ series['metaData'] for series in group ],
+					'names' : [ series['data'].name for series in group ],
+					'samplingFrequency' : samplingFrequency,
+					'data' : blockData
+				}
+			seriesBlocks.append( seriesBlock )
+
+		return seriesBlocks
+
+	def _splitSeries( self, seriesBlocks ):
+
+		seriesResults = []
+		for seriesBlock in seriesBlocks:
+
+			blockData = seriesBlock['data']
+			for k in range( len( seriesBlock['metaData'] ) ):
+
+				seriesData = pandas.Series( blockData[k].values, index=blockData.index, name=seriesBlock['names'][k] )
+				series = {
+						'metaData' : seriesBlock['metaData'][k],
+						'data' : seriesData
+					}
+				seriesResults.append( series )
+
+		return seriesResults
+
+	def _planTimeWindow( self, timeParameters ):
+
+		#smallest period holding the selected years and months,
+		#rows outside of it are removed by the time filter anyway
+		if timeParameters is None:
+			return None
+
+		years  = timeParameters.get( 'years', [] )
+		months = timeParameters.get( 'months', [] )
+		if len(years) == 0:
+			return None
+
+		firstYear = min( years )
+		lastYear  = max( years )
+		if len(months) == 0:
+			return [ datetime.datetime( firstYear, 1, 1 ), datetime.datetime( lastYear + 1, 1, 1 ) ]
+
+		lowerBound = datetime.datetime( firstYear, min( months ), 1 )
+		upperBound = datetime.datetime( lastYear, max( months ), 1 ) + relativedelta.relativedelta( months=1 )
+
+		return [ lowerBound, upperBound ]
 
-		return answer
-	
 	def _calculateTimeBounds( self, seriesArray, request ):
 		
 		#trivial case
@@ -552,9 +903,11 @@ class ZNDataRequestHandler:
 
 		return originalVariableParameters,transformVariableParameters
 	
-	def _fillMissingData(self,series, timeBounds, timeInterval ):
+	def _fillMissingData(self,series, timeBounds, timeInterval, timeWindow=None, samplingFrequency=None ):
 
-		samplingFrequency = util.findSamplingFrequency( series )	
+		#series or dataframe, samplingFrequency may come from the whole index
+		if samplingFrequency is None:
+			samplingFrequency = util.findSamplingFrequency( series )	
 		if samplingFrequency is None:
 			newSeries = series
 		else:
@@ -586,6 +939,11 @@ class ZNDataRequestHandler:
 					deltaTime = datetime.timedelta(0,samplingFrequency)
 					endTime   = endTime - deltaTime
 
+				#keep the grid points inside the planned window only
+				if timeWindow is not None:
+					startTime, endTime = self._clipToTimeWindow( startTime, endTime, samplingFrequency, timeWindow )
+					filteredSeries = filteredSeries[ startTime : endTime ]
+
 				#reindex series
 				newTimeIndex = pandas.tseries.index.date_range( start=startTime, end=endTime, freq='%dS' % ( samplingFrequency ) )
 				newSeries = filteredSeries.reindex( newTimeIndex )
@@ -594,6 +952,25 @@ class ZNDataRequestHandler:
 			
 		return newSeries
 
+	def _clipToTimeWindow(self, startTime, endTime, samplingFrequency, timeWindow ):
+
+		#same grid, from startTime in steps of samplingFrequency
+		step = samplingFrequency * 10**9
+		startValue = pandas.Timestamp( startTime ).value
+		endValue   = pandas.Timestamp( endTime ).value
+		windowLower = pandas.Timestamp( timeWindow[0] ).value
+		windowUpper = pandas.Timestamp( timeWindow[1] ).value
+
+		newStartValue = startValue
+		if windowLower > startValue:
+			newStartValue = startValue - ( startValue - windowLower ) // step * step
+
+		newEndValue = endValue
+		if windowUpper < endValue:
+			newEndValue = startValue + ( windowUpper - startValue ) // step * step
+
+		return pandas.Timestamp( newStartValue ), pandas.Timestamp( newEndValue )
+
 	def _extractSeries( self, dataBase, idTuples ):
 		
 		seriesArray = []
@@ -606,6 +983,9 @@ class ZNDataRequestHandler:
 			variableMetaDataArray = dataBase.metaData['tables'][tableCode]['variables']
 			dataFrame = dataBase.data.dataFrames[tableCode]
 
+			#known once the table data is loaded
+			tableMetaData = dataBase.metaData['tables'][tableCode]
+
 			if len(dataFrame) == 0:
 				continue
 
@@ -629,6 +1009,8 @@ class ZNDataRequestHandler:
 							'metaData' : seriesMetaData,
 							'data' : seriesData
 							}
+					if 'samplingFrequency' in tableMetaData:
+						seriesEntry['samplingFrequency'] = tableMetaData['samplingFrequency']
 
 					seriesArray.append( seriesEntry )
 		
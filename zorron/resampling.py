@@ -17,13 +17,32 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 
+import numpy
+import pandas
+
 import zorron.util as util
 
+from zorron.aggregate import ZNRollupEngine
+from zorron.sketch import ZNQuantileSketch, getAccuracy
+
 class ZNResampler:
 
+	#statistics computed from rollup counts, sums, minimums and maximums
+	rollupStatistics = [ 'mean', 'sum', 'min', 'max', 'count', 'fraction' ]
+
+	#rollup level summed into the bins of each interval code
+	rollupLevels = { 'D' : 'D', 'MS' : 'MS', 'A' : 'MS' }
+
+	#statistics that pandas applies column by column to a dataframe
+	blockStatistics = [ 'mean', 'sum', 'min', 'max', 'std', 'var', 'count', 'fraction' ]
+
+	#statistics computed together with the fraction of valid values in one pass
+	kernelStatistics = [ 'mean', 'sum', 'min', 'max', 'std', 'var', 'count', 'fraction', 'percentile' ]
+
 	def __init__(self):
 
 		self._defineStandardIntervals()
+		self.rollupEngine = ZNRollupEngine()
 	
 	def _defineStandardIntervals(self):
 
@@ -74,56 +93,279 @@ class ZNResampler:
 		interval    = { 'units' : 1, 'code' : 'A' }
 		self.standardIntervals.append( (seconds,interval) )
 
-	def resample( self,seriesArray,resamplingParameters, timeInterval ):
+	def resample( self,seriesBlocks,resamplingParameters, timeInterval ):
 		
-		resampledSeriesArray = []
-		if len(seriesArray) == 0:
-			return resampledSeriesArray
+		#blocks: series sharing a time index, one dataframe column per series
+		resampledSeriesBlocks = []
+		if len(seriesBlocks) == 0:
+			return resampledSeriesBlocks
 
 		#statistic
-		resamplingFunction = util.parseStatisticFunction(resamplingParameters['statistic'])
+		statistic = resamplingParameters['statistic']
+		resamplingFunction = util.parseStatisticFunction(statistic)
+
+		minimumFraction = None
+		if 'minimumFraction' in resamplingParameters and statistic['name'] != 'fraction':
+			minimumFraction = resamplingParameters['minimumFraction']
 
 		#resample	
-		resampledSeriesArray = []
-		for series in seriesArray:
-			timeIntervalString = '%d%s' % ( timeInterval['units'], timeInterval['code'] )
-			resampledSeriesData = series['data'].resample( timeIntervalString, how=resamplingFunction )
-			if len(resampledSeriesData) > 0:
-				resampledSeries = {
-							'metaData' 	: series['metaData'],
-							'data'  : resampledSeriesData
-						}
-				resampledSeriesArray.append( resampledSeries )
+		timeIntervalString = '%d%s' % ( timeInterval['units'], timeInterval['code'] )
+		for seriesBlock in seriesBlocks:
+
+			#value and fraction in one pass, pandas otherwise
+			resampledData = None
+			if statistic['name'] in self.kernelStatistics:
+				resampledData = self._resampleKernel( seriesBlock['data'], statistic, timeInterval, minimumFraction )
+
+			if resampledData is None:
+				resampledData = self._resampleBlock( seriesBlock['data'], statistic['name'], resamplingFunction, timeIntervalString )
+
+				#fraction filter
+				if minimumFraction is not None and len(resampledData) > 0:
+					resampledData = self._filterByFraction( seriesBlock['data'], resampledData, timeIntervalString, minimumFraction )
+
+			if len(resampledData) > 0:
+				resampledSeriesBlock = seriesBlock.copy()
+				resampledSeriesBlock['data'] = resampledData
+				resampledSeriesBlocks.append( resampledSeriesBlock )
+
+		return resampledSeriesBlocks
+
+	def _resampleKernel( self, blockData, statistic, timeInterval, minimumFraction=None ):
+
+		#statistic and valid count of every bin at once, None to resample with pandas
+		statisticName = statistic['name']
+
+		#exact percentiles sort every bin
+		accuracy = None
+		if statisticName == 'percentile':
+			accuracy = getAccuracy( statistic )
+			if accuracy is None:
+				return None
+
+		bins = util.calculateBins( blockData.index.asi8, timeInterval )
+		if bins is None:
+			return None
+		binIds, labels = bins
+
+		#rows of a bin are contiguous, empty bins are left to pandas
+		steps = numpy.diff( binIds )
+		if numpy.any( steps > 1 ):
+			return None
+		starts = numpy.concatenate( ( [ 0 ], numpy.flatnonzero( steps ) + 1 ) )
+		sizes  = numpy.diff( numpy.append( starts, len(binIds) ) )
+
+		values = numpy.asarray( blockData.values, dtype=numpy.float64 )
+		valid  = ~numpy.isnan( values )
+		count  = numpy.add.reduceat( valid.astype(numpy.int64), starts, axis=0 )
+		fraction = count / sizes[:,numpy.newaxis].astype(numpy.float64) * 100
+
+		if statisticName in [ 'mean', 'sum', 'std', 'var' ]:
+			validValues = numpy.where( valid, values, 0.0 )
+			total = numpy.add.reduceat( validValues, starts, axis=0 )
+
+		if statisticName == 'mean':
+			resampledValues = numpy.where( count > 0, total / numpy.maximum( count, 1 ), numpy.nan )
+		elif statisticName == 'sum':
+			resampledValues = numpy.where( count > 0, total, numpy.nan )
+		elif statisticName == 'min':
+			resampledValues = numpy.fmin.reduceat( values, starts, axis=0 )
+		elif statisticName == 'max':
+			resampledValues = numpy.fmax.reduceat( values, starts, axis=0 )
+		elif statisticName in [ 'std', 'var' ]:
+
+			#sample variance from sums, as pandas groupby
+			squares = numpy.add.reduceat( validValues * validValues, starts, axis=0 )
+			pairs = numpy.maximum( count * count - count, 1 )
+			resampledValues = numpy.where( count > 1, ( count * squares - total * total ) / pairs, numpy.nan )
+			if statisticName == 'std':
+				resampledValues = numpy.sqrt( resampledValues )
+		elif statisticName == 'count':
+			resampledValues = count
+		elif statisticName == 'fraction':
+			resampledValues = fraction
+		elif statisticName == 'percentile':
+
+			#approximate, from one sketch of the bins of each column
+			sketch = ZNQuantileSketch( accuracy )
+			resampledValues = numpy.column_stack( [ sketch.groupQuantiles( values[:,column], binIds, len(labels), statistic['level'] ) for column in range( values.shape[1] ) ] )
+		else:
+			return None
 
 		#fraction filter
-		if 'minimumFraction' in resamplingParameters and  resamplingParameters['statistic']['name'] != 'fraction':
-			self._filterByFraction( seriesArray,resampledSeriesArray, timeIntervalString, resamplingParameters['minimumFraction'] )
+		if minimumFraction is not None:
+			resampledValues = numpy.where( fraction < minimumFraction, numpy.nan, resampledValues )
 
-		return resampledSeriesArray
+		indexArray = pandas.DatetimeIndex( data=labels )
+		return pandas.DataFrame( resampledValues, index=indexArray, columns=blockData.columns )
+
+	def _resampleBlock( self, blockData, statisticName, resamplingFunction, timeIntervalString ):
+
+		#column-wise on a dataframe, the whole block is resampled at once
+		if statisticName in self.blockStatistics:
+			return blockData.resample( timeIntervalString, how=resamplingFunction )
+
+		columns = []
+		for column in blockData.columns:
+			columns.append( blockData[column].resample( timeIntervalString, how=resamplingFunction ) )
+
+		return pandas.concat( columns, axis=1 )
 	
-	def _filterByFraction(self,seriesArray,resampledSeriesArray ,interval,minimumFraction):
+	def _filterByFraction(self,blockData,resampledData,interval,minimumFraction):
 
 		#compute fraction
 		parameters = { 'name' : 'fraction'}
 		fractionFunction = util.parseStatisticFunction(parameters)
+		fractionData = blockData.resample( interval, how=fractionFunction )
 
-		fractionSeriesArray = []  
+		#filter by minimum fraction
+		return resampledData.where( ~( fractionData.values < minimumFraction ) )
+
+	def resampleRollups( self, data, seriesArray, resamplingParameters, timeBounds, timeInterval, timeParameters ):
+
+		#same answer as filling, filtering and resampling the series,
+		#None when the rollups cannot give it exactly
+		statistic = resamplingParameters['statistic']
+		statisticName = statistic['name']
+		if statisticName not in self.rollupStatistics and statisticName != 'percentile':
+			return None
+		if timeBounds is None or timeInterval is None or timeInterval['code'] not in self.rollupLevels:
+			return None
+
+		#approximate percentiles from the monthly sketches, merged for
+		#monthly and yearly bins
+		accuracy = None
+		if statisticName == 'percentile':
+			accuracy = getAccuracy( statistic )
+			if accuracy is None or self.rollupLevels[ timeInterval['code'] ] != 'MS':
+				return None
+
+		#only time bounds
+		if timeParameters is not None:
+			for key in [ 'years', 'months', 'hours' ]:
+				if len( timeParameters.get( key, [] ) ) > 0:
+					return None
+
+		lowerBound = pandas.Timestamp( timeBounds[0] ).value
+		upperBound = pandas.Timestamp( timeBounds[1] ).value
+		edges = self._calculateRollupEdges( lowerBound, upperBound, timeInterval )
+		if edges is None:
+			return None
+
+		#pandas labels yearly bins with their last day
+		labels = edges[:-1]
+		if timeInterval['code'] == 'A':
+			labels = edges[1:] - 86400 * 10**9
+
+		minimumFraction = None
+		if 'minimumFraction' in resamplingParameters and statisticName != 'fraction':
+			minimumFraction = resamplingParameters['minimumFraction']
+
+		resampledSeriesArray = []
+		samplingFrequencies = {}
 		for series in seriesArray:
-			fractionSeries = series['data'].resample( interval, how=fractionFunction )
-			fractionSeriesArray.append( fractionSeries )
 
-		#filter by minimum fraction
-		nan = float('nan')
-		for i in range(len(seriesArray)):
+			tableCode = series['metaData']['tableCode']
+			seriesData = series['data']
+			rollup = data.rollups.get( tableCode )
+			if rollup is None or not rollup.valid:
+				return None
+			if accuracy is not None and ( rollup.sketch is None or rollup.sketch.accuracy > accuracy ):
+				return None
+
+			#the grid used to fill missing data
+			if tableCode not in samplingFrequencies:
+				samplingFrequencies[tableCode] = util.getSamplingFrequency( series )
+			samplingFrequency = samplingFrequencies[tableCode]
+			if samplingFrequency != rollup.samplingFrequency:
+				return None
+
+			#series without rows between the bounds are dropped
+			timeArray = seriesData.index.asi8
+			if numpy.searchsorted( timeArray, lowerBound, 'left' ) >= numpy.searchsorted( timeArray, upperBound, 'right' ):
+				continue
+
+			column = rollup.columns.index( '%s' % ( seriesData.name ) )
+			count, total, minimum, maximum = self.rollupEngine.aggregate( rollup, self.rollupLevels[ timeInterval['code'] ], column, edges )
+
+			#filled rows per bin
+			slots = numpy.diff( edges ) / ( samplingFrequency * 1e9 )
+			fraction = count / slots * 100
+
+			if statisticName == 'mean':
+				values = numpy.where( count > 0, total / numpy.maximum( count, 1 ), numpy.nan )
+			elif statisticName == 'sum':
+				values = numpy.where( count > 0, total, numpy.nan )
+			elif statisticName == 'min':
+				values = minimum
+			elif statisticName == 'max':
+				values = maximum
+			elif statisticName == 'count':
+				values = count
+			elif statisticName == 'fraction':
+				values = fraction
+			elif statisticName == 'percentile':
+				values = self.rollupEngine.quantiles( rollup, column, edges, statistic['level'] )
+
+			if minimumFraction is not None:
+				values = numpy.where( fraction < minimumFraction, numpy.nan, values )
+
+			seriesMetaData = series['metaData']
+			seriesMetaData['firstTimeStamp'] = pandas.Timestamp( lowerBound )
+			seriesMetaData['lastTimeStamp']  = pandas.Timestamp( upperBound - samplingFrequency * 10**9 )
+
+			indexArray = pandas.DatetimeIndex( data=labels )
+			resampledSeries = {
+						'metaData' : seriesMetaData,
+						'data' : pandas.Series( values, index=indexArray, name=seriesData.name )
+					}
+			resampledSeriesArray.append( resampledSeries )
 
-			fractionValues  = fractionSeriesArray[i].values
+		return resampledSeriesArray
 
-			for k in range(len(fractionValues)):
+	def _calculateRollupEdges( self, lowerBound, upperBound, timeInterval ):
 
-				if fractionValues[k] < minimumFraction:
-					resampledSeriesArray[i]['data'].values[k] = nan
-	
-		return
+		#bins of the rounded time bounds, starting at the lower bound
+		timeUnits = timeInterval['units']
+		edges = None
+
+		if timeInterval['code'] == 'D':
+
+			intervalLength = timeUnits * 86400 * 10**9
+			if lowerBound % ( 86400 * 10**9 ) != 0 or ( upperBound - lowerBound ) % intervalLength != 0:
+				return None
+			numberIntervals = ( upperBound - lowerBound ) // intervalLength
+			edges = lowerBound + numpy.arange( numberIntervals + 1, dtype=numpy.int64 ) * intervalLength
+
+		elif timeInterval['code'] == 'MS':
+
+			bounds = numpy.array( [ lowerBound, upperBound ], dtype=numpy.int64 )
+			months = bounds.astype('datetime64[ns]').astype('datetime64[M]')
+			if numpy.any( months.astype('datetime64[ns]').astype(numpy.int64) != bounds ):
+				return None
+			months = months.astype(numpy.int64)
+			if ( months[1] - months[0] ) % timeUnits != 0:
+				return None
+			edges = numpy.arange( months[0], months[1] + 1, timeUnits ).astype('datetime64[M]')
+			edges = edges.astype('datetime64[ns]').astype(numpy.int64)
+
+		elif timeInterval['code'] == 'A':
+
+			#calendar years, as pandas bins sub-daily rows
+			bounds = numpy.array( [ lowerBound, upperBound ], dtype=numpy.int64 )
+			years = bounds.astype('datetime64[ns]').astype('datetime64[Y]')
+			if numpy.any( years.astype('datetime64[ns]').astype(numpy.int64) != bounds ):
+				return None
+			years = years.astype(numpy.int64)
+			if ( years[1] - years[0] ) % timeUnits != 0:
+				return None
+			edges = numpy.arange( years[0], years[1] + 1, timeUnits ).astype('datetime64[Y]')
+			edges = edges.astype('datetime64[ns]').astype(numpy.int64)
+
+		if edges is None or len(edges) < 2:
+			return None
+
+		return edges
 
 	def calculateAdaptiveInterval( self, seriesArray, timeBounds, seriesLength ):
 
@@ -132,8 +374,7 @@ class ZNResampler:
 		#compute maximum sampling frequency
 		samplingFrequencies = []
 		for series in seriesArray:
-			seriesData = series['data']
-			samplingFrequency = util.findSamplingFrequency( seriesData )
+			samplingFrequency = util.getSamplingFrequency( series )
 			samplingFrequencies.append( samplingFrequency )
 
 		maximumSamplingFrequency = max( samplingFrequencies )
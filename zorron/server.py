@@ -26,49 +26,90 @@ import zorron.util as util
 import zorron.encoding as encoding
 
 from zorron.manager import ZNDefaultManager
+from zorron.concurrency import ZNConcurrencyManager
 from zorron.znparser import ZNCSVParser
 
 
 class ZNServer( object ):
 
-	def __init__(self,dataBaseDirectory,temporaryDirectory):
+	def __init__(self,dataBaseDirectory,temporaryDirectory,configuration=None):
 		
-		self.manager = ZNDefaultManager(temporaryDirectory)
+		if configuration is None:
+			configuration = {}
+
+		#scheduler: requests run concurrently on pinned versions of the data,
+		#writes publish new versions without waiting for them
+		self.concurrencyManager = ZNConcurrencyManager( 
+								configuration.get( 'processors', 4 ),
+								configuration.get( 'queueSize', 64 ),
+								configuration.get( 'queueTimeout', None )
+							)
+
+		self.manager = ZNDefaultManager(temporaryDirectory,configuration)
 		print "Loading Database ..."
 		self.dataBase = self.manager.loadDataBase( dataBaseDirectory )
 		print "...done."
 	
 	def getMetaData(self):
 
-		return self.dataBase.metaData
+		return self.concurrencyManager.request( lambda : self.dataBase.metaData )
 	
 	def getMetaDataTable(self,code):
 
-		return self.dataBase.metaData['tables'][code]
+		return self.concurrencyManager.request( lambda : self.dataBase.metaData['tables'][code] )
 	
 	def getTableCodes(self):
 
-		return self.dataBase.metaData['tables'].keys()
+		return self.concurrencyManager.request( lambda : self.dataBase.metaData['tables'].keys() )
 
 	def createTable(self,metaData,dataArray=None):
 
 		if not dataArray is None:
 			dataArray = numpy.array( dataArray )
-		self.manager.createTable( self.dataBase, metaData, dataArray )
+		self.concurrencyManager.write( self.manager.createTable, self.dataBase, metaData, dataArray )
 	
 	def removeTable(self,tableName):
 
-		self.manager.removeTable( self.dataBase, tableName )
+		self.concurrencyManager.write( self.manager.removeTable, self.dataBase, tableName )
 
 	def updateTable(self,tableCode,dataArray):
 
 		dataArray = numpy.array( dataArray )
-		self.manager.updateTable( self.dataBase, tableCode, dataArray )
+		self.concurrencyManager.write( self.manager.updateTable, self.dataBase, tableCode, dataArray )
+
+	def updateTables(self,dataArrays):
+
+		for tableCode in dataArrays.keys():
+			dataArrays[tableCode] = numpy.array( dataArrays[tableCode] )
+
+		return self.concurrencyManager.write( self.manager.updateTables, self.dataBase, dataArrays )
+
+	def snapshotDataBase(self):
+
+		return self.concurrencyManager.request( self.manager.snapshotDataBase, self.dataBase )
+
+	def getSchedulerMetrics(self):
+
+		return self.concurrencyManager.getMetrics()
+
+	def getCacheStatistics(self):
+
+		return self.manager.getCacheStatistics()
+
+	def getLoadTimes(self):
+
+		return self.manager.getLoadTimes()
+
+	def finalize(self):
+
+		#last compaction, writes still queued stay in the logs
+		self.manager.finalize( self.dataBase )
+		self.concurrencyManager.finalize()
 
 	def requestData(self, request ):
 		
 		try:
-			result = self.manager.requestData( self.dataBase, request )	
+			result = self.concurrencyManager.request( self.manager.requestData, self.dataBase, request )	
 
 		except:
 			stackTrace = traceback.format_exc()
@@ -134,6 +175,31 @@ class ZNClient:
 		dataArray = dataArray.tolist()
 		self.serverProxy.updateTable( tableCode, dataArray )
 
+	def updateTables(self, dataArrays ):
+
+		#one round trip for all tables
+		listArrays = {}
+		for tableCode,dataArray in dataArrays.items():
+			listArrays[tableCode] = dataArray.tolist()
+
+		return self.serverProxy.updateTables( listArrays )
+
+	def snapshotDataBase(self):
+
+		return self.serverProxy.snapshotDataBase()
+
+	def getSchedulerMetrics(self):
+
+		return self.serverProxy.getSchedulerMetrics()
+
+	def getCacheStatistics(self):
+
+		return self.serverProxy.getCacheStatistics()
+
+	def getLoadTimes(self):
+
+		return self.serverProxy.getLoadTimes()
+
 	def requestData(self, request ):
 		
 		result = self.serverProxy.requestData( request )
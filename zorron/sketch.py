@@ -0,0 +1,213 @@
+"""
+ZORRO-N - Meteorological Time Series DataBase Engine
+Copyright (C) 2014 - Ernesto Castillo Navarrete
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import numpy
+
+#keys of logarithmic buckets:
+#	0 for zero | bias + bucket for positive values | -( bias + bucket ) for negative values
+#keys keep the order of the values they represent
+
+KEY_BIAS = 2**30
+ZERO_VALUE = 1e-12
+
+def getAccuracy(statisticParameters):
+
+	#relative accuracy of an approximate statistic, None when it must be exact
+	accuracy = statisticParameters.get( 'accuracy', 'exact' )
+	if accuracy == 'exact' or accuracy is None:
+		return None
+
+	accuracy = float( accuracy )
+	if accuracy <= 0 or accuracy >= 1:
+		return None
+
+	return accuracy
+
+class ZNQuantileSketch:
+
+	def __init__(self,accuracy=0.01):
+
+		#mergeable sketch with logarithmic buckets (as DDSketch), a quantile
+		#is within accuracy of the true value relative to its magnitude
+		self.accuracy	= accuracy
+		self.gamma	= ( 1 + accuracy ) / ( 1 - accuracy )
+		self.logGamma	= numpy.log( self.gamma )
+
+	def encode(self,values):
+
+		#bucket key of each value, values must not be nan
+		magnitudes = numpy.abs( values )
+		nonZero = magnitudes > ZERO_VALUE
+
+		keys = numpy.zeros( len(values), dtype=numpy.int64 )
+		buckets = numpy.ceil( numpy.log( magnitudes[nonZero] ) / self.logGamma ).astype(numpy.int64)
+		keys[nonZero] = numpy.where( values[nonZero] > 0, 1, -1 ) * ( buckets + KEY_BIAS )
+
+		return keys
+
+	def decode(self,keys):
+
+		#representative value of each bucket
+		keys = numpy.asarray( keys, dtype=numpy.int64 )
+		buckets = numpy.abs( keys ) - KEY_BIAS
+		values = numpy.sign( keys ) * 2 * self.gamma ** buckets.astype(numpy.float64) / ( self.gamma + 1 )
+
+		return numpy.where( keys == 0, 0.0, values )
+
+	def summarize(self,values):
+
+		#sorted keys and counts of the non nan values
+		values = values[ ~numpy.isnan( values ) ]
+		if len(values) == 0:
+			return numpy.zeros( 0, dtype=numpy.int64 ), numpy.zeros( 0, dtype=numpy.int64 )
+
+		keys = numpy.sort( self.encode( values ) )
+		starts = numpy.flatnonzero( numpy.concatenate( ( [ True ], keys[1:] != keys[:-1] ) ) )
+		counts = numpy.diff( numpy.append( starts, len(keys) ) ).astype(numpy.int64)
+
+		return keys[starts], counts
+
+	def merge(self,keys,counts):
+
+		#keys and counts of several summaries, in any order
+		if len(keys) == 0:
+			return keys, counts
+
+		mergedKeys, inverse = numpy.unique( keys, return_inverse=True )
+		mergedCounts = numpy.bincount( inverse, weights=counts ).astype(numpy.int64)
+
+		return mergedKeys, mergedCounts
+
+	def quantile(self,keys,counts,level):
+
+		#level in percent, interpolated between ranks as numpy.percentile
+		if len(keys) == 0:
+			return numpy.nan
+
+		cumulative = numpy.cumsum( counts )
+		rank = level / 100.0 * ( cumulative[-1] - 1 )
+		lowerRank = numpy.floor( rank )
+		upperRank = numpy.ceil( rank )
+
+		lowerValue, upperValue = self.decode( keys[ numpy.searchsorted( cumulative, [ lowerRank, upperRank ], 'right' ) ] )
+
+		return lowerValue + ( rank - lowerRank ) * ( upperValue - lowerValue )
+
+	def groupQuantiles(self,values,groups,numberGroups,level):
+
+		#quantile of the values of each group 0..numberGroups-1 in one pass,
+		#nan for groups without values
+		valid = ~numpy.isnan( values )
+		values = values[valid]
+		groups = groups[valid]
+
+		result = numpy.empty( numberGroups )
+		result.fill( numpy.nan )
+		if len(values) == 0:
+			return result
+
+		#sorted by group then key, equal pairs are counted together
+		keys = self.encode( values )
+		order = numpy.lexsort( ( keys, groups ) )
+		groups = groups[order]
+		keys = keys[order]
+		changes = numpy.concatenate( ( [ True ], ( groups[1:] != groups[:-1] ) | ( keys[1:] != keys[:-1] ) ) )
+		pairStarts = numpy.flatnonzero( changes )
+		counts = numpy.diff( numpy.append( pairStarts, len(keys) ) )
+		groups = groups[pairStarts]
+		keys = keys[pairStarts]
+
+		#cumulative counts of all the pairs, each group starts at an offset
+		cumulative = numpy.cumsum( counts )
+		groupStarts = numpy.flatnonzero( numpy.concatenate( ( [ True ], groups[1:] != groups[:-1] ) ) )
+		groupEnds = numpy.append( groupStarts[1:], len(keys) )
+		offsets = numpy.concatenate( ( [ 0 ], cumulative[groupEnds[:-1]-1] ) )
+		totals = cumulative[groupEnds-1] - offsets
+
+		rank = level / 100.0 * ( totals - 1 )
+		lowerRank = numpy.floor( rank )
+		upperRank = numpy.ceil( rank )
+
+		#bucket of a rank: first cumulative count above it, inside its group
+		lowerValue = self.decode( keys[ numpy.searchsorted( cumulative, offsets + lowerRank, 'right' ) ] )
+		upperValue = self.decode( keys[ numpy.searchsorted( cumulative, offsets + upperRank, 'right' ) ] )
+		result[ groups[groupStarts] ] = lowerValue + ( rank - lowerRank ) * ( upperValue - lowerValue )
+
+		return result
+
+class ZNSketchLevel:
+
+	def __init__(self,times,starts,keys,counts):
+
+		#summaries of one column, bin k has keys[starts[k]:starts[k+1]]
+		self.times	= times
+		self.starts	= starts
+		self.keys	= keys
+		self.counts	= counts
+
+	def head(self,position):
+
+		end = self.starts[position]
+		return ZNSketchLevel( self.times[:position], self.starts[:position+1], self.keys[:end], self.counts[:end] )
+
+	def append(self,level):
+
+		offset = self.starts[-1]
+		return ZNSketchLevel(
+					numpy.concatenate( ( self.times, level.times ) ),
+					numpy.concatenate( ( self.starts[:-1], level.starts + offset ) ),
+					numpy.concatenate( ( self.keys, level.keys ) ),
+					numpy.concatenate( ( self.counts, level.counts ) )
+				)
+
+	def select(self,firstPosition,lastPosition):
+
+		#keys and counts of the bins firstPosition..lastPosition-1
+		first = self.starts[firstPosition]
+		last  = self.starts[lastPosition]
+		return self.keys[first:last], self.counts[first:last]
+
+def createSketchLevel(sketch,binTimes,values):
+
+	#one summary per bin of sorted binTimes
+	valid = ~numpy.isnan( values )
+	binTimes = binTimes[valid]
+	keys = sketch.encode( values[valid] )
+
+	if len(keys) == 0:
+		return ZNSketchLevel(
+					numpy.zeros( 0, dtype=numpy.int64 ),
+					numpy.zeros( 1, dtype=numpy.int64 ),
+					numpy.zeros( 0, dtype=numpy.int64 ),
+					numpy.zeros( 0, dtype=numpy.int64 )
+				)
+
+	#sorted by bin then key, equal pairs are counted together
+	order = numpy.lexsort( ( keys, binTimes ) )
+	binTimes = binTimes[order]
+	keys = keys[order]
+	changes = numpy.concatenate( ( [ True ], ( binTimes[1:] != binTimes[:-1] ) | ( keys[1:] != keys[:-1] ) ) )
+	pairStarts = numpy.flatnonzero( changes )
+	counts = numpy.diff( numpy.append( pairStarts, len(keys) ) ).astype(numpy.int64)
+	binTimes = binTimes[pairStarts]
+	keys = keys[pairStarts]
+
+	binStarts = numpy.flatnonzero( numpy.concatenate( ( [ True ], binTimes[1:] != binTimes[:-1] ) ) )
+
+	return ZNSketchLevel( binTimes[binStarts], numpy.append( binStarts, len(keys) ), keys, counts )
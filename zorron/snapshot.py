@@ -0,0 +1,205 @@
+"""
+ZORRO-N - Meteorological Time Series DataBase Engine
+Copyright (C) 2014 - Ernesto Castillo Navarrete
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import json
+import os
+import struct
+import numpy
+import pandas
+
+#file layout:
+#	magic (8 bytes) | header length (8 bytes) | json header | padding | arrays
+#array offsets in the header are relative to the first aligned byte after the header
+
+MAGIC 	  = 'ZNSNAP01'
+ALIGNMENT = 64
+
+class ZNSnapshotEngine:
+
+	def __init__(self,fileName='snapshot.znb'):
+
+		self.fileName = fileName
+
+	def getPath(self,rootDirectory):
+
+		return os.path.join( rootDirectory, self.fileName )
+
+	def write(self,dataBase,outputPath=None):
+
+		metaData = dataBase.metaData
+		if outputPath is None:
+			outputPath = self.getPath( metaData['rootDirectory'] )
+
+		#header
+		tables  = {}
+		arrays  = []
+		offset  = 0
+		for tableCode in metaData['tables'].keys():
+
+			dataFrame = dataBase.data.dataFrames[tableCode]
+			timeArray = numpy.ascontiguousarray( dataFrame.index.astype(numpy.int64), dtype=numpy.int64 )
+			valuesArray = numpy.ascontiguousarray( dataFrame.values, dtype=numpy.float64 )
+
+			timeOffset = offset
+			offset = self._align( offset + timeArray.nbytes )
+			valuesOffset = offset
+			offset = self._align( offset + valuesArray.nbytes )
+
+			lastTime = None
+			if len(timeArray) > 0:
+				lastTime = int( timeArray[-1] )
+
+			tables['%s' % ( tableCode )] = {
+						'code' : tableCode,
+						'rows' : len(dataFrame),
+						'lastTime' : lastTime,
+						'columns' : [ '%s' % ( column ) for column in dataFrame.columns ],
+						'timeOffset' : timeOffset,
+						'valuesOffset' : valuesOffset
+					}
+			arrays.append( ( timeOffset, timeArray ) )
+			arrays.append( ( valuesOffset, valuesArray ) )
+
+		header = json.dumps( { 'metaData' : metaData, 'tables' : tables } )
+		dataOffset = self._align( len(MAGIC) + 8 + len(header) )
+
+		#write to a temporary file and rename, so a reader never sees a partial snapshot
+		temporaryPath = outputPath + '.tmp'
+		outputFile = open( temporaryPath, 'wb' )
+		try:
+			outputFile.write( MAGIC )
+			outputFile.write( struct.pack( '<Q', len(header) ) )
+			outputFile.write( header )
+			for arrayOffset,array in arrays:
+				outputFile.seek( dataOffset + arrayOffset )
+				array.tofile( outputFile )
+			outputFile.truncate( dataOffset + offset )
+		finally:
+			outputFile.close()
+
+		os.rename( temporaryPath, outputPath )
+
+		return outputPath
+
+	def isValid(self,rootDirectory,storageEngine):
+
+		inputPath = self.getPath( rootDirectory )
+		if not os.path.isfile( inputPath ):
+			return False
+
+		snapshotTime = os.path.getmtime( inputPath )
+
+		#metadata files are only written when the metadata changes
+		inputPaths = [ os.path.join( rootDirectory, 'metadata.json' ) ]
+		tableDirectories = []
+		for fileName in os.listdir( rootDirectory ):
+			tableDirectory = os.path.join( rootDirectory, fileName )
+			if os.path.isfile( tableDirectory ):
+				continue
+			tableDirectories.append( fileName )
+			inputPaths.append( os.path.join( tableDirectory, 'metadata.js' ) )
+
+		for path in inputPaths:
+			if os.path.isfile( path ) and os.path.getmtime( path ) >= snapshotTime:
+				return False
+
+		#same set of tables
+		header = self._readHeader( inputPath )
+		if sorted( header['tables'].keys() ) != sorted( tableDirectories ):
+			return False
+
+		#data files may be touched without changes (hdf5 files opened for
+		#writing are stamped on close), compare their contents instead
+		storage = storageEngine.createStorage( header['metaData'].get( 'storage', None ) )
+		for tableKey,tableEntry in header['tables'].items():
+			storageEngine.loadTableStorage( storage, tableKey, os.path.join( rootDirectory, tableKey ) )
+			try:
+				numberRows = storageEngine.getTableSize( storage, tableKey )
+				lastTime = storageEngine.getLastTime( storage, tableKey )
+			finally:
+				storageEngine.removeTable( storage, tableKey )
+			if numberRows != tableEntry['rows'] or lastTime != tableEntry.get( 'lastTime', None ):
+				return False
+
+		return True
+
+	def load(self,inputPath):
+
+		header = self._readHeader( inputPath )
+		dataOffset = self._align( len(MAGIC) + 8 + header['length'] )
+
+		dataFrames = {}
+		for tableEntry in header['tables'].values():
+
+			numberRows 	= tableEntry['rows']
+			numberColumns	= len( tableEntry['columns'] )
+
+			if numberRows == 0:
+				timeArray   = numpy.zeros( 0, dtype=numpy.int64 )
+				valuesArray = numpy.zeros( ( 0, numberColumns ), dtype=numpy.float64 )
+			else:
+				#copy-on-write mappings: pages are read on demand and in-place
+				#updates never reach the snapshot file
+				timeArray = numpy.memmap(
+							inputPath,
+							dtype=numpy.int64,
+							mode='c',
+							offset=dataOffset + tableEntry['timeOffset'],
+							shape=( numberRows, )
+						)
+				valuesArray = numpy.memmap(
+							inputPath,
+							dtype=numpy.float64,
+							mode='c',
+							offset=dataOffset + tableEntry['valuesOffset'],
+							shape=( numberRows, numberColumns )
+						)
+
+			indexArray = pandas.DatetimeIndex( data=timeArray )
+			dataFrame  = pandas.DataFrame( index=indexArray, data=valuesArray, columns=tableEntry['columns'], copy=False )
+			dataFrames[ tableEntry['code'] ] = dataFrame
+
+		#json turns table codes into strings, restore the original keys
+		metaData = header['metaData']
+		tablesMetaData = metaData['tables'].values()
+		metaData['tables'] = {}
+		for tableMetaData in tablesMetaData:
+			metaData['tables'][ tableMetaData['code'] ] = tableMetaData
+
+		return metaData, dataFrames
+
+	def _readHeader(self,inputPath):
+
+		inputFile = open( inputPath, 'rb' )
+		try:
+			magic = inputFile.read( len(MAGIC) )
+			if magic != MAGIC:
+				raise IOError( "%s is not a database snapshot" % ( inputPath ) )
+			headerLength = struct.unpack( '<Q', inputFile.read( 8 ) )[0]
+			header = json.loads( inputFile.read( headerLength ) )
+		finally:
+			inputFile.close()
+
+		header['length'] = headerLength
+
+		return header
+
+	def _align(self,offset):
+
+		return ( offset + ALIGNMENT - 1 ) // ALIGNMENT * ALIGNMENT
@@ -18,7 +18,11 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
 import os
+import json
+import calendar
+import datetime
 import numpy
+import pandas
 import csv
 import tables
 
@@ -26,7 +30,7 @@ import zorron.util as util
 
 class ZNStorageEngine:
 
-	def createStorage(self):
+	def createStorage(self,parameters=None):
 		pass	
 
 	def createTable(self,tableMetaData,inMemoryData,storage,outputDirectory):
@@ -34,9 +38,15 @@ class ZNStorageEngine:
 
 class ZNPyTablesStorage:
 
-	def __init__(self):
+	def __init__(self,parameters=None):
+
+		#parameters: codec ('blosc','zlib','lzf'), level, chunkSize (rows)
+		#and partition ('year','month')
+		if parameters is None:
+			parameters = {}
 
 		self.hdf5Files  = {}
+		self.parameters = parameters
 	
 	def __del__(self):
 		
@@ -44,9 +54,17 @@ class ZNPyTablesStorage:
 			hdf5File.close()
 
 class ZNPyTablesStorageEngine(ZNStorageEngine):
+
+	codecs = [ 'blosc', 'zlib', 'lzf' ]
+	periods = [ 'year', 'month' ]
+
+	#layouts:
+	#	/table 				single table
+	#	/schema, /partitions/pYYYY[MM] 	one table per calendar period
+	#row arrays are positional, the timestamp is always the first column
 	
-	def createStorage(self):
-		return ZNPyTablesStorage()
+	def createStorage(self,parameters=None):
+		return ZNPyTablesStorage( self._loadLayout( parameters ) )
 	
 	def loadTableStorage(self,storage,tableCode, inputDirectory):
 
@@ -64,7 +82,7 @@ class ZNPyTablesStorageEngine(ZNStorageEngine):
 		for variable in tableMetaData['variables']:
 			columns[ '%s' % ( variable['code'] ) ] = tables.FloatCol()
 
-		table = hdf5File.create_table( hdf5File.root, 'table', columns )
+		self._initializeFile( hdf5File, columns, storage.parameters )
 
 		tableCode = tableMetaData['code']
 		storage.hdf5Files[tableCode] = hdf5File
@@ -78,10 +96,259 @@ class ZNPyTablesStorageEngine(ZNStorageEngine):
 		hdf5File.close()
 		del storage.hdf5Files[tableCode]
 		
+	def rewriteTable(self,storage,tableCode):
+
+		#copy the table with the storage layout and replace the file
+		hdf5File = storage.hdf5Files[tableCode]
+		inputPath = hdf5File.filename
+		columns = self._getSchema( hdf5File ).coldescrs
+		dataArray = self.getTableData( storage, tableCode )
+
+		temporaryPath = inputPath + '.tmp'
+		temporaryStorage = self.createStorage( storage.parameters )
+		newFile = tables.open_file( temporaryPath, 'w' )
+		temporaryStorage.hdf5Files[tableCode] = newFile
+		try:
+			self._initializeFile( newFile, columns, storage.parameters )
+			self.appendTableData( tableCode, dataArray, temporaryStorage )
+		finally:
+			del temporaryStorage.hdf5Files[tableCode]
+			newFile.close()
+
+		hdf5File.close()
+		os.rename( temporaryPath, inputPath )
+		storage.hdf5Files[tableCode] = tables.open_file( inputPath, mode='a' )
+
 	def getTableData(self,storage,tableCode):
 
 		hdf5File = storage.hdf5Files[tableCode]
-		table = hdf5File.get_node( hdf5File.root, 'table' )
+
+		return self._readFile( hdf5File )
+
+	def getTableDataRange(self,storage,tableCode,lowerBound=None,upperBound=None):
+
+		#rows with lowerBound <= timestamp <= upperBound (nanoseconds),
+		#only partitions overlapping the range are read
+		hdf5File = storage.hdf5Files[tableCode]
+		partitions = self._getPartitions( hdf5File )
+
+		if partitions is None:
+			dataArray = self._readTable( hdf5File.get_node( hdf5File.root, 'table' ) )
+		else:
+			period = hdf5File.root.partitions._v_attrs.period
+			selected = []
+			for key,table in partitions:
+				partitionStart, partitionEnd = self._getPartitionBounds( key, period )
+				if lowerBound is not None and partitionEnd <= lowerBound:
+					continue
+				if upperBound is not None and partitionStart > upperBound:
+					continue
+				selected.append( table )
+			dataArray = self._readTables( selected, self._getSchema( hdf5File ) )
+
+		timeArray = dataArray[:,0]
+		first = 0
+		last  = len(timeArray)
+		if lowerBound is not None:
+			first = numpy.searchsorted( timeArray, lowerBound, 'left' )
+		if upperBound is not None:
+			last  = numpy.searchsorted( timeArray, upperBound, 'right' )
+
+		return dataArray[first:last]
+
+	def getTableSize(self,storage,tableCode):
+
+		hdf5File = storage.hdf5Files[tableCode]
+		partitions = self._getPartitions( hdf5File )
+
+		if partitions is None:
+			return hdf5File.get_node( hdf5File.root, 'table' ).nrows
+
+		return sum( [ table.nrows for key,table in partitions ] )
+
+	def getLastTime(self,storage,tableCode):
+
+		#timestamp of the last row, None for an empty table
+		hdf5File = storage.hdf5Files[tableCode]
+		partitions = self._getPartitions( hdf5File )
+
+		if partitions is None:
+			tableArray = [ hdf5File.get_node( hdf5File.root, 'table' ) ]
+		else:
+			tableArray = [ table for key,table in partitions ]
+
+		for table in reversed( tableArray ):
+			if table.nrows > 0:
+				return int( table.cols.timestamp[ table.nrows - 1 ] )
+
+		return None
+
+	def getPartitionBounds(self,storage,tableCode,firstTime,lastTime):
+
+		#time range [lower,upper) of the partitions holding firstTime..lastTime
+		hdf5File = storage.hdf5Files[tableCode]
+		if self._getPartitions( hdf5File ) is None:
+			return None
+
+		period = hdf5File.root.partitions._v_attrs.period
+		keys = self._computePartitionKeys( numpy.array( [ firstTime, lastTime ] ), period )
+		lowerBound = self._getPartitionBounds( keys[0], period )[0]
+		upperBound = self._getPartitionBounds( keys[1], period )[1]
+
+		return lowerBound, upperBound
+
+	def replacePartitions(self,storage,tableCode,lowerBound,upperBound,dataArray,flush=True):
+
+		#drop the partitions inside [lowerBound,upperBound) and write dataArray
+		hdf5File = storage.hdf5Files[tableCode]
+		period = hdf5File.root.partitions._v_attrs.period
+
+		for key,table in self._getPartitions( hdf5File ):
+			partitionStart, partitionEnd = self._getPartitionBounds( key, period )
+			if partitionStart >= lowerBound and partitionEnd <= upperBound:
+				hdf5File.remove_node( table )
+
+		self.appendTableData( tableCode, dataArray, storage, flush )
+
+	def readTableData(self,inputDirectory):
+
+		#read a table without registering it in a storage
+		inputPath = os.path.join( inputDirectory, 'data.h5f' )
+		hdf5File = tables.open_file( inputPath, mode='r' )
+		try:
+			dataArray = self._readFile( hdf5File )
+		finally:
+			hdf5File.close()
+
+		return dataArray
+
+	def _loadLayout(self,parameters):
+
+		#layouts come from json, PyTables rejects unicode codec names
+		if parameters is None:
+			return None
+
+		parameters = dict( parameters )
+		if parameters.get( 'codec', None ) is not None:
+			parameters['codec'] = str( parameters['codec'] )
+			if parameters['codec'] not in self.codecs:
+				raise ValueError( "Unknown codec %s" % ( parameters['codec'] ) )
+
+		if parameters.get( 'partition', None ) is not None:
+			parameters['partition'] = str( parameters['partition'] )
+			if parameters['partition'] not in self.periods:
+				raise ValueError( "Unknown partition period %s" % ( parameters['partition'] ) )
+
+		return parameters
+
+	def _getLayout(self,parameters):
+
+		filters = None
+		codec = parameters.get( 'codec', None )
+		if codec is not None:
+			level = parameters.get( 'level', 5 )
+			filters = tables.Filters( complevel=int( level ), complib=str( codec ) )
+
+		chunkShape = None
+		if 'chunkSize' in parameters:
+			chunkShape = ( parameters['chunkSize'], )
+
+		return filters, chunkShape
+
+	def _initializeFile(self,hdf5File,columns,parameters):
+
+		period = parameters.get( 'partition', None )
+		if period is None:
+			self._createTableNode( hdf5File, hdf5File.root, 'table', columns, parameters )
+			return
+
+		#empty table keeping the column description
+		self._createTableNode( hdf5File, hdf5File.root, 'schema', columns, parameters )
+		group = hdf5File.create_group( hdf5File.root, 'partitions' )
+		group._v_attrs.period = period
+
+	def _createTableNode(self,hdf5File,where,name,columns,parameters):
+
+		filters, chunkShape = self._getLayout( parameters )
+		table = hdf5File.create_table( where, name, columns, filters=filters, chunkshape=chunkShape )
+
+		return table
+
+	def _getSchema(self,hdf5File):
+
+		if 'schema' in hdf5File.root:
+			return hdf5File.get_node( hdf5File.root, 'schema' )
+
+		return hdf5File.get_node( hdf5File.root, 'table' )
+
+	def _getPartitions(self,hdf5File):
+
+		#sorted list of ( key, table ), None for single table files
+		if 'partitions' not in hdf5File.root:
+			return None
+
+		partitions = []
+		for table in hdf5File.list_nodes( hdf5File.root.partitions ):
+			partitions.append( ( int( table._v_name[1:] ), table ) )
+		partitions.sort()
+
+		return partitions
+
+	def _computePartitionKeys(self,timeArray,period):
+
+		timeIndex = pandas.DatetimeIndex( data=timeArray.astype(numpy.int64) )
+		keys = numpy.asarray( timeIndex.year, dtype=numpy.int64 )
+		if period == 'month':
+			keys = keys * 100 + numpy.asarray( timeIndex.month, dtype=numpy.int64 )
+
+		return keys
+
+	def _getPartitionBounds(self,key,period):
+
+		#[start,end) of a partition in nanoseconds
+		key = int( key )
+		if period == 'year':
+			start = datetime.datetime( key, 1, 1 )
+			end   = datetime.datetime( key + 1, 1, 1 )
+		else:
+			year  = key // 100
+			month = key % 100
+			start = datetime.datetime( year, month, 1 )
+			if month == 12:
+				end = datetime.datetime( year + 1, 1, 1 )
+			else:
+				end = datetime.datetime( year, month + 1, 1 )
+
+		start = calendar.timegm( start.timetuple() ) * 1000000000
+		end   = calendar.timegm( end.timetuple() ) * 1000000000
+
+		return start, end
+
+	def _readFile(self,hdf5File):
+
+		partitions = self._getPartitions( hdf5File )
+		if partitions is None:
+			return self._readTable( hdf5File.get_node( hdf5File.root, 'table' ) )
+
+		partitionTables = [ table for key,table in partitions ]
+		return self._readTables( partitionTables, self._getSchema( hdf5File ) )
+
+	def _readTables(self,tableArray,schema):
+
+		numberRows = sum( [ table.nrows for table in tableArray ] )
+		numberColumns = len(schema.cols)
+		dataArray = numpy.zeros( shape = ( numberRows, numberColumns ) )
+
+		first = 0
+		for table in tableArray:
+			last = first + table.nrows
+			if last > first:
+				table.read( out=dataArray[first:last] )
+			first = last
+
+		return dataArray
+
+	def _readTable(self,table):
 
 		numberRows = table.nrows
 		numberColumns = len(table.cols)
@@ -90,26 +357,267 @@ class ZNPyTablesStorageEngine(ZNStorageEngine):
 				
 		return dataArray
 			
-	def deleteTableData(self,storage,tableCode,firstIndexRow,lastIndexRow):
+	def flushTable(self,storage,tableCode):
+
+		storage.hdf5Files[tableCode].flush()
+
+	def deleteTableData(self,storage,tableCode,firstIndexRow,lastIndexRow,flush=True):
 		
 		hdf5File = storage.hdf5Files[tableCode]
-		table = hdf5File.get_node( hdf5File.root, 'table' )
+		partitions = self._getPartitions( hdf5File )
+
+		if partitions is not None:
+
+			#map the row range onto the partitions
+			offset = 0
+			for key,table in partitions:
+				numberRows = table.nrows
+				first = max( firstIndexRow - offset, 0 )
+				last  = min( lastIndexRow - offset, numberRows - 1 )
+				if first <= last:
+					if first == 0 and last == numberRows - 1:
+						hdf5File.remove_node( table )
+					else:
+						table.remove_rows( first, last + 1 )
+				offset = offset + numberRows
 
-		if firstIndexRow == 0 and lastIndexRow == table.nrows - 1:
-			columnsDescription = table.coldescrs
-			hdf5File.remove_node( hdf5File.root, 'table')
-			hdf5File.flush()
-			hdf5File.create_table( hdf5File.root, 'table', columnsDescription )		
 		else:
-			table.remove_rows(firstIndexRow,lastIndexRow+1)
+			table = hdf5File.get_node( hdf5File.root, 'table' )
+
+			if firstIndexRow == 0 and lastIndexRow == table.nrows - 1:
+				columnsDescription = table.coldescrs
+				hdf5File.remove_node( hdf5File.root, 'table')
+				hdf5File.flush()
+				self._createTableNode( hdf5File, hdf5File.root, 'table', columnsDescription, storage.parameters )
+			else:
+				table.remove_rows(firstIndexRow,lastIndexRow+1)
 
-		hdf5File.flush()
+		if flush:
+			hdf5File.flush()
 	
-	def appendTableData(self,tableCode,dataArray,storage):
+	def appendTableData(self,tableCode,dataArray,storage,flush=True):
 
 		hdf5File = storage.hdf5Files[tableCode]	
-		table = hdf5File.get_node( hdf5File.root, 'table')
-		
-		table.append( dataArray )
+		partitions = self._getPartitions( hdf5File )
+
+		if partitions is None:
+			table = hdf5File.get_node( hdf5File.root, 'table')
+			table.append( dataArray )
+
+		elif len(dataArray) > 0:
+
+			#rows are sorted, so every partition is a contiguous block
+			period = hdf5File.root.partitions._v_attrs.period
+			columns = self._getSchema( hdf5File ).coldescrs
+			keys = self._computePartitionKeys( dataArray[:,0], period )
+			boundaries = numpy.flatnonzero( numpy.diff( keys ) ) + 1
+			starts = numpy.concatenate( ( [ 0 ], boundaries ) )
+			ends   = numpy.concatenate( ( boundaries, [ len(keys) ] ) )
+
+			for k in range( len(starts) ):
+				name = 'p%d' % ( keys[ starts[k] ] )
+				if name in hdf5File.root.partitions:
+					table = hdf5File.get_node( hdf5File.root.partitions, name )
+				else:
+					table = self._createTableNode( hdf5File, hdf5File.root.partitions, name, columns, storage.parameters )
+				table.append( dataArray[ starts[k]:ends[k] ] )
+
+		if flush:
+			hdf5File.flush()
+
+class ZNColumnStorage:
+
+	def __init__(self):
+
+		self.directories = {}
+		self.columnCodes = {}
+
+		#column files written without fsync since the last flush, by table
+		self.pendingPaths = {}
+
+class ZNColumnStorageEngine(ZNStorageEngine):
+
+	#each table keeps the timestamp and every variable in its own
+	#contiguous binary file, so single columns can be memory mapped
+	#(tables are still loaded whole into the data engine through getTableData)
+
+	def createStorage(self,parameters=None):
+		return ZNColumnStorage()
+
+	def loadTableStorage(self,storage,tableCode,inputDirectory):
+
+		columnsDirectory = os.path.join( inputDirectory, 'columns' )
+
+		inputPath = os.path.join( columnsDirectory, 'columns.js' )
+		inputFile = open( inputPath, 'r' )
+		columnCodes = json.load( inputFile )
+		inputFile.close()
+
+		storage.directories[tableCode] = columnsDirectory
+		storage.columnCodes[tableCode] = columnCodes
+
+	def createTable(self,tableMetaData,dataArray,storage,outputDirectory):
+
+		columnsDirectory = os.path.join( outputDirectory, 'columns' )
+		os.mkdir( columnsDirectory )
+
+		#column list
+		columnCodes = [ 'timestamp' ]
+		for variable in tableMetaData['variables']:
+			columnCodes.append( '%s' % ( variable['code'] ) )
+
+		outputPath = os.path.join( columnsDirectory, 'columns.js' )
+		outputFile = open( outputPath, 'w' )
+		json.dump( columnCodes, outputFile )
+		outputFile.close()
+
+		#empty columns
+		for columnCode in columnCodes:
+			open( self._getColumnPath( columnsDirectory, columnCode ), 'wb' ).close()
+
+		tableCode = tableMetaData['code']
+		storage.directories[tableCode] = columnsDirectory
+		storage.columnCodes[tableCode] = columnCodes
+
+		#load data
+		self.appendTableData( tableCode, dataArray, storage )
+
+	def removeTable(self,storage,tableCode):
+
+		del storage.directories[tableCode]
+		del storage.columnCodes[tableCode]
+		storage.pendingPaths.pop( tableCode, None )
+
+	def getTableSize(self,storage,tableCode):
+
+		inputPath = self._getColumnPath( storage.directories[tableCode], 'timestamp' )
+		return os.path.getsize( inputPath ) // 8
+
+	def getLastTime(self,storage,tableCode):
+
+		#timestamp of the last row, None for an empty table
+		timeArray = self.getColumnData( storage, tableCode, 'timestamp' )
+		if len(timeArray) == 0:
+			return None
+
+		return int( timeArray[-1] )
+
+	def getColumnData(self,storage,tableCode,columnCode,numberRows=None):
+
+		#read-only mapping, pages are shared through the os page cache
+		#numberRows defaults to the length of the timestamp column
+		if numberRows is None:
+			numberRows = self.getTableSize( storage, tableCode )
+		dtype = numpy.float64
+		if columnCode == 'timestamp':
+			dtype = numpy.int64
+
+		if numberRows == 0:
+			return numpy.zeros( 0, dtype=dtype )
+
+		inputPath = self._getColumnPath( storage.directories[tableCode], columnCode )
+		return numpy.memmap( inputPath, dtype=dtype, mode='r', shape=( numberRows, ) )
+
+	def getTableDataRange(self,storage,tableCode,lowerBound=None,upperBound=None):
+
+		#binary search on the mapped timestamps, only the range is read
+		timeArray = self.getColumnData( storage, tableCode, 'timestamp' )
+		first = 0
+		last  = len(timeArray)
+		if lowerBound is not None:
+			first = numpy.searchsorted( timeArray, lowerBound, 'left' )
+		if upperBound is not None:
+			last  = numpy.searchsorted( timeArray, upperBound, 'right' )
+
+		columnCodes = storage.columnCodes[tableCode]
+		dataArray = numpy.zeros( shape = ( last - first, len(columnCodes) ) )
+		for c in range( len(columnCodes) ):
+			dataArray[:,c] = self.getColumnData( storage, tableCode, columnCodes[c] )[first:last]
+
+		return dataArray
+
+	def getPartitionBounds(self,storage,tableCode,firstTime,lastTime):
+
+		return None
+
+	def getTableData(self,storage,tableCode):
+
+		columnCodes = storage.columnCodes[tableCode]
+		numberRows = self.getTableSize( storage, tableCode )
+
+		dataArray = numpy.zeros( shape = ( numberRows, len(columnCodes) ) )
+		for c in range( len(columnCodes) ):
+			dataArray[:,c] = self.getColumnData( storage, tableCode, columnCodes[c], numberRows )
+
+		return dataArray
+
+	def readTableData(self,inputDirectory):
+
+		storage = self.createStorage()
+		self.loadTableStorage( storage, None, inputDirectory )
+
+		return self.getTableData( storage, None )
+
+	def flushTable(self,storage,tableCode):
+
+		#column files are closed after every operation, reopened to be synced
+		for path in storage.pendingPaths.pop( tableCode, set() ):
+			columnFile = open( path, 'r+b' )
+			os.fsync( columnFile.fileno() )
+			columnFile.close()
+
+	def deleteTableData(self,storage,tableCode,firstIndexRow,lastIndexRow,flush=True):
+
+		columnsDirectory = storage.directories[tableCode]
+		columnCodes = storage.columnCodes[tableCode]
+		numberRows = self.getTableSize( storage, tableCode )
+
+		#rows after the deleted range, read before any column is truncated
+		tails = {}
+		if lastIndexRow < numberRows - 1:
+			for columnCode in columnCodes:
+				column = self.getColumnData( storage, tableCode, columnCode, numberRows )
+				tails[columnCode] = numpy.array( column[lastIndexRow+1:] )
+				del column
+
+		for columnCode in columnCodes:
+
+			path = self._getColumnPath( columnsDirectory, columnCode )
+			columnFile = open( path, 'r+b' )
+			columnFile.truncate( firstIndexRow * 8 )
+			if columnCode in tails:
+				columnFile.seek( 0, os.SEEK_END )
+				tails[columnCode].tofile( columnFile )
+			self._syncColumn( storage, tableCode, path, columnFile, flush )
+			columnFile.close()
+
+	def appendTableData(self,tableCode,dataArray,storage,flush=True):
+
+		columnsDirectory = storage.directories[tableCode]
+		columnCodes = storage.columnCodes[tableCode]
+
+		for c in range( len(columnCodes) ):
+
+			if columnCodes[c] == 'timestamp':
+				column = numpy.ascontiguousarray( dataArray[:,c], dtype=numpy.int64 )
+			else:
+				column = numpy.ascontiguousarray( dataArray[:,c], dtype=numpy.float64 )
+
+			path = self._getColumnPath( columnsDirectory, columnCodes[c] )
+			columnFile = open( path, 'ab' )
+			column.tofile( columnFile )
+			self._syncColumn( storage, tableCode, path, columnFile, flush )
+			columnFile.close()
+
+	def _syncColumn(self,storage,tableCode,path,columnFile,flush):
+
+		#synced now, or by the next flushTable of the batch
+		columnFile.flush()
+		if flush:
+			os.fsync( columnFile.fileno() )
+		else:
+			storage.pendingPaths.setdefault( tableCode, set() ).add( path )
+
+	def _getColumnPath(self,columnsDirectory,columnCode):
 
-		hdf5File.flush()
+		return os.path.join( columnsDirectory, '%s.bin' % ( columnCode ) )
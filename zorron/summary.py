@@ -0,0 +1,179 @@
+"""
+ZORRO-N - Meteorological Time Series DataBase Engine
+Copyright (C) 2014 - Ernesto Castillo Navarrete
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import numpy
+
+class ZNSummaryLevel:
+
+	def __init__(self,times,count,mean,squares,minimum,maximum):
+
+		#one row per year with rows, arrays are year x column
+		#squares: sum of squared deviations from the mean of the year
+		self.times	= times
+		self.count	= count
+		self.mean	= mean
+		self.squares	= squares
+		self.minimum	= minimum
+		self.maximum	= maximum
+
+	def head(self,position):
+
+		return ZNSummaryLevel(
+					self.times[:position],
+					self.count[:position],
+					self.mean[:position],
+					self.squares[:position],
+					self.minimum[:position],
+					self.maximum[:position]
+				)
+
+	def append(self,level):
+
+		return ZNSummaryLevel(
+					numpy.concatenate( ( self.times, level.times ) ),
+					numpy.concatenate( ( self.count, level.count ) ),
+					numpy.concatenate( ( self.mean, level.mean ) ),
+					numpy.concatenate( ( self.squares, level.squares ) ),
+					numpy.concatenate( ( self.minimum, level.minimum ) ),
+					numpy.concatenate( ( self.maximum, level.maximum ) )
+				)
+
+class ZNSummary:
+
+	def __init__(self,columns,samplingFrequency,aligned,firstTime,lastTime,yearlyLevel):
+
+		#aligned: every row is on the grid of samplingFrequency seconds from the first one
+		self.columns		= columns
+		self.samplingFrequency	= samplingFrequency
+		self.aligned		= aligned
+		self.firstTime		= firstTime
+		self.lastTime		= lastTime
+		self.yearlyLevel	= yearlyLevel
+
+		#statistics of the whole table by column
+		self.count, self.mean, self.squares = self._merge( yearlyLevel )
+		self.minimum = self._reduce( numpy.fmin, yearlyLevel.minimum )
+		self.maximum = self._reduce( numpy.fmax, yearlyLevel.maximum )
+
+	def getStandardDeviation(self):
+
+		#sample standard deviation, as pandas
+		variance = self.squares / numpy.maximum( self.count - 1, 1 )
+		return numpy.where( self.count > 1, numpy.sqrt( variance ), numpy.nan )
+
+	def getGridLength(self):
+
+		#rows of the table filled on its grid
+		return ( self.lastTime - self.firstTime ) // ( self.samplingFrequency * 10**9 ) + 1
+
+	def _merge(self,level):
+
+		#parallel combination of the yearly means and squared deviations (Chan et al.)
+		count = level.count.sum( axis=0 )
+		weights = numpy.maximum( count, 1 )
+		mean = ( level.count * level.mean ).sum( axis=0 ) / weights
+		deviations = level.mean - mean
+		squares = ( level.squares + level.count * deviations * deviations ).sum( axis=0 )
+		mean = numpy.where( count > 0, mean, numpy.nan )
+
+		return count, mean, squares
+
+	def _reduce(self,function,values):
+
+		if len(values) == 0:
+			result = numpy.empty( values.shape[1] )
+			result.fill( numpy.nan )
+			return result
+
+		return function.reduce( values, axis=0 )
+
+class ZNSummaryEngine:
+
+	def create(self,dataFrame,samplingFrequency):
+
+		if len(dataFrame) == 0:
+			return None
+
+		timeArray = dataFrame.index.asi8
+		yearlyLevel = self._summarizeRows( timeArray, dataFrame.values )
+
+		return ZNSummary( self._getColumns( dataFrame ), samplingFrequency, self._isAligned( timeArray, samplingFrequency ), timeArray[0], timeArray[-1], yearlyLevel )
+
+	def update(self,summary,dataFrame,samplingFrequency,firstTime):
+
+		#years from the first updated one, a new summary is returned
+		if summary is None or len(dataFrame) == 0:
+			return self.create( dataFrame, samplingFrequency )
+
+		timeArray = dataFrame.index.asi8
+		firstYear = numpy.array( [ firstTime ], dtype=numpy.int64 ).astype('datetime64[ns]').astype('datetime64[Y]')
+		firstYear = firstYear.astype('datetime64[ns]').astype(numpy.int64)[0]
+
+		position = numpy.searchsorted( timeArray, firstYear, 'left' )
+		yearPosition = numpy.searchsorted( summary.yearlyLevel.times, firstYear, 'left' )
+		yearlyLevel = summary.yearlyLevel.head( yearPosition ).append( self._summarizeRows( timeArray[position:], dataFrame.values[position:] ) )
+
+		return ZNSummary( self._getColumns( dataFrame ), samplingFrequency, self._isAligned( timeArray, samplingFrequency ), timeArray[0], timeArray[-1], yearlyLevel )
+
+	def _getColumns(self,dataFrame):
+
+		return [ '%s' % ( column ) for column in dataFrame.columns ]
+
+	def _isAligned(self,timeArray,samplingFrequency):
+
+		if samplingFrequency is None or samplingFrequency <= 0:
+			return False
+
+		return numpy.all( ( timeArray - timeArray[0] ) % ( samplingFrequency * 10**9 ) == 0 )
+
+	def _summarizeRows(self,timeArray,valuesArray):
+
+		numberColumns = valuesArray.shape[1]
+		if len(timeArray) == 0:
+			return ZNSummaryLevel(
+						numpy.zeros( 0, dtype=numpy.int64 ),
+						numpy.zeros( ( 0, numberColumns ), dtype=numpy.int64 ),
+						numpy.zeros( ( 0, numberColumns ) ),
+						numpy.zeros( ( 0, numberColumns ) ),
+						numpy.zeros( ( 0, numberColumns ) ),
+						numpy.zeros( ( 0, numberColumns ) )
+					)
+
+		#rows are sorted, a year starts where its time changes
+		years = timeArray.astype('datetime64[ns]').astype('datetime64[Y]').astype('datetime64[ns]').astype(numpy.int64)
+		starts = numpy.flatnonzero( numpy.concatenate( ( [ True ], years[1:] != years[:-1] ) ) )
+		sizes = numpy.diff( numpy.append( starts, len(years) ) )
+
+		validArray = ~numpy.isnan( valuesArray )
+		validValues = numpy.where( validArray, valuesArray, 0.0 )
+		count = numpy.add.reduceat( validArray.astype(numpy.int64), starts, axis=0 )
+		mean = numpy.add.reduceat( validValues, starts, axis=0 ) / numpy.maximum( count, 1 )
+
+		#two passes, deviations from the mean of each year
+		deviations = numpy.where( validArray, valuesArray - numpy.repeat( mean, sizes, axis=0 ), 0.0 )
+		squares = numpy.add.reduceat( deviations * deviations, starts, axis=0 )
+
+		return ZNSummaryLevel(
+					years[starts],
+					count,
+					mean,
+					squares,
+					numpy.fmin.reduceat( valuesArray, starts, axis=0 ),
+					numpy.fmax.reduceat( valuesArray, starts, axis=0 )
+				)
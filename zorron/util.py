@@ -62,13 +62,29 @@ def findSamplingFrequency(dataFrame):
 
 	#find sampling frequency
 	index = dataFrame.index.astype(numpy.int64)
-	if len(index) == 1:
+	if len(index) < 2:
         	return None
     	deltas= index[1:] - index[:-1]
 	samplingFrequencySeconds = (int) ( numpy.median( deltas ) / 1e9 )
 
 	return samplingFrequencySeconds
 
+def getSamplingFrequency(series):
+
+	#series of a request, from the table metadata when it is known
+	if 'samplingFrequency' in series:
+		return series['samplingFrequency']
+
+	return findSamplingFrequency( series['data'] )
+
+def calendarCodes(timeArray):
+
+	#month 0-11 and hour 0-23 of nanosecond timestamps
+	months = timeArray.astype('datetime64[ns]').astype('datetime64[M]').astype(numpy.int64) % 12
+	hours  = ( timeArray // ( 3600 * 10**9 ) ) % 24
+
+	return months, hours
+
 def parseStatisticFunction(functionParameters):
 
 	name = functionParameters['name']
@@ -93,6 +109,69 @@ def parseStatisticFunction(functionParameters):
 
 	return function	
 
+def reduceGroups(function,values,starts,ends,emptyValue=numpy.nan):
+
+	#function.reduceat over rows values[starts[k]:ends[k]], sorted groups
+	result = numpy.empty( ( len(starts), ) + values.shape[1:], dtype=numpy.float64 )
+	result.fill( emptyValue )
+
+	nonEmpty = ends > starts
+	if not numpy.any( nonEmpty ):
+		return result
+
+	#interleaved bounds, the reductions between groups are discarded
+	groupStarts = starts[nonEmpty]
+	groupEnds   = ends[nonEmpty]
+	indices = numpy.column_stack( ( groupStarts, groupEnds ) ).ravel()[:-1]
+	reduced = function.reduceat( values[:groupEnds[-1]], indices, axis=0 )[::2]
+	result[nonEmpty] = reduced
+
+	return result
+
+def calculateBins(timeArray,timeInterval):
+
+	#bins of pandas resample, closed left and labeled left, for sorted timestamps
+	#returns the bin of each timestamp from 0 and the bin labels, None if not supported
+	timeUnits = timeInterval['units']
+	timeCode  = timeInterval['code']
+
+	if len(timeArray) == 0:
+		return None
+
+	tickLengths = {
+			'Min' : 60 * 10**9,
+			'H' : 3600 * 10**9,
+			'D' : 86400 * 10**9
+		}
+
+	if timeCode in tickLengths:
+
+		#anchored at midnight when the interval divides a day, at the first timestamp otherwise
+		binLength = timeUnits * tickLengths[timeCode]
+		origin = timeArray[0]
+		if tickLengths['D'] % binLength == 0:
+			origin = timeArray[0] // tickLengths['D'] * tickLengths['D']
+
+		binIds = ( timeArray - origin ) // binLength
+		firstBin = binIds[0]
+		binIds = binIds - firstBin
+		numberBins = binIds[-1] + 1
+		labels = origin + ( firstBin + numpy.arange( numberBins, dtype=numpy.int64 ) ) * binLength
+
+	elif timeCode == 'MS':
+
+		#anchored at the first month
+		months = timeArray.astype('datetime64[ns]').astype('datetime64[M]').astype(numpy.int64)
+		binIds = ( months - months[0] ) // timeUnits
+		numberBins = binIds[-1] + 1
+		labels = months[0] + numpy.arange( numberBins, dtype=numpy.int64 ) * timeUnits
+		labels = labels.astype('datetime64[M]').astype('datetime64[ns]').astype(numpy.int64)
+
+	else:
+		return None
+
+	return binIds, labels
+
 def createDataFrame(dataArray,variableNames=None ):
 
 	timeArray = dataArray[:,0].astype(numpy.int64)
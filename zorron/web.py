@@ -21,12 +21,24 @@ import cherrypy
 import os
 
 from zorron.manager import ZNDefaultManager
+from zorron.concurrency import ZNConcurrencyManager
 
 class ZNWebServer(object):
 	
-	def __init__(self,dataBaseDirectory,temporaryDirectory):
+	def __init__(self,dataBaseDirectory,temporaryDirectory,configuration=None):
 		
-		self.manager = ZNDefaultManager(temporaryDirectory)
+		if configuration is None:
+			configuration = {}
+
+		#scheduler: requests run concurrently on pinned versions of the data,
+		#writes publish new versions without waiting for them
+		self.concurrencyManager = ZNConcurrencyManager( 
+								configuration.get( 'processors', 4 ),
+								configuration.get( 'queueSize', 64 ),
+								configuration.get( 'queueTimeout', None )
+							)
+
+		self.manager = ZNDefaultManager(temporaryDirectory,configuration)
 		print "Loading Database ..."
 		self.dataBase = self.manager.loadDataBase( dataBaseDirectory )
 		print "...done."
@@ -35,7 +47,7 @@ class ZNWebServer(object):
 	def handleRequest(self, request ):
 		
 		request = json.loads( request )
-		result = self.manager.requestData( self.dataBase, request )	
+		result = self.concurrencyManager.request( self.manager.requestData, self.dataBase, request )	
 
 		answer = None
 		if request['outputFormat']['type'] == 'json':